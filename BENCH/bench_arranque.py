@@ -0,0 +1,123 @@
+﻿# BENCH/bench_arranque.py
+"""
+Compara lo que paga cada fuente de /load antes de procesar su primer registro:
+
+- subprocess: intérprete nuevo + import de firebase_admin/grpc + (con credenciales)
+  initialize_app, cliente y primera lectura. Se paga en CADA carga.
+- inprocess: lo mismo se paga una vez al arrancar la API de carga; cada carga
+  posterior solo hace import_module (ya en caché) y reutiliza el cliente abierto.
+
+Uso (desde la raíz del proyecto):
+    python BENCH/bench_arranque.py [--repeticiones 5] [--fuente GAL] [--json salida.json]
+Si existe el fichero de credenciales se mide también la conexión y una lectura.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+CREDENTIALS_FILE = PROJECT_ROOT / "iei-proyecto-firebase-adminsdk-fbsvc-04d774ba06.json"
+
+MODULOS = {
+    "GAL": "GAL.extractor_gal",
+    "CAT": "CAT.extractor_cat",
+    "CV": "CV.extractor_cv",
+}
+
+
+def script_arranque(modulo: str, con_firestore: bool) -> str:
+    codigo = [
+        "import sys",
+        f"sys.path.insert(0, {str(PROJECT_ROOT)!r})",
+        f"import {modulo} as m",
+    ]
+    if con_firestore:
+        codigo += [
+            f"import os; os.chdir({str(PROJECT_ROOT)!r})",
+            "db = m.init_firestore()",
+            "list(db.collection('provincias').limit(1).stream())",
+        ]
+    return "; ".join(codigo)
+
+
+def medir_subprocess(modulo: str, con_firestore: bool, repeticiones: int) -> list[float]:
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", script_arranque(modulo, con_firestore)], check=True, cwd=str(PROJECT_ROOT))
+        tiempos.append(time.perf_counter() - t0)
+    return tiempos
+
+
+def medir_inprocess(modulo: str, con_firestore: bool, repeticiones: int) -> tuple[float, list[float]]:
+    """Devuelve (coste del primer uso en este proceso, costes de los usos siguientes)."""
+
+    def una_vez() -> None:
+        m = importlib.import_module(modulo)
+        if con_firestore:
+            db = m.init_firestore()  # initialize_app/firestore.client() ya cacheados tras la primera
+            list(db.collection("provincias").limit(1).stream())
+
+    t0 = time.perf_counter()
+    una_vez()
+    frio = time.perf_counter() - t0
+
+    calientes = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        una_vez()
+        calientes.append(time.perf_counter() - t0)
+    return frio, calientes
+
+
+def resumen(tiempos: list[float]) -> dict:
+    return {
+        "mediana_ms": round(statistics.median(tiempos) * 1000, 2),
+        "min_ms": round(min(tiempos) * 1000, 2),
+        "max_ms": round(max(tiempos) * 1000, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Arranque de extractores: subprocess vs en proceso")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--fuente", choices=sorted(MODULOS), default="GAL")
+    parser.add_argument("--json", dest="json_path", default=None, help="guardar el resultado en este fichero")
+    args = parser.parse_args()
+
+    modulo = MODULOS[args.fuente]
+    con_firestore = CREDENTIALS_FILE.exists()
+
+    sub = medir_subprocess(modulo, con_firestore, args.repeticiones)
+    frio, calientes = medir_inprocess(modulo, con_firestore, args.repeticiones)
+
+    resultado = {
+        "fuente": args.fuente,
+        "con_firestore": con_firestore,
+        "repeticiones": args.repeticiones,
+        "subprocess_por_carga": resumen(sub),
+        "inprocess_primer_uso": round(frio * 1000, 2),
+        "inprocess_por_carga": resumen(calientes),
+    }
+
+    print(f"[INFO] Fuente {args.fuente} ({'con' if con_firestore else 'sin'} conexión a Firestore)")
+    print(f"  subprocess, cada carga:     {resultado['subprocess_por_carga']['mediana_ms']:>10.2f} ms (mediana)")
+    print(f"  en proceso, primera vez:    {resultado['inprocess_primer_uso']:>10.2f} ms (una vez por proceso)")
+    print(f"  en proceso, cada carga:     {resultado['inprocess_por_carga']['mediana_ms']:>10.2f} ms (mediana)")
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(resultado, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
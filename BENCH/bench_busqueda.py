@@ -0,0 +1,372 @@
+﻿# BENCH/bench_busqueda.py
+"""
+Prueba de carga de GET /estaciones (BUSQUEDA/api_busqueda_itv.py) contra el almacén local:
+
+1. siembra un SQLite (COMUN/almacen.py) con N estaciones, N/4 localidades y las provincias de
+   GAL, CAT y CV, con los mismos campos que escriben los extractores (se reutiliza si ya existe);
+2. arranca la API de búsqueda en un proceso aparte apuntando a ese fichero;
+3. lanza una mezcla de consultas con --concurrencia clientes durante --duracion segundos:
+       provincia  ?provincia=Lugo
+       localidad  ?localidad=<trozo del nombre de una localidad>
+       cp         ?cp=<CP de una estación>
+       tipo       ?tipo=Estación Fija | Estación Móvil
+       todo       sin filtros
+4. mide aparte, consulta a consulta, las lecturas de documentos de cada tipo (contadores del
+   almacén en /health): son las que se facturarían en Firestore.
+
+Resultado: p50/p95/p99, consultas/s y lecturas por consulta (y por estación devuelta) de cada
+tipo, en JSON para comparar entre commits (--comparar).
+
+Uso (desde la raíz del proyecto):
+    python BENCH/bench_busqueda.py [--estaciones 10000] [--concurrencia 8] [--duracion 10]
+                                   [--mezcla provincia=3 localidad=3 cp=2 tipo=1 todo=1] [--json salida.json]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from BENCH.bench_carga import puerto_libre, rss_max_proceso_mb
+from BENCH.generar_datos import CAT_PROVINCIAS, CV_PREFIJOS, GAL_PROVINCIAS, ESTACIONES_POR_LOCALIDAD, nombre_localidad
+from COMUN import almacen
+
+TIPOS_CONSULTA = ["provincia", "localidad", "cp", "tipo", "todo"]
+MEZCLA_POR_DEFECTO = ["provincia=3", "localidad=3", "cp=2", "tipo=1", "todo=1"]
+# Cambia cuando cambia lo que se siembra: un almacén de otra versión no se reutiliza
+VERSION_SIEMBRA = 1
+ESPERA_API_SEGUNDOS = 30
+
+CV_LOCALIDADES = {
+    "Castellón": ["Castellón de la Plana", "Vila-real", "Vinaròs", "Benicarló"],
+    "Valencia": ["Valencia", "Torrent", "Gandia", "Paterna", "Sagunto", "Alzira"],
+    "Alicante": ["Alicante", "Elche", "Benidorm", "Alcoy", "Orihuela", "Dénia"],
+}
+
+
+def provincias_sembradas() -> dict[str, tuple[str, list[str]]]:
+    """Provincia -> (prefijo CP, nombres base de localidades), las de las tres comunidades."""
+    provincias = {p: (datos[0], datos[2]) for p, datos in {**GAL_PROVINCIAS, **CAT_PROVINCIAS}.items()}
+    provincias.update({p: (CV_PREFIJOS[p], nombres) for p, nombres in CV_LOCALIDADES.items()})
+    return provincias
+
+
+def sembrar(db, estaciones: int, semilla: int) -> dict:
+    """Escribe provincias, localidades y estaciones; devuelve lo necesario para generar consultas."""
+    rng = random.Random(semilla)
+    provincias = provincias_sembradas()
+    nombres_provincia = list(provincias)
+    lote = db.batch()
+    pendientes = 0
+
+    def escribir(coleccion: str, id_documento: str, datos: dict) -> None:
+        nonlocal lote, pendientes
+        lote.set(db.collection(coleccion).document(id_documento), datos)
+        pendientes += 1
+        if pendientes >= 500:
+            lote.commit()
+            lote, pendientes = db.batch(), 0
+
+    for i, nombre in enumerate(nombres_provincia, start=1):
+        escribir("provincias", f"{i:04d}", {"codigo": f"{i:04d}", "nombre": nombre})
+
+    localidades: dict[tuple[str, int], str] = {}
+    cps: list[str] = []
+    for n in range(estaciones):
+        provincia = nombres_provincia[n % len(nombres_provincia)]
+        p_codigo = f"{nombres_provincia.index(provincia) + 1:04d}"
+        prefijo, nombres = provincias[provincia]
+        m = n // (len(nombres_provincia) * ESTACIONES_POR_LOCALIDAD)
+        if (provincia, m) not in localidades:
+            l_codigo = f"{len(localidades) + 1:04d}"
+            localidades[(provincia, m)] = l_codigo
+            escribir("localidades", l_codigo, {
+                "codigo": l_codigo, "nombre": nombre_localidad(nombres, m).title(), "provincia_codigo": p_codigo,
+            })
+        l_codigo = localidades[(provincia, m)]
+        cp = f"{prefijo}{rng.randrange(1000):03d}"
+        cps.append(cp)
+        tipo = rng.choices(["Estación_fija", "Estación_movil", "Otros"], weights=[90, 7, 3])[0]
+        cod = f"{n + 1:05d}"
+        escribir("estaciones", cod, {
+            "nombre": f"Estación de {nombre_localidad(nombres, m).title()} {n}",
+            "cod_estacion": cod,
+            "direccion": f"Polígono industrial, parcela {n}",
+            "codigo_postal": cp,
+            "latitud": round(rng.uniform(38.0, 43.7), 6),
+            "longitud": round(rng.uniform(-9.2, 3.2), 6),
+            "tipo": tipo,
+            "descripcion": f"ITV en {nombre_localidad(nombres, m).title()}. Revisión anual.",
+            "horario": "L.V. 7:00-21:00",
+            "contacto": f"itv{n}@ejemplo.com",
+            "URL": "https://www.ejemplo.com",
+            "localidad_codigo": l_codigo,
+            "provincia_codigo": p_codigo,
+        })
+    if pendientes:
+        lote.commit()
+
+    return {
+        "version": VERSION_SIEMBRA,
+        "estaciones": estaciones,
+        "semilla": semilla,
+        "provincias": nombres_provincia,
+        "localidades": sorted({nombre_localidad(provincias[p][1], m) for p, m in localidades}),
+        "cps": sorted(set(cps)),
+    }
+
+
+def preparar_almacen(ruta: Path, estaciones: int, semilla: int) -> dict:
+    """Almacén sembrado. Si el fichero ya tiene esta siembra se reutiliza; si quedó a medias se
+    vuelve a sembrar encima (mismos ids con la misma semilla, así que no quedan restos)."""
+    db = almacen.almacen_sqlite(ruta)
+    marca = db.collection("bench").document("siembra").get()
+    if marca.exists:
+        datos = marca.to_dict()
+        if (datos["version"], datos["estaciones"], datos["semilla"]) == (VERSION_SIEMBRA, estaciones, semilla):
+            return datos
+        raise SystemExit(f"{ruta} tiene otra siembra ({datos['estaciones']} estaciones, semilla {datos['semilla']}); bórralo o usa otro --almacen")
+
+    print(f"[INFO] Sembrando {estaciones} estaciones en {ruta}...")
+    t0 = time.perf_counter()
+    datos = sembrar(db, estaciones, semilla)
+    db.collection("bench").document("siembra").set(datos)
+    print(f"[INFO] Sembrado en {time.perf_counter() - t0:.1f} s")
+    return datos
+
+
+def generar_parametros(tipo: str, siembra: dict, rng: random.Random) -> dict:
+    if tipo == "provincia":
+        return {"provincia": rng.choice(siembra["provincias"])}
+    if tipo == "localidad":
+        # Un trozo del nombre: desde el nombre entero (pocas localidades) a 3 letras (muchas)
+        nombre = rng.choice(siembra["localidades"]).lower()
+        largo = rng.randint(3, len(nombre))
+        inicio = rng.randint(0, len(nombre) - largo)
+        return {"localidad": nombre[inicio:inicio + largo]}
+    if tipo == "cp":
+        return {"cp": rng.choice(siembra["cps"])}
+    if tipo == "tipo":
+        return {"tipo": rng.choices(["Estación Fija", "Estación Móvil"], weights=[3, 1])[0]}
+    return {}
+
+
+def arrancar_api(ruta: Path, puerto: int) -> subprocess.Popen:
+    env = dict(os.environ, ITV_ALMACEN="sqlite", ITV_ALMACEN_SQLITE=str(ruta))
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "BUSQUEDA.api_busqueda_itv:app",
+         "--host", "127.0.0.1", "--port", str(puerto), "--log-level", "warning"],
+        cwd=str(PROJECT_ROOT), env=env,
+    )
+    limite = time.perf_counter() + ESPERA_API_SEGUNDOS
+    while time.perf_counter() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"La API de búsqueda ha terminado al arrancar (código {proceso.returncode})")
+        try:
+            requests.get(f"http://127.0.0.1:{puerto}/health", timeout=1)
+            return proceso
+        except requests.RequestException:
+            time.sleep(0.1)
+    proceso.terminate()
+    raise RuntimeError(f"La API de búsqueda no ha arrancado en el puerto {puerto}")
+
+
+def lecturas_servidor(base: str) -> int:
+    return requests.get(f"{base}/health", timeout=10).json()["almacen"]["lecturas"]
+
+
+def medir_lecturas(base: str, siembra: dict, tipos: list[str], muestras: int, limit: int, semilla: int) -> dict:
+    """Consultas de una en una: la diferencia de lecturas del almacén es solo de esa consulta."""
+    rng = random.Random(f"{semilla}-lecturas")
+    resultado = {}
+    with requests.Session() as sesion:
+        for tipo in tipos:
+            lecturas = devueltas = 0
+            for _ in range(muestras):
+                antes = lecturas_servidor(base)
+                params = {**generar_parametros(tipo, siembra, rng), "limit": limit}
+                devueltas += sesion.get(f"{base}/estaciones", params=params, timeout=60).json()["count"]
+                lecturas += lecturas_servidor(base) - antes
+            resultado[tipo] = {
+                "lecturas_por_consulta": round(lecturas / muestras, 1),
+                "devueltas_por_consulta": round(devueltas / muestras, 1),
+                "lecturas_por_devuelta": round(lecturas / devueltas, 2) if devueltas else None,
+            }
+    return resultado
+
+
+def lanzar_carga(base: str, siembra: dict, mezcla: dict[str, int], concurrencia: int,
+                 duracion: float, limit: int, semilla: int) -> tuple[dict[str, list[float]], dict[str, int], float]:
+    """(latencias en ms por tipo, errores por tipo, segundos reales) con 'concurrencia' clientes."""
+    tipos, pesos = list(mezcla), list(mezcla.values())
+    latencias: dict[str, list[float]] = {t: [] for t in tipos}
+    errores: dict[str, int] = {t: 0 for t in tipos}
+    lock = threading.Lock()
+    fin = time.perf_counter() + duracion
+
+    def cliente(k: int) -> None:
+        rng = random.Random(f"{semilla}-cliente-{k}")
+        with requests.Session() as sesion:
+            while time.perf_counter() < fin:
+                tipo = rng.choices(tipos, weights=pesos)[0]
+                params = {**generar_parametros(tipo, siembra, rng), "limit": limit}
+                t0 = time.perf_counter()
+                try:
+                    ok = sesion.get(f"{base}/estaciones", params=params, timeout=60).status_code == 200
+                except requests.RequestException:
+                    ok = False
+                ms = (time.perf_counter() - t0) * 1000
+                with lock:
+                    if ok:
+                        latencias[tipo].append(ms)
+                    else:
+                        errores[tipo] += 1
+
+    t0 = time.perf_counter()
+    hilos = [threading.Thread(target=cliente, args=(k,), daemon=True) for k in range(concurrencia)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return latencias, errores, time.perf_counter() - t0
+
+
+def percentiles(valores: list[float]) -> dict:
+    if not valores:
+        return {"consultas": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "media_ms": None, "max_ms": None}
+    cortes = statistics.quantiles(valores, n=100, method="inclusive") if len(valores) > 1 else [valores[0]] * 99
+    return {
+        "consultas": len(valores),
+        "p50_ms": round(cortes[49], 2),
+        "p95_ms": round(cortes[94], 2),
+        "p99_ms": round(cortes[98], 2),
+        "media_ms": round(statistics.fmean(valores), 2),
+        "max_ms": round(max(valores), 2),
+    }
+
+
+def parsear_mezcla(trozos: list[str]) -> dict[str, int]:
+    mezcla = {}
+    for trozo in trozos:
+        tipo, _, peso = trozo.partition("=")
+        if tipo not in TIPOS_CONSULTA:
+            raise SystemExit(f"Tipo de consulta desconocido: {tipo} ({', '.join(TIPOS_CONSULTA)})")
+        mezcla[tipo] = int(peso or 1)
+    return {t: p for t, p in mezcla.items() if p > 0}
+
+
+def comparar(anterior: dict, actual: dict) -> None:
+    print("[INFO] Comparado con la ejecución anterior (p95 y lecturas por consulta):")
+    for tipo, r in actual["tipos"].items():
+        previo = anterior.get("tipos", {}).get(tipo)
+        if not previo or not previo.get("p95_ms") or not r.get("p95_ms"):
+            continue
+        cambio = r["p95_ms"] / previo["p95_ms"] - 1
+        print(f"  {tipo:<10} p95 {previo['p95_ms']:>8.2f} -> {r['p95_ms']:>8.2f} ms ({cambio:+.1%})  "
+              f"lecturas {previo.get('lecturas_por_consulta')} -> {r.get('lecturas_por_consulta')}")
+    if anterior.get("consultas_por_segundo"):
+        cambio = actual["consultas_por_segundo"] / anterior["consultas_por_segundo"] - 1
+        print(f"  total      {anterior['consultas_por_segundo']:>8.1f} -> {actual['consultas_por_segundo']:>8.1f} consultas/s ({cambio:+.1%})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Latencia y lecturas de GET /estaciones bajo concurrencia (almacén SQLite sembrado)")
+    parser.add_argument("--estaciones", type=int, default=10_000)
+    parser.add_argument("--concurrencia", type=int, default=8, help="clientes simultáneos")
+    parser.add_argument("--duracion", type=float, default=10.0, help="segundos de carga")
+    parser.add_argument("--mezcla", nargs="+", default=MEZCLA_POR_DEFECTO, help="tipo=peso (provincia, localidad, cp, tipo, todo)")
+    parser.add_argument("--limit", type=int, default=500, help="limit de cada consulta (el de la API por defecto)")
+    parser.add_argument("--muestras-lecturas", type=int, default=20, help="consultas por tipo para contar lecturas")
+    parser.add_argument("--calentamiento", type=int, default=20, help="consultas sin medir antes de la carga")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--almacen", default=None, help="fichero SQLite (por defecto, en el directorio temporal)")
+    parser.add_argument("--json", dest="json_path", default=None, help="guardar el resultado en este fichero")
+    parser.add_argument("--comparar", default=None, help="resultado JSON de una ejecución anterior")
+    args = parser.parse_args()
+
+    mezcla = parsear_mezcla(args.mezcla)
+    ruta = Path(args.almacen) if args.almacen else (
+        Path(tempfile.gettempdir()) / f"itv_busqueda_v{VERSION_SIEMBRA}_{args.estaciones}_{args.semilla}.sqlite3")
+    siembra = preparar_almacen(ruta, args.estaciones, args.semilla)
+
+    puerto = puerto_libre()
+    base = f"http://127.0.0.1:{puerto}"
+    api = arrancar_api(ruta, puerto)
+    try:
+        # La primera consulta carga localidades/provincias en la caché de la API
+        t0 = time.perf_counter()
+        requests.get(f"{base}/estaciones", params={"limit": 1}, timeout=60).raise_for_status()
+        primera_ms = (time.perf_counter() - t0) * 1000
+        rng = random.Random(f"{args.semilla}-calentamiento")
+        for _ in range(args.calentamiento):
+            tipo = rng.choice(list(mezcla))
+            requests.get(f"{base}/estaciones", params={**generar_parametros(tipo, siembra, rng), "limit": args.limit}, timeout=60)
+
+        lecturas = medir_lecturas(base, siembra, list(mezcla), args.muestras_lecturas, args.limit, args.semilla)
+        print(f"[INFO] Carga: {args.concurrencia} clientes durante {args.duracion:.0f} s, mezcla {mezcla}")
+        latencias, errores, segundos = lanzar_carga(base, siembra, mezcla, args.concurrencia, args.duracion, args.limit, args.semilla)
+        rss_api = rss_max_proceso_mb(api.pid)
+    finally:
+        api.terminate()
+        api.wait(timeout=10)
+
+    total = sum(len(v) for v in latencias.values())
+    salida = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "estaciones": args.estaciones,
+        "localidades": len(siembra["localidades"]),
+        "concurrencia": args.concurrencia,
+        "duracion_s": round(segundos, 2),
+        "limit": args.limit,
+        "mezcla": mezcla,
+        "primera_consulta_ms": round(primera_ms, 2),
+        "consultas": total,
+        "errores": sum(errores.values()),
+        "consultas_por_segundo": round(total / segundos, 1) if segundos else None,
+        "api_rss_max_mb": rss_api,
+        "global": percentiles([ms for v in latencias.values() for ms in v]),
+        "tipos": {
+            tipo: {**percentiles(latencias[tipo]), "errores": errores[tipo], **lecturas[tipo]}
+            for tipo in mezcla
+        },
+    }
+
+    print(f"[INFO] {args.estaciones} estaciones, {salida['localidades']} localidades; primera consulta {primera_ms:.1f} ms")
+    print(f"  {'tipo':<10} {'consultas':>9} {'p50':>8} {'p95':>8} {'p99':>8}  {'lect/cons':>9} {'dev/cons':>8} {'lect/dev':>8}")
+    for tipo, r in salida["tipos"].items():
+        if not r["consultas"]:
+            print(f"  {tipo:<10} sin consultas correctas ({r['errores']} errores)")
+            continue
+        amplificacion = f"{r['lecturas_por_devuelta']:.2f}" if r["lecturas_por_devuelta"] is not None else "-"
+        print(f"  {tipo:<10} {r['consultas']:>9} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}  "
+              f"{r['lecturas_por_consulta']:>9.1f} {r['devueltas_por_consulta']:>8.1f} {amplificacion:>8}")
+    g = salida["global"]
+    print(f"  {'global':<10} {total:>9} {g['p50_ms'] or 0:>8.2f} {g['p95_ms'] or 0:>8.2f} {g['p99_ms'] or 0:>8.2f}  "
+          f"{salida['consultas_por_segundo']} consultas/s, {salida['errores']} errores")
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(salida, indent=2, ensure_ascii=False), encoding="utf-8")
+    if args.comparar:
+        comparar(json.loads(Path(args.comparar).read_text(encoding="utf-8")), salida)
+
+
+if __name__ == "__main__":
+    main()
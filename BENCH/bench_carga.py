@@ -0,0 +1,270 @@
+﻿# BENCH/bench_carga.py
+"""
+Benchmark de la carga completa, wrapper -> extractor -> almacén, por fuente y escala:
+
+1. genera las fuentes sintéticas de cada escala (BENCH/generar_datos.py; se reutilizan si ya existen);
+2. sirve ese directorio con el gateway de wrappers (GATEWAY/api_gateway.py) en un puerto libre;
+3. lanza cada extractor en un proceso nuevo contra un almacén local (COMUN/almacen.py) y mide:
+   registros/s, lecturas y escrituras del almacén por registro, RSS máximo del extractor,
+   segundos de cada etapa ([ETAPA]) y estaciones insertadas frente a las esperadas.
+
+Almacenes:
+- sqlite:    un fichero nuevo por escala, compartido por las tres fuentes (como una carga real GAL, CAT, CV).
+- memoria:   SQLite en memoria, uno por extractor (sin disco: solo el coste del pipeline).
+- firestore: el de las credenciales (o el emulador, con FIRESTORE_EMULATOR_HOST); las lecturas
+             no se pueden contar y las escrituras son las del escritor.
+
+Uso (desde la raíz del proyecto):
+    python BENCH/bench_carga.py [--escalas 1000 10000 100000] [--fuente GAL CAT CV] [--almacen sqlite]
+                                [--transporte ndjson|columnar] [--json salida.json] [--comparar anterior.json]
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from BENCH.bench_cat_xml import rss_max_mb
+from BENCH.generar_datos import MANIFIESTO, VERSION, generar
+from COMUN.progreso import parsear_linea
+
+EXTRACTORES = {
+    "GAL": ("GAL.extractor_gal", "ITV_GAL_API_BASE"),
+    "CAT": ("CAT.extractor_cat", "ITV_CAT_API_BASE"),
+    "CV": ("CV.extractor_cv", "ITV_CV_API_BASE"),
+}
+ESPERA_GATEWAY_SEGUNDOS = 30
+
+
+class Recolector(io.TextIOBase):
+    """stdout del extractor: se queda con las líneas [ETAPA]/[ESCRITOR]/[PROGRESO] y tira el resto."""
+
+    def __init__(self):
+        self._pendiente = ""
+        self.etapas: dict[str, float] = {}
+        self.escritor: dict[str, str] = {}
+        self.ultimo_progreso = ""   # hay una por registro: solo se parsea la última
+        self.lineas = 0
+
+    def write(self, texto: str) -> int:
+        lineas = (self._pendiente + texto).split("\n")
+        self._pendiente = lineas.pop()
+        for linea in lineas:
+            self.lineas += 1
+            if linea.startswith("[ETAPA]"):
+                campos = parsear_linea(linea)
+                self.etapas[campos["nombre"]] = self.etapas.get(campos["nombre"], 0.0) + float(campos["segundos"])
+            elif linea.startswith("[ESCRITOR]"):
+                self.escritor = parsear_linea(linea)
+            elif linea.startswith("[PROGRESO]"):
+                self.ultimo_progreso = linea
+        return len(texto)
+
+
+def medir(fuente: str, almacen_tipo: str) -> dict:
+    """Se ejecuta en un proceso nuevo (--medir): el RSS máximo y los imports son solo de este extractor."""
+    import importlib
+
+    from COMUN import almacen
+
+    recolector = Recolector()
+    t0 = time.perf_counter()
+    db = almacen.abrir() if almacen_tipo == "firestore" else almacen.almacen_sqlite()
+    modulo = importlib.import_module(EXTRACTORES[fuente][0])
+    with redirect_stdout(recolector):
+        modulo.main(db=db, forzar=True)
+    segundos = time.perf_counter() - t0
+
+    progreso = parsear_linea(recolector.ultimo_progreso)
+    leidos = int(progreso.get("procesados", 0))
+    insertadas = int(progreso.get("insertados", 0))
+    stats = db.stats() if hasattr(db, "stats") else {}
+    lecturas = stats.get("lecturas")
+    escrituras = stats.get("escrituras", int(recolector.escritor.get("escrituras", 0)))
+    return {
+        "registros": leidos,
+        "insertadas": insertadas,
+        "segundos": round(segundos, 3),
+        "registros_por_segundo": round(leidos / segundos, 1) if segundos else None,
+        "lecturas": lecturas,
+        "escrituras": escrituras,
+        "lecturas_por_registro": round(lecturas / leidos, 3) if leidos and lecturas is not None else None,
+        "escrituras_por_registro": round(escrituras / leidos, 3) if leidos else None,
+        "rss_max_mb": round(rss_max_mb() or 0.0, 1),
+        "etapas": {nombre: round(s, 3) for nombre, s in recolector.etapas.items()},
+        "lineas_log": recolector.lineas,
+    }
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_max_proceso_mb(pid: int) -> float | None:
+    """VmHWM de otro proceso (solo Linux); None si no se puede leer."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return round(int(linea.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def arrancar_gateway(datos: Path, puerto: int) -> subprocess.Popen:
+    """El gateway lee Estacions_ITV.csv/ITV-CAT.xml/estaciones.json del directorio en el que se lanza."""
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "GATEWAY.api_gateway:app", "--app-dir", str(PROJECT_ROOT),
+         "--host", "127.0.0.1", "--port", str(puerto), "--log-level", "warning"],
+        cwd=str(datos),
+    )
+    limite = time.perf_counter() + ESPERA_GATEWAY_SEGUNDOS
+    while time.perf_counter() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El gateway ha terminado al arrancar (código {proceso.returncode})")
+        try:
+            with socket.create_connection(("127.0.0.1", puerto), timeout=0.2):
+                return proceso
+        except OSError:
+            time.sleep(0.1)
+    proceso.terminate()
+    raise RuntimeError(f"El gateway no ha arrancado en el puerto {puerto}")
+
+
+def preparar_datos(directorio: Path, estaciones: int, sucias: float, semilla: int) -> dict:
+    """Manifiesto de la escala; solo se regeneran los ficheros si cambian los parámetros."""
+    ruta = directorio / MANIFIESTO
+    if ruta.exists():
+        manifiesto = json.loads(ruta.read_text(encoding="utf-8"))
+        parametros = (manifiesto.get("version"), manifiesto.get("estaciones"), manifiesto.get("sucias"), manifiesto.get("semilla"))
+        mismos = parametros == (VERSION, estaciones, sucias, semilla)
+        if mismos and all((directorio / f["fichero"]).exists() for f in manifiesto["fuentes"].values()):
+            return manifiesto
+    print(f"[INFO] Generando {estaciones} estaciones por fuente en {directorio}...")
+    return generar(directorio, estaciones, sucias, semilla)
+
+
+def medir_escala(args, estaciones: int) -> dict:
+    datos = Path(args.datos) / f"itv_{estaciones}"
+    manifiesto = preparar_datos(datos, estaciones, args.sucias, args.semilla)
+
+    env = dict(os.environ)
+    env.update({
+        "ITV_GEOCODIFICAR_RED": "0",     # CV: solo nomenclátor local (los CP sintéticos están en él)
+        "ITV_PROGRESO": "1",
+        "ITV_TRANSPORTE": args.transporte,
+    })
+    if args.almacen != "firestore":
+        env["ITV_ALMACEN"] = "sqlite"
+        if args.almacen == "memoria":
+            env["ITV_ALMACEN_SQLITE"] = ":memory:"
+        else:
+            ruta_sqlite = datos / "almacen.sqlite3"
+            for sufijo in ("", "-wal", "-shm"):
+                Path(f"{ruta_sqlite}{sufijo}").unlink(missing_ok=True)
+            env["ITV_ALMACEN_SQLITE"] = str(ruta_sqlite)
+
+    puerto = puerto_libre()
+    gateway = arrancar_gateway(datos, puerto)
+    resultado = {"estaciones": estaciones, "fuentes": {}}
+    try:
+        for fuente in args.fuente:
+            env_fuente = dict(env)
+            env_fuente[EXTRACTORES[fuente][1]] = f"http://127.0.0.1:{puerto}"
+            salida = subprocess.run(
+                [sys.executable, __file__, "--medir", fuente, "--almacen", args.almacen],
+                check=True, capture_output=True, text=True, cwd=str(PROJECT_ROOT), env=env_fuente,
+            ).stdout
+            r = json.loads(salida.strip().splitlines()[-1])
+            r["esperadas"] = manifiesto["fuentes"][fuente]["esperadas"]
+            r["bytes_fuente"] = manifiesto["fuentes"][fuente]["bytes"]
+            resultado["fuentes"][fuente] = r
+
+            aviso = "" if r["insertadas"] == r["esperadas"] else f"  [!] esperadas {r['esperadas']}"
+            lecturas = f"{r['lecturas_por_registro']:.3f}" if r["lecturas_por_registro"] is not None else "?"
+            print(f"  {fuente:<4} {r['registros']:>7} reg  {r['segundos']:>8.2f} s  {r['registros_por_segundo']:>9.1f} reg/s  "
+                  f"lect/reg {lecturas}  escr/reg {r['escrituras_por_registro']:.3f}  RSS {r['rss_max_mb']:>6.1f} MB  "
+                  f"insertadas {r['insertadas']}{aviso}")
+            etapas = "  ".join(f"{k}={v:.3f}" for k, v in r["etapas"].items())
+            print(f"       etapas: {etapas}")
+    finally:
+        resultado["gateway_rss_max_mb"] = rss_max_proceso_mb(gateway.pid)
+        gateway.terminate()
+        gateway.wait(timeout=10)
+    return resultado
+
+
+def comparar(anterior: dict, actual: dict) -> None:
+    """Diferencia de registros/s con otra ejecución guardada con --json (mismas escalas y fuentes)."""
+    previas = {
+        (e["estaciones"], fuente): r
+        for e in anterior.get("escalas", []) for fuente, r in e["fuentes"].items()
+    }
+    print("[INFO] Comparado con la ejecución anterior (registros/s):")
+    for escala in actual["escalas"]:
+        for fuente, r in escala["fuentes"].items():
+            previo = previas.get((escala["estaciones"], fuente))
+            if not previo or not previo.get("registros_por_segundo"):
+                continue
+            cambio = r["registros_por_segundo"] / previo["registros_por_segundo"] - 1
+            print(f"  {escala['estaciones']:>7} {fuente:<4} {previo['registros_por_segundo']:>9.1f} -> "
+                  f"{r['registros_por_segundo']:>9.1f} ({cambio:+.1%})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de carga wrapper -> extractor -> almacén con datos sintéticos")
+    parser.add_argument("--escalas", type=int, nargs="+", default=[1000, 10000], help="estaciones por fuente")
+    parser.add_argument("--fuente", nargs="+", choices=list(EXTRACTORES), default=list(EXTRACTORES))
+    parser.add_argument("--almacen", choices=["sqlite", "memoria", "firestore"], default="sqlite")
+    parser.add_argument("--transporte", choices=["ndjson", "columnar"], default="ndjson")
+    parser.add_argument("--sucias", type=float, default=0.05, help="fracción de filas sucias")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--datos", default=str(Path(tempfile.gettempdir()) / "itv_bench"), help="dónde generar las fuentes")
+    parser.add_argument("--json", dest="json_path", default=None, help="guardar el resultado en este fichero")
+    parser.add_argument("--comparar", default=None, help="resultado JSON de una ejecución anterior")
+    parser.add_argument("--medir", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        print(json.dumps(medir(args.medir, args.almacen)))
+        return
+
+    salida = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "almacen": args.almacen,
+        "transporte": args.transporte,
+        "sucias": args.sucias,
+        "semilla": args.semilla,
+        "escalas": [],
+    }
+    for estaciones in args.escalas:
+        print(f"[INFO] Escala {estaciones} estaciones por fuente (almacén {args.almacen}, transporte {args.transporte})")
+        salida["escalas"].append(medir_escala(args, estaciones))
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(salida, indent=2, ensure_ascii=False), encoding="utf-8")
+    if args.comparar:
+        comparar(json.loads(Path(args.comparar).read_text(encoding="utf-8")), salida)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+﻿# BENCH/bench_cat_xml.py
+"""
+Memoria del wrapper CAT al leer un XML grande:
+
+- iterparse: CAT.wrapper_cat.iterar_cat_xml (lo que sirve /cat/records/stream),
+  recorriendo los registros sin guardarlos.
+- dom: lo que se hacía antes, ET.parse del fichero entero + findall(".//row").
+
+Genera un XML sintético con la misma forma que ITV-CAT.xml (un <row> que envuelve
+los <row> de cada estación) del tamaño pedido, y mide cada modo en un proceso nuevo:
+RSS máximo y RSS muestreado cada 10% de los registros (con iterparse debe quedarse plano).
+
+Uso (desde la raíz del proyecto):
+    python BENCH/bench_cat_xml.py [--mb 300] [--xml ruta.xml] [--modos iterparse dom] [--json salida.json]
+El fichero generado se reutiliza si ya existe con ese tamaño (se borra con --limpiar).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from CAT.wrapper_cat import iterar_cat_xml
+
+FILA = """    <row _id="row-{n}" _uuid="00000000-0000-0000-0000-{n:012d}" _position="0" _address="https://analisi.transparenciacatalunya.cat/resource/_7dyp-y4dd/row-{n}">
+      <estaci>S{n}</estaci>
+      <denominaci>Estació sintètica {n}</denominaci>
+      <operador>APPLUS ITV</operador>
+      <adre_a>Carrer de prova {n}</adre_a>
+      <municipi>Cornellà de Llobregat</municipi>
+      <codi_municipi>080734</codi_municipi>
+      <tel_atenc_public>902930200</tel_atenc_public>
+      <lat>41357138</lat>
+      <long>2095921</long>
+      <geocoded_column>POINT (2095921 41357138)</geocoded_column>
+      <localitzador_a_google_maps url="http://maps.google.com/maps?t=k&amp;q=41.357138+2.095921" />
+      <serveis_territorials>Barcelona</serveis_territorials>
+      <horari_de_servei>De dilluns a dijous de 7 a 22h, divendres de 7 a 21h i dissabtes de 9 a 14h.</horari_de_servei>
+      <correu_electr_nic>www.applusiteuve.com</correu_electr_nic>
+      <web url="http://www.applusiteuve.com" />
+    </row>
+"""
+
+
+def generar_xml(ruta: Path, mb: int) -> int:
+    """Escribe filas hasta superar 'mb' megas; devuelve cuántas."""
+    objetivo = mb * 1024 * 1024
+    n = 0
+    with ruta.open("w", encoding="utf-8") as f:
+        f.write("<?xml version='1.0' encoding='utf-8'?>\n<response>\n  <row>\n")
+        while f.tell() < objetivo:
+            f.write("".join(FILA.format(n=n + k) for k in range(1000)))
+            n += 1000
+        f.write("  </row>\n</response>\n")
+    return n
+
+
+def rss_mb() -> float | None:
+    """RSS actual del proceso (psutil si está; si no, /proc en Linux)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def rss_max_mb() -> float | None:
+    try:
+        import resource
+        maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maximo / 2**20 if sys.platform == "darwin" else maximo / 1024   # bytes en macOS, KiB en Linux
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2**20   # Windows
+    except (ImportError, AttributeError):
+        return None
+
+
+def medir(modo: str, ruta: Path, total: int) -> dict:
+    """Se ejecuta en un proceso nuevo (--medir) para que el RSS máximo sea solo de este modo."""
+    import xml.etree.ElementTree as ET
+    from CAT.wrapper_cat import _registro_de_row
+
+    muestras = []
+    cada = max(1, total // 10)
+    base = rss_mb()
+    t0 = time.perf_counter()
+
+    if modo == "iterparse":
+        registros = iterar_cat_xml(ruta)
+    else:
+        root = ET.parse(ruta).getroot()
+        registros = (r for r in map(_registro_de_row, root.findall(".//row")) if r and "estaci" in r)
+
+    n = 0
+    for n, _ in enumerate(registros, start=1):
+        if n % cada == 0:
+            muestras.append(round(rss_mb() or 0.0, 1))
+
+    return {
+        "modo": modo,
+        "registros": n,
+        "segundos": round(time.perf_counter() - t0, 2),
+        "rss_inicial_mb": round(base, 1) if base is not None else None,
+        "rss_max_mb": round(rss_max_mb() or 0.0, 1),
+        "rss_cada_10pct_mb": muestras,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="RSS del wrapper CAT: iterparse vs DOM completo")
+    parser.add_argument("--mb", type=int, default=300, help="tamaño del XML sintético")
+    parser.add_argument("--xml", default=None, help="ruta del XML (por defecto, en el directorio temporal)")
+    parser.add_argument("--modos", nargs="+", choices=["iterparse", "dom"], default=["iterparse", "dom"])
+    parser.add_argument("--json", dest="json_path", default=None, help="guardar el resultado en este fichero")
+    parser.add_argument("--limpiar", action="store_true", help="borrar el XML generado al terminar")
+    parser.add_argument("--medir", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--total", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    ruta = Path(args.xml) if args.xml else Path(tempfile.gettempdir()) / f"itv_cat_{args.mb}mb.xml"
+
+    if args.medir:
+        print(json.dumps(medir(args.medir, ruta, args.total)))
+        return
+
+    if ruta.exists() and ruta.stat().st_size >= args.mb * 1024 * 1024:
+        total = sum(1 for _ in iterar_cat_xml(ruta))
+    else:
+        print(f"[INFO] Generando {ruta} ({args.mb} MB)...")
+        total = generar_xml(ruta, args.mb)
+    tam_mb = ruta.stat().st_size / 2**20
+    print(f"[INFO] {ruta}: {tam_mb:.0f} MB, {total} registros")
+
+    resultados = []
+    for modo in args.modos:
+        salida = subprocess.run(
+            [sys.executable, __file__, "--medir", modo, "--xml", str(ruta), "--total", str(total)],
+            check=True, capture_output=True, text=True, cwd=str(PROJECT_ROOT),
+        ).stdout
+        r = json.loads(salida.strip().splitlines()[-1])
+        resultados.append(r)
+        print(f"  {modo:<10} {r['segundos']:>7.2f} s  RSS máx {r['rss_max_mb']:>8.1f} MB  "
+              f"RSS cada 10%: {r['rss_cada_10pct_mb']}")
+
+    if args.json_path:
+        Path(args.json_path).write_text(
+            json.dumps({"xml_mb": round(tam_mb, 1), "registros": total, "resultados": resultados}, indent=2),
+            encoding="utf-8",
+        )
+    if args.limpiar:
+        ruta.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+﻿# BENCH/bench_columnar.py
+"""
+Tamaño y tiempo de (de)codificación de los registros raw de cada fuente:
+
+- json:     lo que devuelve /x/records (una lista de objetos, como la serializa FastAPI).
+- ndjson:   /x/records/stream (un objeto por línea).
+- columnar: /x/records con Accept: application/x-msgpack (COMUN/columnar.py).
+
+Los registros se sacan de los ficheros reales con los lectores de los wrappers y se
+repiten hasta --filas; los campos que en la fuente son (casi) distintos en cada estación
+(nombre, dirección, id...) se numeran para que no se repitan también en la muestra.
+
+Uso (desde la raíz del proyecto):
+    python BENCH/bench_columnar.py [--filas 100000] [--fuente GAL CAT CV] [--repeticiones 3] [--json salida.json]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from CAT.wrapper_cat import leer_cat_xml
+from COMUN import columnar, ndjson
+from CV.wrapper_cv import leer_cv_json
+from GAL.wrapper_gal import leer_gal_csv
+
+FUENTES = {
+    "GAL": (leer_gal_csv, PROJECT_ROOT / "Estacions_ITV.csv"),
+    "CAT": (leer_cat_xml, PROJECT_ROOT / "ITV-CAT.xml"),
+    "CV": (leer_cv_json, PROJECT_ROOT / "estaciones.json"),
+}
+
+
+def muestra(base: list[dict], filas: int) -> list[dict]:
+    """'filas' registros a partir de los reales, numerando los campos que casi no se repiten en la fuente."""
+    unicos = {
+        k for k in base[0]
+        if all(isinstance(r.get(k), str) for r in base) and len({r.get(k) for r in base}) * 4 >= len(base) * 3
+    }
+    registros = []
+    for n in range(filas):
+        r = dict(base[n % len(base)])
+        for k in unicos:
+            r[k] = f"{r[k]} {n}"
+        registros.append(r)
+    return registros
+
+
+def cronometrar(fn, repeticiones: int) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - t0)
+    return round(statistics.median(tiempos) * 1000, 1)
+
+
+def medir_fuente(registros: list[dict], repeticiones: int) -> list[dict]:
+    como_json = json.dumps(registros, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    como_ndjson = b"".join(ndjson.codificar(registros))
+    resultados = [
+        {
+            "formato": "json",
+            "bytes": len(como_json),
+            "codificar_ms": cronometrar(lambda: json.dumps(registros, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), repeticiones),
+            "decodificar_ms": cronometrar(lambda: json.loads(como_json), repeticiones),
+        },
+        {
+            "formato": "ndjson",
+            "bytes": len(como_ndjson),
+            "codificar_ms": cronometrar(lambda: b"".join(ndjson.codificar(registros)), repeticiones),
+            "decodificar_ms": cronometrar(lambda: list(ndjson.decodificar(como_ndjson.splitlines())), repeticiones),
+        },
+    ]
+    if columnar.DISPONIBLE:
+        como_columnar = columnar.codificar(registros)
+        assert list(columnar.decodificar(como_columnar)[1]) == registros
+        resultados.append({
+            "formato": "columnar",
+            "bytes": len(como_columnar),
+            "codificar_ms": cronometrar(lambda: columnar.codificar(registros), repeticiones),
+            # Hasta tener todos los dicts montados, igual que json.loads
+            "decodificar_ms": cronometrar(lambda: list(columnar.decodificar(como_columnar)[1]), repeticiones),
+            # Solo las columnas (lo que se paga antes de entregar el primer registro)
+            "decodificar_columnas_ms": cronometrar(lambda: columnar.decodificar(como_columnar), repeticiones),
+        })
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Transporte de registros raw: JSON vs NDJSON vs columnar (msgpack)")
+    parser.add_argument("--filas", type=int, default=100_000)
+    parser.add_argument("--fuente", nargs="+", choices=sorted(FUENTES), default=["GAL", "CAT", "CV"])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--json", dest="json_path", default=None, help="guardar el resultado en este fichero")
+    args = parser.parse_args()
+
+    if not columnar.DISPONIBLE:
+        print("[WARN] msgpack no está instalado: solo se mide JSON/NDJSON (pip install msgpack)")
+
+    salida = {"filas": args.filas, "repeticiones": args.repeticiones, "fuentes": {}}
+    for fuente in args.fuente:
+        lector, ruta = FUENTES[fuente]
+        base = lector(ruta)
+        if not base:
+            print(f"[WARN] {fuente}: no hay registros en {ruta}; se omite")
+            continue
+        resultados = medir_fuente(muestra(base, args.filas), args.repeticiones)
+        salida["fuentes"][fuente] = resultados
+
+        referencia = resultados[0]["bytes"]
+        print(f"[INFO] {fuente}: {args.filas} registros (a partir de {len(base)} reales)")
+        for r in resultados:
+            extra = f"  (solo columnas {r['decodificar_columnas_ms']:>7.1f} ms)" if "decodificar_columnas_ms" in r else ""
+            print(f"  {r['formato']:<9} {r['bytes'] / 2**20:>7.2f} MB ({r['bytes'] / referencia:>5.1%})  "
+                  f"codificar {r['codificar_ms']:>7.1f} ms  decodificar {r['decodificar_ms']:>7.1f} ms{extra}")
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(salida, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+﻿# BENCH/generar_datos.py
+"""
+Fuentes sintéticas para los benchmarks de carga: Estacions_ITV.csv (GAL), ITV-CAT.xml (CAT)
+y estaciones.json (CV) con el formato de los ficheros reales y el número de estaciones pedido.
+
+Una fracción de las filas (--sucias) sale "sucia" a propósito, repartida entre los casos que
+valida cada extractor (provincia vacía o de otra comunidad, CP mal formado o de otra provincia,
+sin coordenadas, duplicados, móviles...). Algunos casos se cargan igualmente (alias de provincia,
+CP sin el cero, contacto inválido) y otros se descartan: manifiesto.json dice cuántas filas hay
+de cada caso y cuántas estaciones debería insertar cada extractor en un almacén vacío.
+
+Los CP de CV salen del nomenclátor local (CV/datos/nomenclator_cp.csv), así que se geocodifican
+sin red (ITV_GEOCODIFICAR_RED=0).
+
+Uso (desde la raíz del proyecto):
+    python BENCH/generar_datos.py --estaciones 10000 --salida /tmp/itv_10000 [--sucias 0.05] [--semilla 1]
+Los wrappers leen los ficheros del directorio desde el que se lanzan: basta con arrancarlos allí
+(es lo que hace BENCH/bench_carga.py).
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import random
+import sys
+from pathlib import Path
+from typing import Callable, Iterator
+from xml.sax.saxutils import escape, quoteattr
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from CV.nomenclator import NOMENCLATOR_CSV
+
+FICHEROS = {
+    "GAL": "Estacions_ITV.csv",
+    "CAT": "ITV-CAT.xml",
+    "CV": "estaciones.json",
+}
+MANIFIESTO = "manifiesto.json"
+# Cambia cuando cambian las filas generadas: los datos de otra versión no se reutilizan
+VERSION = 1
+ESTACIONES_POR_LOCALIDAD = 4
+
+# Casos sucios de cada fuente -> ¿el extractor la guarda igualmente?
+CASOS = {
+    "GAL": {
+        "provincia_vacia": False,
+        "provincia_invalida": False,
+        "provincia_alias": True,
+        "concello_vacio": False,
+        "cp_formato": False,
+        "cp_otra_provincia": False,
+        "sin_coordenadas": False,
+        "coordenadas_fuera_de_rango": False,
+        "duplicado": False,
+        "campos_vacios": True,
+    },
+    "CAT": {
+        "duplicado": False,
+        "provincia_invalida": False,
+        "provincia_alias": True,
+        "municipio_vacio": False,
+        "cp_corto": True,
+        "sin_cp": False,
+        "coordenadas_fuera": False,
+        "coordenadas_vacias": False,
+        "movil_sin_coordenadas": True,
+        "contacto_invalido": True,
+    },
+    "CV": {
+        "duplicado": False,
+        "provincia_invalida": False,
+        "provincia_alias": True,
+        "municipio_vacio": False,
+        "cp_formato": False,
+        "cp_sin_cero": False,
+        "cp_otra_provincia": False,
+        "sin_numero": False,
+        "sin_coordenadas": False,
+        "movil": True,
+        "agricola": True,
+    },
+}
+
+GAL_PROVINCIAS = {
+    # provincia: (prefijo CP, alias que normaliza el extractor, concellos, (lat min, lat max), (lon min, lon max))
+    "A Coruña": ("15", "Coruña", ["Arteixo", "Carballo", "Ferrol", "Narón", "Ribeira", "Santiago", "Betanzos"], (42.6, 43.7), (-9.2, -7.7)),
+    "Lugo": ("27", "lugo", ["Viveiro", "Monforte", "Sarria", "Vilalba", "Burela", "Chantada"], (42.4, 43.7), (-7.9, -6.9)),
+    "Ourense": ("32", "Orense", ["Verín", "Xinzo", "Carballiño", "Ribadavia", "Celanova", "Barco"], (41.9, 42.5), (-8.3, -6.9)),
+    "Pontevedra": ("36", "pontevedra", ["Vigo", "Lalín", "Porriño", "Cangas", "Tui", "Estrada"], (42.0, 42.8), (-8.9, -8.0)),
+}
+CAT_PROVINCIAS = {
+    "Barcelona": ("08", "barcelona", ["Cornellà", "Sabadell", "Terrassa", "Mataró", "Manresa", "Vic"], (41.2, 42.2), (1.4, 2.8)),
+    "Girona": ("17", "GIRONA", ["Figueres", "Blanes", "Olot", "Palafrugell", "Ripoll"], (41.7, 42.4), (2.1, 3.2)),
+    "Lleida": ("25", "Lérida", ["Tàrrega", "Balaguer", "Mollerussa", "Solsona", "Tremp"], (41.4, 42.6), (0.4, 1.6)),
+    "Tarragona": ("43", "tarragona", ["Reus", "Valls", "Tortosa", "Amposta", "Cambrils"], (40.6, 41.4), (0.2, 1.6)),
+}
+CV_ALIAS = {"Castellón": "castellon", "Valencia": "VALENCIA", "Alicante": "alicante"}
+CV_PREFIJOS = {"Castellón": "12", "Valencia": "46", "Alicante": "03"}
+
+
+def reparto_sucias(total: int, fraccion: float, casos: list[str], rng: random.Random) -> dict[int, str]:
+    """Fila -> caso sucio: round(total * fraccion) filas, los casos por turnos. Nunca la fila 0 (la de los duplicados)."""
+    n = min(max(total - 1, 0), round(total * fraccion))
+    filas = rng.sample(range(1, total), n) if n else []
+    return {fila: casos[k % len(casos)] for k, fila in enumerate(sorted(filas))}
+
+
+def nombre_localidad(nombres: list[str], m: int) -> str:
+    """Localidad m-ésima de una provincia: los nombres reales y, cuando se acaban, numerados ("Vigo 3")."""
+    return f"{nombres[m % len(nombres)]} {m // len(nombres)}"
+
+
+def grados_minutos(valor: float) -> str:
+    """-8.2861 -> "-8° 17.165'" (el formato de COORDENADAS GMAPS)."""
+    grados = int(valor)
+    minutos = abs(valor - grados) * 60
+    signo = "-" if valor < 0 and grados == 0 else ""
+    return f"{signo}{grados}° {minutos:.3f}'"
+
+
+def filas_gal(total: int, sucias: dict[int, str], rng: random.Random) -> Iterator[dict[str, str]]:
+    provincias = list(GAL_PROVINCIAS)
+    primera = ""   # los duplicados repiten el nombre de la fila 0, que nunca es sucia
+    for n in range(total):
+        provincia = provincias[n % len(provincias)]
+        prefijo, alias, concellos, lat, lon = GAL_PROVINCIAS[provincia]
+        concello = nombre_localidad(concellos, n // (len(provincias) * ESTACIONES_POR_LOCALIDAD))
+        fila = {
+            "NOME DA ESTACIÓN": f"Estación ITV de {concello} ({n})",
+            "ENDEREZO": f"Polígono industrial, parcela {n}",
+            "CONCELLO": concello,
+            "CÓDIGO POSTAL": f"{prefijo}{rng.randrange(1000):03d}",
+            "PROVINCIA": provincia,
+            "TELÉFONO": f"881 {rng.randrange(1000):03d} {rng.randrange(1000):03d}",
+            "HORARIO": "de 8:00 a 21:00 horas (de luns a venres) e de 8:00 a 14:30 horas (sábados)",
+            "SOLICITUDE DE CITA PREVIA": f"https://www.sycitv.com/gl/cita-previa-particulares/?estacion={n}",
+            "CORREO ELECTRÓNICO": f"estacion{n}@sycitv.com",
+            "COORDENADAS GMAPS": f"{grados_minutos(rng.uniform(*lat))}, {grados_minutos(rng.uniform(*lon))}",
+        }
+        primera = primera or fila["NOME DA ESTACIÓN"]
+        caso = sucias.get(n)
+        if caso == "provincia_vacia":
+            fila["PROVINCIA"] = ""
+        elif caso == "provincia_invalida":
+            fila["PROVINCIA"] = "Madrid"
+        elif caso == "provincia_alias":
+            fila["PROVINCIA"] = alias
+        elif caso == "concello_vacio":
+            fila["CONCELLO"] = ""
+        elif caso == "cp_formato":
+            fila["CÓDIGO POSTAL"] = fila["CÓDIGO POSTAL"][:4]
+        elif caso == "cp_otra_provincia":
+            fila["CÓDIGO POSTAL"] = "28" + fila["CÓDIGO POSTAL"][2:]
+        elif caso == "sin_coordenadas":
+            fila["COORDENADAS GMAPS"] = ""
+        elif caso == "coordenadas_fuera_de_rango":
+            fila["COORDENADAS GMAPS"] = f"95° 0.000', {grados_minutos(rng.uniform(*lon))}"
+        elif caso == "duplicado":
+            fila["NOME DA ESTACIÓN"] = primera
+        elif caso == "campos_vacios":
+            fila["HORARIO"] = fila["CORREO ELECTRÓNICO"] = fila["SOLICITUDE DE CITA PREVIA"] = ""
+        yield fila
+
+
+def escribir_gal(ruta: Path, total: int, sucias: dict[int, str], rng: random.Random) -> None:
+    with ruta.open("w", encoding="utf-8", newline="") as f:
+        escritor = None
+        for fila in filas_gal(total, sucias, rng):
+            if escritor is None:
+                escritor = csv.DictWriter(f, fieldnames=list(fila), delimiter=";")
+                escritor.writeheader()
+            escritor.writerow(fila)
+
+
+def filas_cat(total: int, sucias: dict[int, str], rng: random.Random) -> Iterator[dict[str, str]]:
+    provincias = list(CAT_PROVINCIAS)
+    for n in range(total):
+        provincia = provincias[n % len(provincias)]
+        prefijo, alias, municipios, lat, lon = CAT_PROVINCIAS[provincia]
+        municipio = nombre_localidad(municipios, n // (len(provincias) * ESTACIONES_POR_LOCALIDAD))
+        lat_e6, lon_e6 = round(rng.uniform(*lat) * 1e6), round(rng.uniform(*lon) * 1e6)
+        fila = {
+            "estaci": f"S{n}",
+            "denominaci": f"{municipio} ({n})",
+            "operador": "APPLUS ITV",
+            "adre_a": f"Carrer de prova {n}",
+            "cp": f"{prefijo}{rng.randrange(1000):03d}",
+            "municipi": municipio,
+            "codi_municipi": f"{n:06d}",
+            "tel_atenc_public": f"93{rng.randrange(10**7):07d}",
+            "lat": str(lat_e6),
+            "long": str(lon_e6),
+            "geocoded_column": f"POINT ({lon_e6} {lat_e6})",
+            "serveis_territorials": provincia,
+            "horari_de_servei": "De dilluns a divendres de 7 a 21h i dissabtes de 9 a 14h.",
+            "correu_electr_nic": f"estacio{n}@itv.cat",
+            "web": "http://www.applusiteuve.com",
+        }
+        caso = sucias.get(n)
+        if caso == "duplicado":
+            fila["estaci"] = "S0"
+        elif caso == "provincia_invalida":
+            fila["serveis_territorials"] = "Madrid"
+        elif caso == "provincia_alias":
+            fila["serveis_territorials"] = alias
+        elif caso == "municipio_vacio":
+            fila["municipi"] = ""
+        elif caso == "cp_corto":
+            fila["cp"] = fila["cp"].lstrip("0") if prefijo.startswith("0") else fila["cp"][:4]
+        elif caso == "sin_cp":
+            del fila["cp"]
+        elif caso == "coordenadas_fuera":
+            fila["lat"], fila["long"] = "40416775", "-3703790"
+            fila["geocoded_column"] = "POINT (-3703790 40416775)"
+        elif caso == "coordenadas_vacias":
+            del fila["lat"], fila["long"], fila["geocoded_column"]
+        elif caso == "movil_sin_coordenadas":
+            fila["denominaci"] = f"ITV mòbil {n}"
+            del fila["lat"], fila["long"], fila["geocoded_column"]
+        elif caso == "contacto_invalido":
+            fila["tel_atenc_public"] = ""
+            fila["correu_electr_nic"] = "www.applusiteuve.com"
+        yield fila
+
+
+def escribir_cat(ruta: Path, total: int, sucias: dict[int, str], rng: random.Random) -> None:
+    """Mismo esqueleto que ITV-CAT.xml: <response><row> que envuelve un <row> por estación."""
+    with ruta.open("w", encoding="utf-8") as f:
+        f.write("<?xml version='1.0' encoding='utf-8'?>\n<response>\n  <row>\n")
+        for n, fila in enumerate(filas_cat(total, sucias, rng)):
+            f.write(f'    <row _id="row-{n}" _uuid="00000000-0000-0000-0000-{n:012d}" _position="0">\n')
+            for campo, valor in fila.items():
+                if campo == "web":
+                    f.write(f"      <web url={quoteattr(valor)} />\n")
+                else:
+                    f.write(f"      <{campo}>{escape(valor)}</{campo}>\n")
+            f.write("    </row>\n")
+        f.write("  </row>\n</response>\n")
+
+
+def codigos_postales_cv() -> dict[str, list[tuple[str, str]]]:
+    """Provincia -> [(cp, municipio)] del nomenclátor (así las estaciones se geocodifican sin red)."""
+    por_provincia: dict[str, list[tuple[str, str]]] = {p: [] for p in CV_PREFIJOS}
+    with open(NOMENCLATOR_CSV, encoding="utf-8-sig", newline="") as f:
+        for fila in csv.DictReader(f, delimiter=";"):
+            if fila["provincia"] in por_provincia:
+                por_provincia[fila["provincia"]].append((fila["cod_postal"], fila["municipio"]))
+    return por_provincia
+
+
+def filas_cv(total: int, sucias: dict[int, str], rng: random.Random) -> Iterator[dict]:
+    cps = codigos_postales_cv()
+    provincias = list(cps)
+    for n in range(total):
+        provincia = provincias[n % len(provincias)]
+        m = n // (len(provincias) * ESTACIONES_POR_LOCALIDAD)
+        cp, _ = cps[provincia][m % len(cps[provincia])]
+        fila = {
+            "TIPO ESTACIÓN": "Estación Fija",
+            "PROVINCIA": provincia,
+            "MUNICIPIO": nombre_localidad([m for _, m in cps[provincia]], m),
+            # Como en estaciones.json: número salvo que empiece por 0
+            "C.POSTAL": cp if cp.startswith("0") else int(cp),
+            "DIRECCIÓN": f"Pol. Ind. Sintético, parcela {n}",
+            "Nº ESTACIÓN": n + 1,
+            "HORARIOS": "L.V. 7:00-21:00 / S. 8:00-14:00",
+            "CORREO": f"itv{n}@sitval.com",
+        }
+        caso = sucias.get(n)
+        if caso == "duplicado":
+            fila["Nº ESTACIÓN"] = 1
+        elif caso == "provincia_invalida":
+            fila["PROVINCIA"] = "Murcia"
+        elif caso == "provincia_alias":
+            fila["PROVINCIA"] = CV_ALIAS[provincia]
+        elif caso == "municipio_vacio":
+            fila["MUNICIPIO"] = ""
+        elif caso == "cp_formato":
+            fila["C.POSTAL"] = "999999"
+        elif caso == "cp_sin_cero":
+            fila["PROVINCIA"], fila["C.POSTAL"] = "Alicante", 3001
+        elif caso == "cp_otra_provincia":
+            fila["C.POSTAL"] = "28" + str(cp)[2:]
+        elif caso == "sin_numero":
+            del fila["Nº ESTACIÓN"]
+        elif caso == "sin_coordenadas":
+            fila["C.POSTAL"] = f"{CV_PREFIJOS[provincia]}999"   # CP bien formado que no está en el nomenclátor
+        elif caso == "movil":
+            fila["TIPO ESTACIÓN"] = "Estación Móvil"
+        elif caso == "agricola":
+            fila["TIPO ESTACIÓN"] = "Estación Agrícola"
+        yield fila
+
+
+def escribir_cv(ruta: Path, total: int, sucias: dict[int, str], rng: random.Random) -> None:
+    """Una lista JSON como estaciones.json, escrita fila a fila."""
+    with ruta.open("w", encoding="utf-8") as f:
+        f.write("[")
+        for n, fila in enumerate(filas_cv(total, sucias, rng)):
+            f.write(("," if n else "") + "\n  " + json.dumps(fila, ensure_ascii=False))
+        f.write("\n]\n")
+
+
+ESCRITORES: dict[str, Callable[[Path, int, dict[int, str], random.Random], None]] = {
+    "GAL": escribir_gal,
+    "CAT": escribir_cat,
+    "CV": escribir_cv,
+}
+
+
+def generar(salida: Path | str, estaciones: int, sucias: float = 0.05, semilla: int = 1,
+            fuentes: list[str] | None = None) -> dict:
+    """Escribe las fuentes pedidas en 'salida' y devuelve el manifiesto (también en salida/manifiesto.json)."""
+    salida = Path(salida)
+    salida.mkdir(parents=True, exist_ok=True)
+    manifiesto = {"version": VERSION, "estaciones": estaciones, "sucias": sucias, "semilla": semilla, "fuentes": {}}
+    for fuente in fuentes or list(FICHEROS):
+        rng = random.Random(f"{semilla}-{fuente}")
+        casos = CASOS[fuente]
+        reparto = reparto_sucias(estaciones, sucias, list(casos), rng)
+        ruta = salida / FICHEROS[fuente]
+        ESCRITORES[fuente](ruta, estaciones, reparto, rng)
+
+        por_caso = {caso: 0 for caso in casos}
+        for caso in reparto.values():
+            por_caso[caso] += 1
+        descartadas = sum(n for caso, n in por_caso.items() if not casos[caso])
+        manifiesto["fuentes"][fuente] = {
+            "fichero": ruta.name,
+            "bytes": ruta.stat().st_size,
+            "filas": estaciones,
+            "sucias": por_caso,
+            "esperadas": estaciones - descartadas,
+        }
+    (salida / MANIFIESTO).write_text(json.dumps(manifiesto, indent=2, ensure_ascii=False), encoding="utf-8")
+    return manifiesto
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Genera fuentes GAL/CAT/CV sintéticas (con filas sucias) para los benchmarks")
+    parser.add_argument("--estaciones", type=int, default=1000, help="filas por fuente")
+    parser.add_argument("--salida", required=True, help="directorio donde escribir los ficheros")
+    parser.add_argument("--sucias", type=float, default=0.05, help="fracción de filas sucias (0-1)")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--fuente", nargs="+", choices=sorted(FICHEROS), default=list(FICHEROS))
+    args = parser.parse_args()
+
+    manifiesto = generar(args.salida, args.estaciones, args.sucias, args.semilla, args.fuente)
+    for fuente, info in manifiesto["fuentes"].items():
+        sucias = sum(info["sucias"].values())
+        print(f"[INFO] {fuente}: {info['fichero']} {info['bytes'] / 2**20:.1f} MB, {info['filas']} filas "
+              f"({sucias} sucias), {info['esperadas']} estaciones esperadas")
+
+
+if __name__ == "__main__":
+    main()
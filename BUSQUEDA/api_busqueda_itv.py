@@ -1,14 +1,27 @@
 ﻿from __future__ import annotations
 
+import base64
+import binascii
+import heapq
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Header, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
-import firebase_admin
-from firebase_admin import credentials, firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from COMUN import almacen, perfilado
+
+from .indice_espacial import IndiceEspacial
+from .metricas import PROMETHEUS_MEDIA_TYPE, Contador, Etapas, Histograma, Registro
 
 
 # ========= Config =========
@@ -16,7 +29,28 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 CREDENTIALS_FILE = BASE_DIR / "iei-proyecto-firebase-adminsdk-fbsvc-04d774ba06.json"
 
 DEFAULT_LIMIT = 500
-MAX_LIMIT = 2000
+MAX_LIMIT = 2000  # solo para la respuesta JSON; en NDJSON no hay tope
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Segundos que se consideran "frescas" las tablas localidades/provincias cacheadas
+LOOKUP_TTL_SECONDS = 300
+
+# Planificador de consultas: Firestore admite como mucho 30 valores en un filtro "in"
+IN_CHUNK_SIZE = 30
+# Con más trozos que esto se deja de usar "in" y se filtra por provincia_codigo
+MAX_IN_CHUNKS = 10
+QUERY_WORKERS = 8
+
+# Búsqueda geográfica
+GEO_CELDA_GRADOS = 0.1
+# Estaciones nuevas que se piden de una vez (get_all) al sincronizar el índice tras una carga
+GEO_SYNC_LOTE = 300
+DEFAULT_K = 10
+MAX_K = 500
+
+# Cabecera Server-Timing en GET /estaciones (tiempo de cada etapa, para la UI); desactivada por defecto
+SERVER_TIMING = os.getenv("ITV_SERVER_TIMING", "0") == "1"
 
 
 # ========= App =========
@@ -27,13 +61,35 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # Sin esto el navegador no deja leer Server-Timing a la UI (otro origen)
+    expose_headers=["Server-Timing", perfilado.CABECERA_FICHERO],
 )
+# X-Perfil: 1 -> perfil de la petición; GET /profiles (COMUN/perfilado.py)
+perfilado.instalar(app, "busqueda")
+
+
+# ========= Métricas (GET /metrics) =========
+registro_metricas = Registro()
+etapas_segundos = registro_metricas.registrar(Histograma(
+    "itv_busqueda_etapa_segundos",
+    "Duración de cada etapa de GET /estaciones (localidades/provincias solo al recargar la caché)",
+    ["etapa"],
+))
+consultas_total = registro_metricas.registrar(Contador(
+    "itv_busqueda_consultas_total", "Búsquedas en GET /estaciones por forma de consulta y plan", ["forma", "plan"],
+))
+leidos_total = registro_metricas.registrar(Contador(
+    "itv_busqueda_documentos_leidos_total",
+    "Estaciones leídas del almacén (incluidas las que descarta el post-filtro o la mezcla)", ["forma", "plan"],
+))
+devueltos_total = registro_metricas.registrar(Contador(
+    "itv_busqueda_documentos_devueltos_total", "Estaciones devueltas al cliente", ["forma", "plan"],
+))
 
 
 def get_db():
-    if not firebase_admin._apps:
-        firebase_admin.initialize_app(credentials.Certificate(str(CREDENTIALS_FILE)))
-    return firestore.client()
+    # Firestore o SQLite según ITV_ALMACEN (COMUN/almacen.py)
+    return almacen.abrir(CREDENTIALS_FILE)
 
 
 def to_float(x) -> Optional[float]:
@@ -61,19 +117,566 @@ def norm_tipo(ui_tipo: Optional[str]) -> Optional[str]:
     return t
 
 
+def codificar_cursor(ultimo_id: str) -> str:
+    """Cursor opaco para la página siguiente (por dentro: el último id devuelto)."""
+    raw = json.dumps({"after": ultimo_id}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> str:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        after = json.loads(raw.decode("utf-8"))["after"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="cursor no válido")
+    if not isinstance(after, str) or not after:
+        raise HTTPException(status_code=400, detail="cursor no válido")
+    return after
+
+
+def formatear_estacion(doc_id: str, e: dict, loc_by_codigo: dict[str, dict], prov_by_codigo: dict[str, dict]) -> dict:
+    """Estación tal y como la devuelve la API (con localidad/provincia SIEMPRE)."""
+    loc_codigo = str(e.get("localidad_codigo", "") or "")
+    loc_info = loc_by_codigo.get(loc_codigo, {})
+    loc_nombre = str(loc_info.get("nombre", "") or "")
+
+    prov_codigo = str(loc_info.get("provincia_codigo", "") or "")
+    prov_info = prov_by_codigo.get(prov_codigo, {})
+    prov_nombre = str(prov_info.get("nombre", "") or "")
+
+    return {
+        "id": doc_id,
+        "nombre": e.get("nombre", ""),
+        "tipo": e.get("tipo", ""),
+        "direccion": e.get("direccion", ""),
+        "localidad": loc_nombre,
+        "provincia": prov_nombre,
+        "codigo_postal": e.get("codigo_postal", ""),
+        "descripcion": e.get("descripcion", ""),
+        "horario": e.get("horario", ""),
+        "contacto": e.get("contacto", ""),
+        "URL": e.get("URL", ""),
+        "latitud": to_float(e.get("latitud")),
+        "longitud": to_float(e.get("longitud")),
+    }
+
+
+def cargar_tablas(db) -> tuple[dict[str, dict], dict[str, dict]]:
+    """Lee localidades y provincias completas y las indexa por código."""
+    etapas = Etapas(etapas_segundos)
+
+    loc_by_codigo: dict[str, dict] = {}
+    with etapas.medir("localidades"):
+        for d in db.collection("localidades").stream():
+            info = d.to_dict() or {}
+            codigo = str(info.get("codigo", "") or d.id)
+            loc_by_codigo[codigo] = info
+
+    prov_by_codigo: dict[str, dict] = {}
+    with etapas.medir("provincias"):
+        for d in db.collection("provincias").stream():
+            info = d.to_dict() or {}
+            codigo = str(info.get("codigo", "") or d.id)
+            prov_by_codigo[codigo] = info
+
+    return loc_by_codigo, prov_by_codigo
+
+
+class LookupCache:
+    """
+    Caché de proceso para las tablas localidades/provincias:
+    - Se construye la primera vez que se piden (miss).
+    - Pasado el TTL se sigue sirviendo la copia actual y se refresca en segundo plano.
+    - invalidate() la descarta; la API de carga la llama tras /load y /clear.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()          # protege estado y contadores
+        self._build_lock = threading.Lock()    # solo un hilo lee Firestore a la vez
+        self._data: Optional[tuple[dict[str, dict], dict[str, dict]]] = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._refreshing = False
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.invalidations = 0
+        self.last_refresh_seconds: Optional[float] = None
+        self.total_refresh_seconds = 0.0
+
+    def get(self) -> tuple[dict[str, dict], dict[str, dict]]:
+        with self._lock:
+            if self._data is not None:
+                self.hits += 1
+                if time.monotonic() - self._loaded_at > self.ttl_seconds:
+                    self._start_background_refresh()
+                return self._data
+            self.misses += 1
+
+        with self._build_lock:
+            # Otro hilo puede haberla construido mientras esperábamos
+            with self._lock:
+                if self._data is not None:
+                    return self._data
+            return self._refresh()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data = None
+            self.invalidations += 1
+            # Precalentamos para que la primera búsqueda tras la carga no pague la lectura
+            self._start_background_refresh()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "loaded": self._data is not None,
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._data is not None else None,
+                "ttl_seconds": self.ttl_seconds,
+                "localidades": len(self._data[0]) if self._data is not None else 0,
+                "provincias": len(self._data[1]) if self._data is not None else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "invalidations": self.invalidations,
+                "last_refresh_seconds": self.last_refresh_seconds,
+                "avg_refresh_seconds": round(self.total_refresh_seconds / self.refreshes, 4) if self.refreshes else None,
+            }
+
+    def _refresh(self) -> tuple[dict[str, dict], dict[str, dict]]:
+        """Relee Firestore. Llamar con _build_lock adquirido."""
+        with self._lock:
+            generation = self._generation
+
+        t0 = time.perf_counter()
+        data = cargar_tablas(get_db())
+        elapsed = time.perf_counter() - t0
+
+        with self._lock:
+            self.refreshes += 1
+            self.last_refresh_seconds = round(elapsed, 4)
+            self.total_refresh_seconds += elapsed
+            # Si hubo un invalidate mientras leíamos, esta copia puede estar ya vieja
+            if generation == self._generation:
+                self._data = data
+                self._loaded_at = time.monotonic()
+        return data
+
+    def _start_background_refresh(self) -> None:
+        """Lanza un refresco en segundo plano si no hay otro en curso. Llamar con _lock adquirido."""
+        if self._refreshing:
+            return
+        self._refreshing = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self) -> None:
+        try:
+            with self._build_lock:
+                self._refresh()
+        except Exception as e:
+            print(f"[WARN] No se pudo refrescar la caché de localidades/provincias: {e}")
+            with self._lock:
+                self.refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+lookup_cache = LookupCache(LOOKUP_TTL_SECONDS)
+
+# Pool compartido para lanzar en paralelo los trozos de una misma búsqueda
+query_pool = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="estaciones-query")
+
+
+def planificar_consultas(
+    base_q,
+    localidad_codigos: Optional[set[str]],
+    provincia_codigo: Optional[str],
+) -> tuple[list, Optional[set[str]]]:
+    """
+    Decide cómo empujar el filtro de localidad/provincia a Firestore.
+    Devuelve (consultas, post_filtro); post_filtro son las localidades que aún hay
+    que comprobar en Python, o None si Firestore ya devuelve solo lo que toca.
+    - Sin filtro de localidad: una única consulta.
+    - Pocas localidades: varias consultas "in" sobre localidad_codigo (trozos de 30).
+    - Demasiadas: se filtra por provincia_codigo (campo de la estación) y se afina en Python.
+    - Demasiadas y sin provincia: se recorre la colección filtrando en Python.
+    """
+    if localidad_codigos is None:
+        return [base_q], None
+
+    codigos = sorted(localidad_codigos)
+    if len(codigos) <= IN_CHUNK_SIZE * MAX_IN_CHUNKS:
+        consultas = [
+            base_q.where(filter=FieldFilter("localidad_codigo", "in", codigos[i:i + IN_CHUNK_SIZE]))
+            for i in range(0, len(codigos), IN_CHUNK_SIZE)
+        ]
+        return consultas, None
+
+    if provincia_codigo:
+        return [base_q.where(filter=FieldFilter("provincia_codigo", "==", provincia_codigo))], localidad_codigos
+
+    return [base_q], localidad_codigos
+
+
+def nombre_plan(localidad_codigos: Optional[set[str]], post_filtro: Optional[set[str]], provincia_codigo: Optional[str]) -> str:
+    """Etiqueta 'plan' de las métricas: qué rama de planificar_consultas se ha usado."""
+    if localidad_codigos is None:
+        return "directa"
+    if post_filtro is None:
+        return "in"
+    return "provincia" if provincia_codigo else "recorrido"
+
+
+def _contar(docs, leidos: list[int]):
+    """Cuenta en leidos[0] los documentos que salen del stream del almacén."""
+    for d in docs:
+        leidos[0] += 1
+        yield d
+
+
+def _preparar_consulta(q, after: Optional[str], limit: Optional[int]):
+    """Ordena por id de documento (necesario para mezclar y paginar) y aplica cursor/límite."""
+    q = q.order_by(FieldPath.document_id())
+    if after is not None:
+        q = q.start_after({FieldPath.document_id(): after})
+    if limit is not None:
+        q = q.limit(limit)
+    return q
+
+
+def _filtrar(docs, post_filtro: Optional[set[str]], limit: Optional[int]):
+    n = 0
+    for d in docs:
+        if limit is not None and n >= limit:
+            return
+        if post_filtro is not None:
+            loc_codigo = str((d.to_dict() or {}).get("localidad_codigo", "") or "")
+            if loc_codigo not in post_filtro:
+                continue
+        n += 1
+        yield d
+
+
+def ejecutar_consultas(
+    consultas: list, post_filtro: Optional[set[str]], limit: int, after: Optional[str] = None,
+    leidos: Optional[list[int]] = None,
+) -> list:
+    """
+    Lanza las consultas en paralelo (ordenadas por id de documento) y mezcla los
+    resultados en orden de id hasta 'limit'. Cada consulta lee como mucho lo que
+    puede acabar en la respuesta, no MAX_LIMIT documentos sin filtrar.
+    Si se pasa 'leidos', suma en leidos[0] los documentos leídos del almacén.
+    """
+    limit_firestore = limit if post_filtro is None else None
+
+    def correr(q) -> tuple[list, int]:
+        cuenta = [0]
+        stream = _contar(_preparar_consulta(q, after, limit_firestore).stream(), cuenta)
+        return list(_filtrar(stream, post_filtro, limit)), cuenta[0]
+
+    resultados = [correr(consultas[0])] if len(consultas) == 1 else list(query_pool.map(correr, consultas))
+    if leidos is not None:
+        leidos[0] += sum(n for _, n in resultados)
+
+    if len(resultados) == 1:
+        return resultados[0][0]
+    merged = heapq.merge(*(docs for docs, _ in resultados), key=lambda d: d.id)
+    return [d for _, d in zip(range(limit), merged)]
+
+
+def iterar_consultas(
+    consultas: list, post_filtro: Optional[set[str]], limit: Optional[int], after: Optional[str] = None,
+    leidos: Optional[list[int]] = None,
+):
+    """
+    Versión perezosa de ejecutar_consultas para exportaciones en streaming:
+    los streams de Firestore se abren a la vez y se mezclan por id según llegan,
+    sin acumular la respuesta en memoria. limit=None recorre todo.
+    """
+    limit_firestore = limit if post_filtro is None else None
+    leidos = leidos if leidos is not None else [0]
+    streams = [
+        _filtrar(_contar(_preparar_consulta(q, after, limit_firestore).stream(), leidos), post_filtro, None)
+        for q in consultas
+    ]
+    merged = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=lambda d: d.id)
+    yield from _filtrar(merged, None, limit)
+
+
+class EstacionesGeo:
+    """
+    Índice espacial en memoria de las estaciones con coordenadas:
+    - Se construye entero la primera vez que se usa (solo entonces esperan las consultas).
+    - Tras una carga se listan solo los ids de la colección y se leen enteras las
+      estaciones cuyo id no se conocía (y se quitan las que ya no están). No se
+      puede usar el último id como marca: los ids se reparten por bloques entre
+      extractores concurrentes y al pasar de 5 cifras dejan de ordenarse como texto.
+    - Tras un borrado del almacén se reconstruye entero.
+    Las consultas leen la vista actual (índice + documentos) sin lock: una vista publicada no
+    se modifica nunca. Las actualizaciones, en segundo plano, construyen otra (la sincronización
+    parte de una copia de la actual) y la sustituyen de golpe; mientras, se sirve la anterior.
+    _build_lock serializa las actualizaciones; _lock protege los indicadores y contadores.
+    """
+
+    def __init__(self, celda_grados: float):
+        self.celda_grados = celda_grados
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._vista: Optional[tuple[IndiceEspacial, dict[str, dict]]] = None
+        # Todos los ids vistos, con o sin coordenadas: los que faltan en el índice no se releen.
+        # Solo lo usan las actualizaciones (con _build_lock)
+        self._ids: set[str] = set()
+        self._construido = False
+        self._pendiente = False
+
+        self.rebuilds = 0
+        self.syncs = 0
+        self.last_build_seconds: Optional[float] = None
+        self.last_sync_seconds: Optional[float] = None
+
+    def asegurar(self) -> None:
+        """Construye el índice si aún no existe; si ya hay una vista, no espera a nada."""
+        if self._vista is not None:
+            return
+        with self._build_lock:
+            if self._vista is None:
+                self._reconstruir()
+
+    def marcar(self, completo: bool) -> None:
+        """Anota que el almacén cambió y lo aplica en segundo plano si el índice ya existía."""
+        with self._lock:
+            if self._vista is None:
+                return
+            if completo:
+                self._construido = False
+            else:
+                self._pendiente = True
+        threading.Thread(target=self._actualizar_en_segundo_plano, daemon=True).start()
+
+    def cercanos(self, lat: float, lon: float, k: int, max_km: Optional[float]) -> list[tuple[float, str, dict]]:
+        indice, docs = self._vista
+        return [(d, i, docs[i]) for d, i in indice.cercanos(lat, lon, k, max_km)]
+
+    def en_caja(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float, limit: int) -> list[tuple[str, dict]]:
+        indice, docs = self._vista
+        return [(i, docs[i]) for i in indice.en_caja(min_lat, min_lon, max_lat, max_lon, limit)]
+
+    def stats(self) -> dict:
+        vista = self._vista
+        with self._lock:
+            return {
+                "built": self._construido,
+                "pending_sync": self._pendiente,
+                "indexed": len(vista[0]) if vista is not None else 0,
+                "known_ids": len(self._ids),
+                "rebuilds": self.rebuilds,
+                "syncs": self.syncs,
+                "last_build_seconds": self.last_build_seconds,
+                "last_sync_seconds": self.last_sync_seconds,
+            }
+
+    @staticmethod
+    def _coordenadas(e: dict) -> tuple[Optional[float], Optional[float]]:
+        return to_float(e.get("latitud")), to_float(e.get("longitud"))
+
+    def _reconstruir(self) -> None:
+        t0 = time.perf_counter()
+        # Se marca al empezar: un cambio que llegue mientras se lee el almacén vuelve a marcarlo
+        with self._lock:
+            self._construido, self._pendiente = True, False
+        try:
+            indice = IndiceEspacial(self.celda_grados)
+            docs: dict[str, dict] = {}
+            ids: set[str] = set()
+            for d in get_db().collection("estaciones").stream():
+                e = d.to_dict() or {}
+                ids.add(d.id)
+                lat, lon = self._coordenadas(e)
+                if lat is not None and lon is not None:
+                    indice.insertar(d.id, lat, lon)
+                    docs[d.id] = e
+        except Exception:
+            with self._lock:
+                self._construido = False
+            raise
+
+        self._ids = ids
+        self._vista = (indice, docs)
+        with self._lock:
+            self.rebuilds += 1
+            self.last_build_seconds = round(time.perf_counter() - t0, 4)
+
+    def _sincronizar(self) -> None:
+        t0 = time.perf_counter()
+        with self._lock:
+            self._pendiente = False
+
+        db = get_db()
+        coleccion = db.collection("estaciones")
+        # select([]): solo los ids, sin traer los campos de cada estación
+        actuales = {d.id for d in coleccion.select([]).stream()}
+        nuevos = sorted(actuales - self._ids)
+        borrados = self._ids - actuales
+        leidas = []
+        for i in range(0, len(nuevos), GEO_SYNC_LOTE):
+            for snap in db.get_all([coleccion.document(doc_id) for doc_id in nuevos[i:i + GEO_SYNC_LOTE]]):
+                if snap.exists:
+                    leidas.append((snap.id, snap.to_dict() or {}))
+
+        indice_actual, docs_actuales = self._vista
+        indice, docs, ids = indice_actual.copia(), dict(docs_actuales), set(self._ids)
+        for doc_id in borrados:
+            indice.eliminar(doc_id)
+            docs.pop(doc_id, None)
+            ids.discard(doc_id)
+        for doc_id, e in leidas:
+            ids.add(doc_id)
+            lat, lon = self._coordenadas(e)
+            if lat is not None and lon is not None:
+                indice.insertar(doc_id, lat, lon)
+                docs[doc_id] = e
+
+        self._ids = ids
+        self._vista = (indice, docs)
+        with self._lock:
+            self.syncs += 1
+            self.last_sync_seconds = round(time.perf_counter() - t0, 4)
+
+    def _actualizar_en_segundo_plano(self) -> None:
+        try:
+            with self._build_lock:
+                with self._lock:
+                    construido, pendiente = self._construido, self._pendiente
+                if not construido:
+                    self._reconstruir()
+                elif pendiente:
+                    self._sincronizar()
+        except Exception as e:
+            print(f"[WARN] No se pudo actualizar el índice espacial: {e}")
+
+
+estaciones_geo = EstacionesGeo(GEO_CELDA_GRADOS)
+
+
+def respuesta_vacia(ndjson: bool):
+    if ndjson:
+        return StreamingResponse(iter(()), media_type=NDJSON_MEDIA_TYPE)
+    return {"count": 0, "estaciones": [], "next_cursor": None}
+
+
+def forma_consulta(localidad_q: str, cp_q: str, provincia_q: str, tipo_q: Optional[str]) -> str:
+    """Etiqueta 'forma' de las métricas: los filtros usados (p. ej. "provincia+tipo"), o "todo"."""
+    filtros = [n for n, v in (("provincia", provincia_q), ("localidad", localidad_q), ("cp", cp_q), ("tipo", tipo_q)) if v]
+    return "+".join(filtros) or "todo"
+
+
+def anotar_busqueda(forma: str, plan: str, leidos: int, devueltos: int) -> None:
+    consultas_total.inc(forma=forma, plan=plan)
+    leidos_total.inc(leidos, forma=forma, plan=plan)
+    devueltos_total.inc(devueltos, forma=forma, plan=plan)
+
+
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    # Con el almacén local, sus contadores de lecturas (BENCH/bench_busqueda.py mide lecturas por consulta)
+    almacen_stats = get_db().stats() if almacen.BACKEND == "sqlite" else {"backend": almacen.BACKEND}
+    return {"status": "ok", "lookup_cache": lookup_cache.stats(), "geo_index": estaciones_geo.stats(), "almacen": almacen_stats}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Histogramas de etapas y contadores de leídos/devueltos en formato de texto de Prometheus."""
+    return PlainTextResponse(registro_metricas.exponer(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+
+@app.post("/cache/invalidate")
+def invalidar_cache(incremental: bool = Query(default=True)):
+    """
+    La llama la API de carga cuando cambia el almacén:
+    - tras /load (incremental=true): el índice espacial solo lee las estaciones nuevas.
+    - tras /clear (incremental=false): el índice espacial se reconstruye entero.
+    """
+    lookup_cache.invalidate()
+    estaciones_geo.marcar(completo=not incremental)
+    return {"invalidated": True, "incremental": incremental}
+
+
+@app.get("/estaciones/near")
+def estaciones_cercanas(
+    lat: float = Query(ge=-90, le=90),
+    lon: float = Query(ge=-180, le=180),
+    k: int = Query(default=DEFAULT_K, ge=1, le=MAX_K),
+    max_km: Optional[float] = Query(default=None, gt=0),
+):
+    """Las k estaciones con coordenadas más cercanas a (lat, lon), con su distancia en km."""
+    estaciones_geo.asegurar()
+    loc_by_codigo, prov_by_codigo = lookup_cache.get()
+
+    estaciones = []
+    for dist, doc_id, e in estaciones_geo.cercanos(lat, lon, k, max_km):
+        estacion = formatear_estacion(doc_id, e, loc_by_codigo, prov_by_codigo)
+        estacion["distancia_km"] = round(dist, 3)
+        estaciones.append(estacion)
+
+    return {"count": len(estaciones), "estaciones": estaciones}
+
+
+@app.get("/estaciones/bbox")
+def estaciones_en_caja(
+    min_lat: float = Query(ge=-90, le=90),
+    min_lon: float = Query(ge=-180, le=180),
+    max_lat: float = Query(ge=-90, le=90),
+    max_lon: float = Query(ge=-180, le=180),
+    limit: int = Query(default=DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+):
+    """Estaciones con coordenadas dentro de la caja (p. ej. la vista actual del mapa)."""
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(status_code=400, detail="La caja no es válida (min > max)")
+
+    estaciones_geo.asegurar()
+    loc_by_codigo, prov_by_codigo = lookup_cache.get()
+
+    estaciones = [
+        formatear_estacion(doc_id, e, loc_by_codigo, prov_by_codigo)
+        for doc_id, e in estaciones_geo.en_caja(min_lat, min_lon, max_lat, max_lon, limit)
+    ]
+    return {"count": len(estaciones), "estaciones": estaciones}
 
 
 @app.get("/estaciones")
 def buscar_estaciones(
+    response: Response,
     localidad: Optional[str] = Query(default=None),
     cp: Optional[str] = Query(default=None),
     provincia: Optional[str] = Query(default=None),
     tipo: Optional[str] = Query(default=None),
-    limit: int = Query(default=DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    limit: Optional[int] = Query(default=None, ge=1),
+    cursor: Optional[str] = Query(default=None),
+    accept: Optional[str] = Header(default=None),
 ):
+    """
+    Búsqueda paginada de estaciones, ordenadas por id:
+    - JSON (por defecto): hasta 'limit' (<= MAX_LIMIT) estaciones y 'next_cursor'
+      para pedir la página siguiente con ?cursor=...
+    - Accept: application/x-ndjson: una estación por línea según se leen de
+      Firestore; sin 'limit' exporta todo lo que quede desde el cursor.
+    Con ITV_SERVER_TIMING=1 la respuesta lleva Server-Timing con tablas, estaciones y respuesta.
+    """
+    ndjson = NDJSON_MEDIA_TYPE in (accept or "")
+    if not ndjson:
+        limit = limit or DEFAULT_LIMIT
+        if limit > MAX_LIMIT:
+            raise HTTPException(status_code=422, detail=f"limit no puede superar {MAX_LIMIT} (usa cursor o NDJSON)")
+    after = decodificar_cursor(cursor) if cursor else None
+
     db = get_db()
 
     localidad_q = (localidad or "").strip().lower()
@@ -81,18 +684,22 @@ def buscar_estaciones(
     cp_q = (cp or "").strip()
     tipo_q = norm_tipo(tipo)
 
-    # ========= Cargar SIEMPRE diccionarios (para devolver siempre localidad/provincia) =========
-    loc_by_codigo: dict[str, dict] = {}
-    for d in db.collection("localidades").stream():
-        info = d.to_dict() or {}
-        codigo = str(info.get("codigo", "") or d.id)
-        loc_by_codigo[codigo] = info
+    forma = forma_consulta(localidad_q, cp_q, provincia_q, tipo_q)
+    etapas = Etapas(etapas_segundos)
 
-    prov_by_codigo: dict[str, dict] = {}
-    for d in db.collection("provincias").stream():
-        info = d.to_dict() or {}
-        codigo = str(info.get("codigo", "") or d.id)
-        prov_by_codigo[codigo] = info
+    def responder(resultado):
+        if SERVER_TIMING and etapas.duraciones:
+            cabeceras = resultado.headers if isinstance(resultado, Response) else response.headers
+            cabeceras["Server-Timing"] = etapas.server_timing()
+        return resultado
+
+    def sin_resultados():
+        anotar_busqueda(forma, "vacia", 0, 0)
+        return responder(respuesta_vacia(ndjson))
+
+    # ========= Diccionarios SIEMPRE disponibles (cacheados a nivel de proceso) =========
+    with etapas.medir("tablas"):
+        loc_by_codigo, prov_by_codigo = lookup_cache.get()
 
     # ========= Resolver provincia_codigo (por nombre) =========
     provincia_codigo: Optional[str] = None
@@ -109,7 +716,7 @@ def buscar_estaciones(
         if provincia_codigo is None:
             provincia_codigo = matches[0] if matches else None
         if provincia_codigo is None:
-            return {"count": 0, "estaciones": []}
+            return sin_resultados()
 
     # ========= Resolver localidad_codigos (por nombre y/o provincia_codigo) =========
     localidad_codigos: Optional[set[str]] = None
@@ -125,7 +732,7 @@ def buscar_estaciones(
             cands.add(codigo)
 
         if not cands:
-            return {"count": 0, "estaciones": []}
+            return sin_resultados()
         localidad_codigos = cands
 
     # ========= Query estaciones (filtros directos) =========
@@ -135,46 +742,48 @@ def buscar_estaciones(
     if tipo_q:
         q = q.where(filter=FieldFilter("tipo", "==", tipo_q))
 
-    docs = list(q.limit(limit).stream())
+    consultas, post_filtro = planificar_consultas(q, localidad_codigos, provincia_codigo)
+    plan = nombre_plan(localidad_codigos, post_filtro, provincia_codigo)
+    leidos = [0]
+
+    # ========= NDJSON: se escribe cada estación según sale del stream =========
+    if ndjson:
+        # Las cabeceras salen antes del cuerpo: aquí Server-Timing solo lleva "tablas";
+        # las etapas del stream se miden igualmente para /metrics
+        def generar():
+            devueltos = 0
+            t_estaciones = t_respuesta = 0.0
+            docs = iterar_consultas(consultas, post_filtro, limit, after, leidos)
+            try:
+                while True:
+                    t0 = time.perf_counter()
+                    d = next(docs, None)
+                    t1 = time.perf_counter()
+                    t_estaciones += t1 - t0
+                    if d is None:
+                        break
+                    estacion = formatear_estacion(d.id, d.to_dict() or {}, loc_by_codigo, prov_by_codigo)
+                    linea = json.dumps(estacion, ensure_ascii=False) + "\n"
+                    t_respuesta += time.perf_counter() - t1
+                    devueltos += 1
+                    yield linea
+            finally:
+                etapas.anotar("estaciones", t_estaciones)
+                etapas.anotar("respuesta", t_respuesta)
+                anotar_busqueda(forma, plan, leidos[0], devueltos)
+
+        return responder(StreamingResponse(generar(), media_type=NDJSON_MEDIA_TYPE))
+
+    with etapas.medir("estaciones"):
+        docs = ejecutar_consultas(consultas, post_filtro, limit, after, leidos)
 
     # ========= Construir respuesta (con localidad/provincia SIEMPRE) =========
-    estaciones = []
-    for d in docs:
-        e = d.to_dict() or {}
-
-        loc_codigo = str(e.get("localidad_codigo", "") or "")
-        if localidad_codigos is not None and loc_codigo not in localidad_codigos:
-            continue
-
-        loc_info = loc_by_codigo.get(loc_codigo, {})
-        loc_nombre = str(loc_info.get("nombre", "") or "")
-
-        prov_codigo = str(loc_info.get("provincia_codigo", "") or "")
-        prov_info = prov_by_codigo.get(prov_codigo, {})
-        prov_nombre = str(prov_info.get("nombre", "") or "")
-
-        lat = to_float(e.get("latitud"))
-        lon = to_float(e.get("longitud"))
-
-        estaciones.append(
-            {
-                "id": d.id,
-                "nombre": e.get("nombre", ""),
-                "tipo": e.get("tipo", ""),
-                "direccion": e.get("direccion", ""),
-                "localidad": loc_nombre,
-                "provincia": prov_nombre,
-                "codigo_postal": e.get("codigo_postal", ""),
-                "descripcion": e.get("descripcion", ""),
-                "horario": e.get("horario", ""),
-                "contacto": e.get("contacto", ""),
-                "URL": e.get("URL", ""),
-                "latitud": lat,
-                "longitud": lon,
-            }
-        )
-
-        if len(estaciones) >= limit:
-            break
-
-    return {"count": len(estaciones), "estaciones": estaciones}
+    # Se serializa aquí (y no al volver a FastAPI) para que la etapa "respuesta" incluya el JSON
+    with etapas.medir("respuesta"):
+        estaciones = [formatear_estacion(d.id, d.to_dict() or {}, loc_by_codigo, prov_by_codigo) for d in docs]
+        # Página llena: puede haber más (si no, la siguiente vendrá vacía)
+        next_cursor = codificar_cursor(docs[-1].id) if len(docs) == limit else None
+        cuerpo = JSONResponse({"count": len(estaciones), "estaciones": estaciones, "next_cursor": next_cursor})
+    anotar_busqueda(forma, plan, leidos[0], len(estaciones))
+
+    return responder(cuerpo)
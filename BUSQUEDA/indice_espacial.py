@@ -0,0 +1,180 @@
+﻿# BUSQUEDA/indice_espacial.py
+from __future__ import annotations
+
+import math
+from typing import Iterable, Optional
+
+
+RADIO_TIERRA_KM = 6371.0088
+KM_POR_GRADO = math.pi * RADIO_TIERRA_KM / 180.0
+
+
+def distancia_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distancia haversine en km."""
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class IndiceEspacial:
+    """
+    Rejilla de celdas fijas (en grados) sobre lat/lon:
+    - insertar/eliminar son O(1) (más el tamaño de la celda), así que se puede
+      actualizar de forma incremental tras una carga sin reconstruir todo.
+    - cercanos() recorre anillos de celdas alrededor del punto y para en cuanto
+      ninguna celda sin visitar puede contener algo más cerca que el k-ésimo.
+    - en_caja() solo mira las celdas que tocan la caja.
+    Con celdas de 0.1º y ~100k estaciones en España hay unas pocas por celda,
+    por lo que una búsqueda k-NN típica calcula unas decenas de distancias.
+    """
+
+    def __init__(self, celda_grados: float = 0.1):
+        self.celda_grados = celda_grados
+        self._celdas: dict[tuple[int, int], list[tuple[str, float, float]]] = {}
+        self._puntos: dict[str, tuple[float, float]] = {}
+        # Extensión de las celdas ocupadas (para saber cuándo no quedan anillos útiles)
+        self._min_i = self._max_i = self._min_j = self._max_j = 0
+
+    def __len__(self) -> int:
+        return len(self._puntos)
+
+    def __contains__(self, punto_id: str) -> bool:
+        return punto_id in self._puntos
+
+    def _celda(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.celda_grados), math.floor(lon / self.celda_grados)
+
+    def copia(self) -> "IndiceEspacial":
+        """Copia independiente: se puede modificar sin tocar este índice (que sigue sirviendo consultas)."""
+        otro = IndiceEspacial(self.celda_grados)
+        otro._celdas = {clave: list(celda) for clave, celda in self._celdas.items()}
+        otro._puntos = dict(self._puntos)
+        otro._min_i, otro._max_i, otro._min_j, otro._max_j = self._min_i, self._max_i, self._min_j, self._max_j
+        return otro
+
+    def vaciar(self) -> None:
+        self._celdas.clear()
+        self._puntos.clear()
+        self._min_i = self._max_i = self._min_j = self._max_j = 0
+
+    def insertar(self, punto_id: str, lat: float, lon: float) -> None:
+        if punto_id in self._puntos:
+            self.eliminar(punto_id)
+
+        i, j = self._celda(lat, lon)
+        if not self._puntos:
+            self._min_i = self._max_i = i
+            self._min_j = self._max_j = j
+        else:
+            self._min_i, self._max_i = min(self._min_i, i), max(self._max_i, i)
+            self._min_j, self._max_j = min(self._min_j, j), max(self._max_j, j)
+
+        self._celdas.setdefault((i, j), []).append((punto_id, lat, lon))
+        self._puntos[punto_id] = (lat, lon)
+
+    def insertar_muchos(self, puntos: Iterable[tuple[str, float, float]]) -> None:
+        for punto_id, lat, lon in puntos:
+            self.insertar(punto_id, lat, lon)
+
+    def eliminar(self, punto_id: str) -> bool:
+        pos = self._puntos.pop(punto_id, None)
+        if pos is None:
+            return False
+        clave = self._celda(*pos)
+        celda = self._celdas.get(clave, [])
+        celda[:] = [p for p in celda if p[0] != punto_id]
+        if not celda:
+            self._celdas.pop(clave, None)
+        # La extensión no se encoge: como mucho se visita algún anillo vacío de más
+        return True
+
+    def cercanos(
+        self, lat: float, lon: float, k: int, max_km: Optional[float] = None
+    ) -> list[tuple[float, str]]:
+        """Devuelve hasta k pares (distancia_km, id) ordenados por distancia."""
+        if k <= 0 or not self._puntos:
+            return []
+
+        c = self.celda_grados
+        ci, cj = self._celda(lat, lon)
+        mejores: list[tuple[float, str]] = []  # ordenada, como mucho k elementos
+        limite = max_km if max_km is not None else math.inf
+
+        r = 0
+        while True:
+            for i, j in self._anillo(ci, cj, r):
+                for punto_id, plat, plon in self._celdas.get((i, j), ()):
+                    d = distancia_km(lat, lon, plat, plon)
+                    if d > limite:
+                        continue
+                    if len(mejores) < k:
+                        mejores.append((d, punto_id))
+                        mejores.sort()
+                    elif d < mejores[-1][0]:
+                        mejores[-1] = (d, punto_id)
+                        mejores.sort()
+
+            # Distancia mínima a cualquier punto fuera de los anillos 0..r
+            gap_lat = min(lat - (ci - r) * c, (ci + r + 1) * c - lat)
+            gap_lon = min(lon - (cj - r) * c, (cj + r + 1) * c - lon)
+            cota_km = gap_lat * KM_POR_GRADO
+            objetivo = mejores[-1][0] if len(mejores) >= k else limite
+            if objetivo != math.inf:
+                # cos() en la latitud más alejada del ecuador a la que puede estar un candidato
+                lat_ext = min(89.9, abs(lat) + objetivo / KM_POR_GRADO)
+                cota_km = min(cota_km, gap_lon * KM_POR_GRADO * math.cos(math.radians(lat_ext)))
+                if cota_km >= objetivo:
+                    break
+
+            if self._fuera_de_extension(ci, cj, r):
+                break
+            r += 1
+
+        return mejores
+
+    def en_caja(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float, limit: Optional[int] = None
+    ) -> list[str]:
+        """Ids dentro de la caja [min_lat, max_lat] x [min_lon, max_lon]."""
+        i0, j0 = self._celda(min_lat, min_lon)
+        i1, j1 = self._celda(max_lat, max_lon)
+        i0, i1 = max(i0, self._min_i), min(i1, self._max_i)
+        j0, j1 = max(j0, self._min_j), min(j1, self._max_j)
+        if i0 > i1 or j0 > j1 or not self._puntos:
+            return []
+
+        # Si la caja abarca más celdas de las que hay ocupadas, es más barato recorrer las ocupadas
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._celdas):
+            claves = sorted(k for k in self._celdas if i0 <= k[0] <= i1 and j0 <= k[1] <= j1)
+        else:
+            claves = [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+        ids: list[str] = []
+        for clave in claves:
+            for punto_id, plat, plon in self._celdas.get(clave, ()):
+                if min_lat <= plat <= max_lat and min_lon <= plon <= max_lon:
+                    ids.append(punto_id)
+                    if limit is not None and len(ids) >= limit:
+                        return ids
+        return ids
+
+    def _anillo(self, ci: int, cj: int, r: int):
+        if r == 0:
+            yield ci, cj
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield ci - r, j
+            yield ci + r, j
+        for i in range(ci - r + 1, ci + r):
+            yield i, cj - r
+            yield i, cj + r
+
+    def _fuera_de_extension(self, ci: int, cj: int, r: int) -> bool:
+        """True si los anillos 0..r ya cubren todas las celdas ocupadas."""
+        return (
+            ci - r <= self._min_i and ci + r >= self._max_i
+            and cj - r <= self._min_j and cj + r >= self._max_j
+        )
@@ -0,0 +1,132 @@
+﻿# BUSQUEDA/metricas.py
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Cubos en segundos: de 1 ms (caché caliente) a 10 s (recorrer toda la colección en Firestore)
+CUBOS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres: tuple[str, ...], valores: tuple[str, ...], extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(x: float) -> str:
+    if x == float("inf"):
+        return "+Inf"
+    return repr(float(x)) if isinstance(x, float) else str(x)
+
+
+class Contador:
+    """Contador monótono con etiquetas (formato de texto de Prometheus)."""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Iterable[str] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._valores: dict[tuple[str, ...], float] = {}
+
+    def inc(self, cantidad: float = 1, **etiquetas: str) -> None:
+        clave = tuple(str(etiquetas[n]) for n in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def exponer(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            for clave, valor in sorted(self._valores.items()):
+                lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}")
+        return lineas
+
+
+class Histograma:
+    """Histograma acumulado por cubos (le=...), con _sum y _count, como los de Prometheus."""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Iterable[str] = (), cubos: Iterable[float] = CUBOS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.cubos = tuple(sorted(cubos)) + (float("inf"),)
+        self._lock = threading.Lock()
+        # etiquetas -> (cuenta por cubo, suma, total)
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observar(self, valor: float, **etiquetas: str) -> None:
+        clave = tuple(str(etiquetas[n]) for n in self.etiquetas)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * len(self.cubos), 0.0, 0]
+            for i, limite in enumerate(self.cubos):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    def exponer(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            for clave, (cuentas, suma, total) in sorted(self._series.items()):
+                acumulado = 0
+                for limite, n in zip(self.cubos, cuentas):
+                    acumulado += n
+                    le = f'le="{_numero(limite)}"'
+                    lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, le)} {acumulado}")
+                lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {_numero(suma)}")
+                lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {total}")
+        return lineas
+
+
+class Registro:
+    def __init__(self):
+        self._metricas: list = []
+
+    def registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def exponer(self) -> str:
+        return "\n".join(linea for m in self._metricas for linea in m.exponer()) + "\n"
+
+
+class Etapas:
+    """
+    Tiempos de las etapas de una petición: cada etapa se observa en el histograma
+    (etiqueta 'etapa') y se guarda para la cabecera Server-Timing de la respuesta.
+    """
+
+    def __init__(self, histograma: Optional[Histograma]):
+        self.histograma = histograma
+        self.duraciones: dict[str, float] = {}
+
+    @contextmanager
+    def medir(self, etapa: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.anotar(etapa, time.perf_counter() - t0)
+
+    def anotar(self, etapa: str, segundos: float) -> None:
+        self.duraciones[etapa] = self.duraciones.get(etapa, 0.0) + segundos
+        if self.histograma is not None:
+            self.histograma.observar(segundos, etapa=etapa)
+
+    def server_timing(self) -> str:
+        # https://www.w3.org/TR/server-timing/ (dur en milisegundos)
+        return ", ".join(f"{etapa};dur={s * 1000:.1f}" for etapa, s in self.duraciones.items())
@@ -1,17 +1,32 @@
 ﻿from __future__ import annotations
 
+import os
 import sys
+import json
 import time
+import uuid
+import random
+import importlib
+import contextvars
+import threading
+import traceback
 import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Literal
+from typing import Callable, Literal, Optional
 
-from fastapi import FastAPI, HTTPException
+import requests
+from fastapi import FastAPI, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
-import firebase_admin
-from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from COMUN import almacen, perfilado, progreso
+from COMUN.escritor import ERRORES_TRANSITORIOS
+from COMUN.progreso import CargaCancelada, parsear_linea
 
 
 # Carpeta raíz del proyecto (…/IEI_FINAL2/IEI_FINAL2)
@@ -20,7 +35,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Credenciales (como lo llevas “ahora”: por nombre de fichero)
 CREDENTIALS_FILE = BASE_DIR / "iei-proyecto-firebase-adminsdk-fbsvc-04d774ba06.json"
 
-WAREHOUSE_COLLECTIONS = ["provincias", "localidades", "estaciones"]
+# "contadores" guarda el siguiente id libre de cada colección (COMUN/contadores.py);
+# se borra con el resto para que tras un /clear los ids vuelvan a empezar.
+WAREHOUSE_COLLECTIONS = ["provincias", "localidades", "estaciones", "contadores", "cargas"]
 
 EXTRACTOR_FILES = {
     "GAL": BASE_DIR / "GAL" / "extractor_gal.py",
@@ -28,7 +45,35 @@ EXTRACTOR_FILES = {
     "CV":  BASE_DIR / "CV" / "extractor_cv.py",
 }
 
+# Los mismos extractores como módulos, para el modo en proceso (mode="inprocess")
+EXTRACTOR_MODULES = {
+    "GAL": "GAL.extractor_gal",
+    "CAT": "CAT.extractor_cat",
+    "CV":  "CV.extractor_cv",
+}
+
 Source = Literal["GAL", "CAT", "CV"]
+ExecutionMode = Literal["subprocess", "inprocess"]
+
+# API de búsqueda: se le avisa cuando cambia el almacén para que invalide su caché
+BUSQUEDA_API_BASE = "http://127.0.0.1:8020"
+BUSQUEDA_INVALIDATE_URL = f"{BUSQUEDA_API_BASE}/cache/invalidate"
+
+# Borrado del almacén (/clear)
+CLEAR_BATCH_SIZE = 400
+CLEAR_MAX_EN_VUELO = 4          # commits simultáneos por colección mientras se pide la siguiente página
+CLEAR_MAX_REINTENTOS = 5
+CLEAR_BACKOFF_BASE = 0.5        # segundos; se dobla en cada reintento
+CLEAR_BACKOFF_MAX = 16.0
+# Checkpoint del último /clear; si existe al arrancar un /clear, se reanuda desde ahí
+CLEAR_ESTADO_FILE = BASE_DIR / "CARGA" / ".clear_estado.json"
+
+# Jobs de carga
+MAX_JOBS_GUARDADOS = 50         # jobs terminados que se conservan para consultarlos
+PROGRESO_MIN_INTERVALO = 0.25   # segundos entre eventos de progreso de una misma fuente
+SSE_KEEPALIVE_SECONDS = 10
+SSE_MAX_SECONDS = 30            # el navegador reconecta solo (Last-Event-ID) y sigue donde iba
+SSE_RETRY_MS = 1000
 
 
 app = FastAPI(title="API Carga", version="1.0.0")
@@ -39,36 +84,669 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[perfilado.CABECERA_FICHERO],
 )  # CORS en FastAPI se configura con CORSMiddleware. [web:336]
+# X-Perfil: 1 -> perfil de la petición; GET /profiles (COMUN/perfilado.py)
+perfilado.instalar(app, "carga")
 
 
 class LoadRequest(BaseModel):
     sources: list[Source]
     clear_before: bool = False
+    # Modo concurrente: los extractores se lanzan a la vez (como mucho max_parallel)
+    parallel: bool = False
+    max_parallel: int = Field(default=3, ge=1, le=len(EXTRACTOR_FILES))
+    # Tiempo máximo por fuente; al superarlo se mata el extractor
+    timeout_seconds: Optional[float] = Field(default=None, gt=0)
+    # True: responder al terminar (comportamiento antiguo). False: devolver el job al momento
+    wait: bool = False
+    # subprocess: un intérprete por fuente (aislado). inprocess: main() importado y
+    # ejecutado en un hilo de esta API, reutilizando su cliente de Firestore ya abierto.
+    mode: ExecutionMode = "subprocess"
+    # Cada extractor se salta su fuente si no ha cambiado desde la última carga (ETag); True = cargar igual
+    force: bool = False
+    # Perfil de cada extractor en .perfiles/ (GET /profiles): "pstats" (cProfile) o "collapsed" (muestreo)
+    profile: Optional[Literal["pstats", "collapsed"]] = None
+
+
+class EjecucionCarga:
+    """
+    Extractores de una petición /load en curso.
+    Permite cancelarla: se matan los procesos vivos y no se arrancan los pendientes.
+    """
+
+    def __init__(self, sources: list[str]):
+        self.sources = sources
+        self._lock = threading.Lock()
+        self._procesos: dict[str, subprocess.Popen] = {}
+        self.cancelled = False
+
+    def registrar(self, source: str, proc) -> bool:
+        """
+        proc: cualquier cosa con kill() (Popen, o SalidaCapturada en modo en proceso).
+        Devuelve False si la carga ya estaba cancelada (y lo mata).
+        """
+        with self._lock:
+            if self.cancelled:
+                proc.kill()
+                return False
+            self._procesos[source] = proc
+            return True
+
+    def terminar(self, source: str) -> None:
+        with self._lock:
+            self._procesos.pop(source, None)
+
+    def cancelar(self) -> list[str]:
+        with self._lock:
+            self.cancelled = True
+            vivos = list(self._procesos.items())
+        for _, proc in vivos:
+            proc.kill()
+        return [s for s, _ in vivos]
+
+
+# Cargas en curso (para /load/cancel)
+EJECUCIONES: set[EjecucionCarga] = set()
+EJECUCIONES_LOCK = threading.Lock()
+
+
+class Job:
+    """
+    Una carga lanzada en segundo plano.
+    Guarda su estado, el progreso por fuente, las etapas cronometradas y una lista
+    de eventos numerados que se sirven por SSE (GET /jobs/{id}/events).
+    """
+
+    def __init__(self, req: LoadRequest):
+        self.id = uuid.uuid4().hex[:12]
+        self.req = req
+        # Misma clave = misma carga: fuentes y los parámetros que cambian lo que se escribe
+        # (parallel, timeout_seconds y profile solo cambian cómo se ejecuta)
+        self.key = (frozenset(req.sources), req.clear_before, req.force, req.mode)
+        self.status = "pending"   # pending | running | done | failed | cancelled
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.ejecucion = EjecucionCarga(list(req.sources))
+        self.response: Optional[dict] = None
+        self.progress: dict[str, dict] = {}
+        self.stages: list[dict] = []
+        self.writers: dict[str, dict] = {}
+        # Fuentes en proceso canceladas cuyo hilo aún no ha parado (el job no termina hasta que paran)
+        self.still_running: set[str] = set()
+        self.events: list[dict] = []
+        self._cond = threading.Condition()
+        self._ultimo_progreso: dict[str, float] = {}
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def emit(self, event: str, data: dict) -> None:
+        with self._cond:
+            self.events.append({"id": len(self.events) + 1, "event": event, "ts": round(time.time(), 3), "data": data})
+            self._cond.notify_all()
+
+    def set_status(self, status: str) -> None:
+        with self._cond:
+            self.status = status
+            if status == "running":
+                self.started_at = time.time()
+            if self.finished:
+                self.finished_at = time.time()
+            # Dentro del mismo bloque: quien vea el job terminado ya tiene este evento
+            self.emit("status", {"status": status, "error": self.error})
+
+    def actualizar_progreso(self, source: str, datos: dict, forzar: bool = False) -> None:
+        self.progress[source] = datos
+        ahora = time.monotonic()
+        # Se emite como mucho cada PROGRESO_MIN_INTERVALO por fuente (el último valor siempre queda en progress)
+        if forzar or ahora - self._ultimo_progreso.get(source, 0.0) >= PROGRESO_MIN_INTERVALO:
+            self._ultimo_progreso[source] = ahora
+            self.emit("progress", {"source": source, **datos})
+
+    def esperar_eventos(self, after: int, timeout: float) -> tuple[list[dict], bool]:
+        """Eventos con id > after (espera hasta timeout si no hay) y si el job ya terminó."""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.events) > after or self.finished, timeout=timeout)
+            return self.events[after:], self.finished
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "sources": self.req.sources,
+            "clear_before": self.req.clear_before,
+            "parallel": self.req.parallel,
+            "mode": self.req.mode,
+            "force": self.req.force,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+            "stages": self.stages,
+            "writers": self.writers,
+            "still_running": sorted(self.still_running),
+            "events": len(self.events),
+            "response": self.response,
+        }
+
+
+JOBS: dict[str, Job] = {}
+JOBS_LOCK = threading.Lock()
 
 
 def get_db():
-    if not CREDENTIALS_FILE.exists():
+    # Con ITV_ALMACEN=sqlite no hacen falta credenciales (COMUN/almacen.py)
+    if almacen.BACKEND == "firestore" and not CREDENTIALS_FILE.exists():
         raise RuntimeError(f"No encuentro credenciales: {CREDENTIALS_FILE}")
 
-    if not firebase_admin._apps:
-        firebase_admin.initialize_app(credentials.Certificate(str(CREDENTIALS_FILE)))
+    return almacen.abrir(CREDENTIALS_FILE)
+
+
+class EstadoBorrado:
+    """
+    Progreso del /clear por colección, guardado en disco tras cada lote confirmado.
+    last_id es el mayor id tal que todo lo anterior ya está borrado, así que si el
+    proceso muere se puede seguir con start_after(last_id) sin volver a recorrer
+    (ni pagar las lápidas de) lo ya borrado.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.colecciones: dict[str, dict] = {}
+        self.reanudado = False
+        if path.exists():
+            try:
+                self.colecciones = json.loads(path.read_text(encoding="utf-8")).get("colecciones", {})
+                self.reanudado = bool(self.colecciones)
+            except (OSError, ValueError):
+                self.colecciones = {}
+
+    def coleccion(self, nombre: str) -> dict:
+        with self._lock:
+            return dict(self.colecciones.setdefault(nombre, {"deleted": 0, "last_id": None, "done": False}))
+
+    def avanzar(self, nombre: str, last_id: str, borrados: int) -> None:
+        with self._lock:
+            info = self.colecciones[nombre]
+            info["deleted"] += borrados
+            info["last_id"] = last_id
+            self._guardar()
+
+    def terminar(self, nombre: str) -> None:
+        with self._lock:
+            self.colecciones[nombre]["done"] = True
+            self._guardar()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {k: dict(v) for k, v in self.colecciones.items()}
+
+    def finalizar(self) -> None:
+        """Todo borrado: ya no hay nada que reanudar."""
+        with self._lock:
+            self.path.unlink(missing_ok=True)
+
+    def _guardar(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"colecciones": self.colecciones}), encoding="utf-8")
+        tmp.replace(self.path)
+
+
+def commit_borrado(db, refs: list) -> None:
+    """Borra un lote; reintenta con backoff exponencial (y jitter) si Firestore lo rechaza por carga."""
+    for intento in range(CLEAR_MAX_REINTENTOS + 1):
+        batch = db.batch()
+        for ref in refs:
+            batch.delete(ref)
+        try:
+            batch.commit()
+            return
+        except ERRORES_TRANSITORIOS:
+            if intento == CLEAR_MAX_REINTENTOS:
+                raise
+            espera = min(CLEAR_BACKOFF_MAX, CLEAR_BACKOFF_BASE * 2 ** intento)
+            time.sleep(espera * random.uniform(0.5, 1.0))
+
+
+def delete_collection(db, collection_name: str, estado: EstadoBorrado, batch_size: int = CLEAR_BATCH_SIZE) -> int:
+    """
+    Borra una colección por lotes (la idea de borrar por lotes es la recomendada por la doc. [web:335]):
+    - pide solo los ids, página a página en orden de id;
+    - mientras se confirman hasta CLEAR_MAX_EN_VUELO lotes ya se está pidiendo la página siguiente;
+    - el checkpoint avanza en orden, lote a lote.
+    Al reanudar, el checkpoint solo ahorra trabajo: entre medias una carga puede haber vuelto a
+    escribir ids ya recorridos (o en una colección ya marcada como terminada; los contadores
+    se borran y los ids vuelven a empezar en 1), así que se acaba con una pasada completa
+    desde el principio hasta una página vacía.
+    """
+    info = estado.coleccion(collection_name)
+    coleccion = db.collection(collection_name)
+    en_vuelo: deque = deque()  # (future, último id del lote, nº docs), en orden de id
+
+    def drenar(maximo: int) -> None:
+        while len(en_vuelo) > maximo:
+            futuro, last_id, n = en_vuelo.popleft()
+            futuro.result()
+            estado.avanzar(collection_name, last_id, n)
+
+    def pasada(pool, cursor: Optional[str]) -> None:
+        while True:
+            q = coleccion.order_by(FieldPath.document_id()).select([FieldPath.document_id()]).limit(batch_size)
+            if cursor is not None:
+                q = q.start_after({FieldPath.document_id(): cursor})
+            docs = list(q.stream())
+            if not docs:
+                break
+
+            cursor = docs[-1].id
+            en_vuelo.append((pool.submit(commit_borrado, db, [d.reference for d in docs]), cursor, len(docs)))
+            drenar(CLEAR_MAX_EN_VUELO)
+
+            if len(docs) < batch_size:
+                break
+        drenar(0)
+
+    with ThreadPoolExecutor(max_workers=CLEAR_MAX_EN_VUELO, thread_name_prefix=f"clear-{collection_name}") as pool:
+        try:
+            if not info["done"]:
+                pasada(pool, info["last_id"])
+            if info["done"] or info["last_id"] is not None:
+                pasada(pool, None)
+        finally:
+            # Si algo falló se descartan los lotes que aún no empezaron; el with espera a los que están en marcha.
+            # El checkpoint se queda en el último lote confirmado en orden.
+            for futuro, _, _ in en_vuelo:
+                futuro.cancel()
+
+    estado.terminar(collection_name)
+    return estado.coleccion(collection_name)["deleted"]
+
+
+# Solo un /clear a la vez; ESTADO_BORRADO es el del /clear en curso (o el último)
+CLEAR_LOCK = threading.Lock()
+ESTADO_BORRADO: Optional[EstadoBorrado] = None
+
+
+def notificar_busqueda(incremental: bool = True) -> bool:
+    """
+    Avisa a la API de búsqueda de que el almacén ha cambiado.
+    - incremental=True tras una carga (solo hay estaciones nuevas).
+    - incremental=False tras un borrado.
+    Si no está levantada no es un error: su caché caducará sola por TTL.
+    """
+    try:
+        resp = requests.post(
+            BUSQUEDA_INVALIDATE_URL,
+            params={"incremental": str(incremental).lower()},
+            timeout=5,
+        )
+        return resp.ok
+    except requests.RequestException:
+        return False
+
+
+def ejecutar_extractor(
+    source: str,
+    ejecucion: EjecucionCarga,
+    timeout_seconds: Optional[float],
+    on_linea: Optional[Callable[[str, str], bool]] = None,
+    forzar: bool = False,
+    perfil: Optional[str] = None,
+) -> dict:
+    """
+    Lanza un extractor en su propio intérprete y recoge su salida línea a línea.
+    on_linea(source, linea) recibe cada línea de stdout según se escribe; si devuelve
+    True la línea se considera consumida (progreso/etapas) y no va al resumen.
+    """
+    t0 = time.time()
+    if ejecucion.cancelled:
+        return {"ok": False, "seconds": 0.0, "returncode": None, "timed_out": False, "cancelled": True, "stdout": "", "stderr": ""}
+
+    proc = subprocess.Popen(
+        [sys.executable, str(EXTRACTOR_FILES[source])],
+        cwd=str(BASE_DIR),              # para que encuentre fuentes/credenciales como lo tienes ahora
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        env={
+            **os.environ,
+            "ITV_PROGRESO": "1",
+            "ITV_FORZAR_CARGA": "1" if forzar else "0",
+            "ITV_PERFIL": perfil or "",
+            "PYTHONUNBUFFERED": "1",
+            "PYTHONIOENCODING": "utf-8",
+        },
+    )  # Ejecutar scripts y devolver salida es un patrón típico con subprocess. [web:326]
+
+    # Solo se conserva la cola de la salida (la respuesta devuelve los últimos 8000 caracteres)
+    stdout_lines: deque[str] = deque(maxlen=2000)
+    stderr_lines: deque[str] = deque(maxlen=2000)
+
+    def leer(stream, acumulado: deque, es_stdout: bool) -> None:
+        for linea in stream:
+            if es_stdout and on_linea is not None and on_linea(source, linea.rstrip("\n")):
+                continue
+            acumulado.append(linea)
+
+    lectores = [
+        threading.Thread(target=leer, args=(proc.stdout, stdout_lines, True), daemon=True),
+        threading.Thread(target=leer, args=(proc.stderr, stderr_lines, False), daemon=True),
+    ]
+    for t in lectores:
+        t.start()
+
+    timed_out = False
+    try:
+        if not ejecucion.registrar(source, proc):
+            proc.wait()
+        else:
+            try:
+                proc.wait(timeout=timeout_seconds)
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                proc.kill()
+                proc.wait()
+    finally:
+        ejecucion.terminar(source)
+        for t in lectores:
+            t.join()
+
+    return {
+        "ok": proc.returncode == 0 and not timed_out and not ejecucion.cancelled,
+        "seconds": round(time.time() - t0, 2),
+        "returncode": proc.returncode,
+        "timed_out": timed_out,
+        "cancelled": ejecucion.cancelled,
+        "mode": "subprocess",
+        "stdout": "".join(stdout_lines)[-8000:],
+        "stderr": "".join(stderr_lines)[-8000:],
+    }
+
+
+class SalidaCapturada:
+    """stdout de una ejecución en proceso: trocea en líneas y guarda la cola, como con subprocess."""
+
+    def __init__(self, source: str, on_linea: Optional[Callable[[str, str], bool]]):
+        self.source = source
+        self.on_linea = on_linea
+        self.stdout_lines: deque[str] = deque(maxlen=2000)
+        self.stderr = ""
+        self.returncode: Optional[int] = None
+        self.cancelada = False
+        self.cancelada_en: Optional[float] = None
+        # Lo comprueban el extractor (cada registro y etapa) y su escritor (cada commit): COMUN/progreso.py
+        self.cancelacion = threading.Event()
+        self._pendiente = ""
+
+    def write(self, texto: str) -> int:
+        if self.cancelada:
+            raise CargaCancelada()
+        self._pendiente += texto
+        while "\n" in self._pendiente:
+            linea, self._pendiente = self._pendiente.split("\n", 1)
+            if self.on_linea is not None and self.on_linea(self.source, linea):
+                continue
+            self.stdout_lines.append(linea + "\n")
+        return len(texto)
+
+    def cerrar(self) -> None:
+        if self._pendiente:
+            self.stdout_lines.append(self._pendiente)
+            self._pendiente = ""
+
+    def kill(self) -> None:
+        """
+        Misma interfaz que Popen.kill() para EjecucionCarga: el extractor para en el siguiente
+        registro, etapa, commit o print. Si está bloqueado en una lectura de red, al volver de ella.
+        """
+        if not self.cancelada:
+            self.cancelada_en = time.monotonic()
+        self.cancelada = True
+        self.cancelacion.set()
+
+
+class StdoutPorHilo:
+    """
+    Sustituye a sys.stdout una sola vez: lo que escribe un hilo con una SalidaCapturada
+    activa va a ella; el resto (logs de uvicorn, etc.) sigue yendo al stdout original.
+    Así varias fuentes en paralelo no mezclan su salida.
+    Va en una ContextVar: los hilos que el extractor arranca con una copia de su contexto
+    (el pipeline de CV) escriben en la misma salida.
+    """
+
+    def __init__(self, original):
+        self.original = original
+        self._salida: contextvars.ContextVar[Optional[SalidaCapturada]] = contextvars.ContextVar("salida_extractor", default=None)
+
+    def activar(self, salida: Optional[SalidaCapturada]) -> None:
+        self._salida.set(salida)
+
+    def write(self, texto: str) -> int:
+        salida = self._salida.get()
+        if salida is not None:
+            return salida.write(texto)
+        return self.original.write(texto)
+
+    def flush(self) -> None:
+        if self._salida.get() is None:
+            self.original.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.original, name)
+
+
+STDOUT_POR_HILO: Optional[StdoutPorHilo] = None
+STDOUT_LOCK = threading.Lock()
+# Si el hilo sigue vivo pasado esto desde la cancelación (p. ej. bloqueado en una lectura de red),
+# se avisa con source_still_running; la fuente no se da por terminada hasta que el hilo acaba
+INPROCESS_GRACE_SECONDS = 30
+INPROCESS_POLL_SECONDS = 0.5
+
+# Extractores en proceso vivos (hilo -> su salida): /clear no borra mientras alguno cancelado siga escribiendo
+EXTRACTORES_EN_PROCESO: dict[threading.Thread, SalidaCapturada] = {}
+EXTRACTORES_EN_PROCESO_LOCK = threading.Lock()
+
+
+def extractores_cancelados_vivos() -> list[str]:
+    with EXTRACTORES_EN_PROCESO_LOCK:
+        return [salida.source for salida in EXTRACTORES_EN_PROCESO.values() if salida.cancelada]
+
+
+def instalar_stdout_por_hilo() -> StdoutPorHilo:
+    global STDOUT_POR_HILO
+    with STDOUT_LOCK:
+        if STDOUT_POR_HILO is None:
+            STDOUT_POR_HILO = StdoutPorHilo(sys.stdout)
+            sys.stdout = STDOUT_POR_HILO
+        return STDOUT_POR_HILO
+
+
+def ejecutar_extractor_en_proceso(
+    source: str,
+    ejecucion: EjecucionCarga,
+    timeout_seconds: Optional[float],
+    on_linea: Optional[Callable[[str, str], bool]] = None,
+    forzar: bool = False,
+    perfil: Optional[str] = None,
+    on_sigue_vivo: Optional[Callable[[str, float], None]] = None,
+) -> dict:
+    """
+    Ejecuta main() del extractor como llamada de librería, en un hilo propio:
+    - sin arrancar intérprete ni reimportar firebase_admin/grpc en cada carga;
+    - con el cliente de Firestore de esta API (get_db()), ya autenticado y con el canal abierto;
+    - capturando su stdout y aislando sus fallos (una excepción no afecta a las demás fuentes).
+    Un hilo no se puede matar: al cancelar o por timeout se le pide que pare y se le espera
+    hasta que acaba. on_sigue_vivo(source, segundos) avisa si tarda más de INPROCESS_GRACE_SECONDS.
+    """
+    t0 = time.time()
+    if ejecucion.cancelled:
+        return {"ok": False, "seconds": 0.0, "returncode": None, "timed_out": False, "cancelled": True, "stdout": "", "stderr": ""}
+
+    stdout_hilos = instalar_stdout_por_hilo()
+    progreso.PROGRESO_ACTIVO = True
+    salida = SalidaCapturada(source, on_linea)
+
+    def objetivo() -> None:
+        stdout_hilos.activar(salida)
+        progreso.activar_cancelacion(salida.cancelacion)
+        try:
+            modulo = importlib.import_module(EXTRACTOR_MODULES[source])
+            modulo.main(db=get_db(), forzar=forzar, perfil=perfil)
+            salida.returncode = 0
+        except CargaCancelada:
+            salida.returncode = -9
+        except BaseException:
+            salida.stderr = traceback.format_exc()
+            salida.returncode = 1
+        finally:
+            progreso.activar_cancelacion(None)
+            stdout_hilos.activar(None)
+            salida.cerrar()
+
+    hilo = threading.Thread(target=objetivo, daemon=True, name=f"extractor-{source}")
+    timed_out = False
+    segundos_tras_cancelar: Optional[float] = None
+    try:
+        if ejecucion.registrar(source, salida):
+            with EXTRACTORES_EN_PROCESO_LOCK:
+                EXTRACTORES_EN_PROCESO[hilo] = salida
+            hilo.start()
+            limite = time.monotonic() + timeout_seconds if timeout_seconds else None
+            avisado = False
+            while hilo.is_alive():
+                hilo.join(INPROCESS_POLL_SECONDS)
+                ahora = time.monotonic()
+                if limite is not None and not salida.cancelada and ahora >= limite:
+                    timed_out = True
+                    salida.kill()
+                if salida.cancelada_en is not None and not avisado and ahora - salida.cancelada_en >= INPROCESS_GRACE_SECONDS:
+                    avisado = True
+                    if on_sigue_vivo is not None:
+                        on_sigue_vivo(source, round(ahora - salida.cancelada_en, 1))
+            if salida.cancelada_en is not None:
+                segundos_tras_cancelar = round(time.monotonic() - salida.cancelada_en, 2)
+    finally:
+        with EXTRACTORES_EN_PROCESO_LOCK:
+            EXTRACTORES_EN_PROCESO.pop(hilo, None)
+        ejecucion.terminar(source)
+
+    return {
+        "ok": salida.returncode == 0 and not timed_out and not ejecucion.cancelled,
+        "seconds": round(time.time() - t0, 2),
+        "returncode": salida.returncode,
+        "timed_out": timed_out,
+        "cancelled": ejecucion.cancelled,
+        "mode": "inprocess",
+        # Lo que tardó el hilo en parar desde que se le pidió (None si no se canceló)
+        "stop_seconds": segundos_tras_cancelar,
+        "stdout": "".join(salida.stdout_lines)[-8000:],
+        "stderr": salida.stderr[-8000:],
+    }
+
+
+def procesar_linea_job(job: Job, source: str, linea: str) -> bool:
+    """Convierte la salida de un extractor en eventos del job."""
+    if linea.startswith("[PROGRESO]"):
+        campos = parsear_linea(linea)
+        datos = {k: int(v) if v.isdigit() else None for k, v in campos.items()}
+        terminado = datos.get("total") is not None and datos.get("procesados") == datos.get("total")
+        job.actualizar_progreso(source, datos, forzar=terminado)
+        return True
+    if linea.startswith("[ETAPA]"):
+        campos = parsear_linea(linea)
+        etapa = {"source": source, "stage": campos.get("nombre", "?"), "seconds": float(campos.get("segundos", 0) or 0)}
+        job.stages.append(etapa)
+        job.emit("stage", etapa)
+        return True
+    if linea.startswith("[ESCRITOR]"):
+        campos = parsear_linea(linea)
+        job.writers[source] = campos
+        job.emit("writer", {"source": source, **campos})
+        return True
+    job.emit("log", {"source": source, "line": linea})
+    return False
+
+
+def ejecutar_job(job: Job) -> None:
+    req = job.req
+    job.set_status("running")
+    with EJECUCIONES_LOCK:
+        EJECUCIONES.add(job.ejecucion)
+
+    def linea(source: str, texto: str) -> bool:
+        return procesar_linea_job(job, source, texto)
+
+    def sigue_vivo(source: str, segundos: float) -> None:
+        # Cancelado (o timeout) pero el hilo aún no ha parado: la fuente sigue sin darse por terminada
+        job.still_running.add(source)
+        job.emit("source_still_running", {"source": source, "seconds_since_cancel": segundos})
+
+    def correr(s: str) -> dict:
+        job.emit("source_started", {"source": s, "mode": req.mode})
+        if req.mode == "inprocess":
+            res = ejecutar_extractor_en_proceso(s, job.ejecucion, req.timeout_seconds, linea, forzar=req.force, perfil=req.profile, on_sigue_vivo=sigue_vivo)
+            job.still_running.discard(s)
+        else:
+            res = ejecutar_extractor(s, job.ejecucion, req.timeout_seconds, linea, forzar=req.force, perfil=req.profile)
+        job.emit("source_finished", {"source": s, "ok": res["ok"], "seconds": res["seconds"], "returncode": res["returncode"], "timed_out": res["timed_out"]})
+        return res
+
+    t0 = time.time()
+    status = "done"
+    try:
+        if req.clear_before:
+            t_clear = time.perf_counter()
+            clear()
+            etapa = {"source": None, "stage": "clear", "seconds": round(time.perf_counter() - t_clear, 3)}
+            job.stages.append(etapa)
+            job.emit("stage", etapa)
+
+        if req.parallel and len(req.sources) > 1:
+            workers = min(req.max_parallel, len(req.sources))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {s: pool.submit(correr, s) for s in req.sources}
+                results = {s: f.result() for s, f in futures.items()}
+        else:
+            results = {s: correr(s) for s in req.sources}
+
+        job.response = {
+            "requested": req.sources,
+            "parallel": req.parallel,
+            "mode": req.mode,
+            "cancelled": job.ejecucion.cancelled,
+            "total_seconds": round(time.time() - t0, 2),
+            "results": results,
+            "search_cache_invalidated": notificar_busqueda(),
+        }
+        if job.ejecucion.cancelled:
+            status = "cancelled"
+    except Exception as e:
+        job.error = str(e)
+        status = "failed"
+    finally:
+        with EJECUCIONES_LOCK:
+            EJECUCIONES.discard(job.ejecucion)
+        job.set_status(status)
+
 
-    return firestore.client()
+def obtener_job(job_id: str) -> Job:
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No existe el job {job_id}")
+    return job
 
 
-def delete_collection(db, collection_name: str, batch_size: int = 400) -> int:
-    deleted = 0
-    while True:
-        docs = list(db.collection(collection_name).limit(batch_size).stream())
-        if not docs:
-            break
-        batch = db.batch()
-        for doc in docs:
-            batch.delete(doc.reference)
-        batch.commit()
-        deleted += len(docs)
-    return deleted  # La idea de borrar por lotes es la recomendada por la doc. [web:335]
+def formatear_sse(ev: dict) -> str:
+    return f"id: {ev['id']}\nevent: {ev['event']}\ndata: {json.dumps(ev['data'], ensure_ascii=False)}\n\n"
 
 
 @app.get("/health")
@@ -78,13 +756,60 @@ def health():
 
 @app.post("/clear")
 def clear():
-    db = get_db()
-    deleted = {col: delete_collection(db, col) for col in WAREHOUSE_COLLECTIONS}
-    return {"cleared": True, "deleted_docs": deleted}
+    """
+    Vacía el almacén borrando todas las colecciones a la vez.
+    Si un /clear anterior se quedó a medias (hay checkpoint en disco), continúa desde ahí.
+    """
+    global ESTADO_BORRADO
+    vivos = extractores_cancelados_vivos()
+    if vivos:
+        raise HTTPException(status_code=409, detail=f"Extractores en proceso cancelados que aún no han parado: {', '.join(vivos)}")
+    if not CLEAR_LOCK.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Ya hay un borrado en curso (ver GET /clear/progress)")
+
+    try:
+        db = get_db()
+        estado = EstadoBorrado(CLEAR_ESTADO_FILE)
+        ESTADO_BORRADO = estado
+        t0 = time.time()
+
+        with ThreadPoolExecutor(max_workers=len(WAREHOUSE_COLLECTIONS), thread_name_prefix="clear") as pool:
+            futures = {col: pool.submit(delete_collection, db, col, estado) for col in WAREHOUSE_COLLECTIONS}
+            deleted = {col: f.result() for col, f in futures.items()}
+
+        estado.finalizar()
+    finally:
+        CLEAR_LOCK.release()
+
+    return {
+        "cleared": True,
+        "deleted_docs": deleted,
+        "resumed": estado.reanudado,
+        "seconds": round(time.time() - t0, 2),
+        "search_cache_invalidated": notificar_busqueda(incremental=False),
+    }
+
+
+@app.get("/clear/progress")
+def clear_progress():
+    """Documentos borrados por colección en el /clear en curso, o en uno interrumpido pendiente de reanudar."""
+    estado = ESTADO_BORRADO if CLEAR_LOCK.locked() and ESTADO_BORRADO is not None else EstadoBorrado(CLEAR_ESTADO_FILE)
+    return {
+        "running": CLEAR_LOCK.locked(),
+        "resumable": CLEAR_ESTADO_FILE.exists() and not CLEAR_LOCK.locked(),
+        "collections": estado.snapshot(),
+    }
 
 
 @app.post("/load")
 def load(req: LoadRequest):
+    """
+    Lanza la carga como job en segundo plano y devuelve su id al momento (202).
+    Si ya hay un job activo con las mismas fuentes y parámetros se devuelve ese (deduplicated=true).
+    Si no, 409 cuando alguna fuente ya se está cargando en otro job (dos extractores de la misma
+    fuente a la vez duplicarían estaciones) o cuando clear_before vaciaría el almacén bajo otro job.
+    Con wait=true se espera a que termine y se responde como antes.
+    """
     if not req.sources:
         raise HTTPException(status_code=400, detail="sources no puede estar vacío")
 
@@ -93,27 +818,116 @@ def load(req: LoadRequest):
         if not EXTRACTOR_FILES[s].exists():
             raise HTTPException(status_code=500, detail=f"No existe extractor: {EXTRACTOR_FILES[s]}")
 
-    if req.clear_before:
-        clear()
-
-    results = {}
-    for s in req.sources:
-        t0 = time.time()
-        proc = subprocess.run(
-            [sys.executable, str(EXTRACTOR_FILES[s])],
-            cwd=str(BASE_DIR),              # para que encuentre fuentes/credenciales como lo tienes ahora
-            capture_output=True,
-            text=True,
-        )  # Ejecutar scripts y devolver salida es un patrón típico con subprocess. [web:326]
-
-        results[s] = {
-            "ok": proc.returncode == 0,
-            "seconds": round(time.time() - t0, 2),
-            "returncode": proc.returncode,
-            "stdout": (proc.stdout or "")[-8000:],
-            "stderr": (proc.stderr or "")[-8000:],
-        }
-
-    return {"requested": req.sources, "results": results}
-
-
+    deduplicated = False
+    clave = (frozenset(req.sources), req.clear_before, req.force, req.mode)
+    with JOBS_LOCK:
+        activos = [j for j in JOBS.values() if not j.finished]
+        activo = next((j for j in activos if j.key == clave), None)
+        if activo is not None:
+            job, deduplicated = activo, True
+        else:
+            for j in activos:
+                comunes = sorted(set(req.sources) & set(j.req.sources))
+                if comunes:
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"El job {j.id} ya está cargando {', '.join(comunes)}",
+                    )
+                if req.clear_before or j.req.clear_before:
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"El job {j.id} está en curso y clear_before borra todo el almacén",
+                    )
+            job = Job(req)
+            JOBS[job.id] = job
+            # Se olvidan los jobs terminados más antiguos
+            terminados = sorted((j for j in JOBS.values() if j.finished), key=lambda j: j.created_at)
+            for viejo in terminados[:max(0, len(terminados) - MAX_JOBS_GUARDADOS)]:
+                JOBS.pop(viejo.id, None)
+
+    if req.wait:
+        if deduplicated:
+            with job._cond:
+                job._cond.wait_for(lambda: job.finished)
+        else:
+            ejecutar_job(job)
+        if job.status == "failed":
+            raise HTTPException(status_code=500, detail=job.error)
+        return job.response
+
+    if not deduplicated:
+        threading.Thread(target=ejecutar_job, args=(job,), daemon=True, name=f"job-{job.id}").start()
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job.id,
+            "status": job.status,
+            "deduplicated": deduplicated,
+            "status_url": f"/jobs/{job.id}",
+            "events_url": f"/jobs/{job.id}/events",
+        },
+    )
+
+
+@app.get("/jobs")
+def list_jobs():
+    with JOBS_LOCK:
+        jobs = sorted(JOBS.values(), key=lambda j: j.created_at, reverse=True)
+    return {"jobs": [{"job_id": j.id, "status": j.status, "sources": j.req.sources, "created_at": j.created_at} for j in jobs]}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    return obtener_job(job_id).summary()
+
+
+@app.get("/jobs/{job_id}/events")
+def job_events(
+    job_id: str,
+    after: int = Query(default=0, ge=0),
+    last_event_id: Optional[str] = Header(default=None),
+):
+    """
+    Server-Sent Events del job: progress, stage, log, source_started/finished, status y end.
+    Cada conexión dura como mucho SSE_MAX_SECONDS; EventSource reconecta solo enviando
+    Last-Event-ID y el stream continúa por el siguiente evento.
+    """
+    job = obtener_job(job_id)
+    if last_event_id and last_event_id.isdigit():
+        after = max(after, int(last_event_id))
+
+    def generar():
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        ultimo = after
+        fin = time.monotonic() + SSE_MAX_SECONDS
+        while True:
+            eventos, terminado = job.esperar_eventos(ultimo, timeout=SSE_KEEPALIVE_SECONDS)
+            for ev in eventos:
+                yield formatear_sse(ev)
+                ultimo = ev["id"]
+            if terminado:
+                yield f"event: end\ndata: {json.dumps({'status': job.status})}\n\n"
+                return
+            if not eventos:
+                yield ": keepalive\n\n"
+            if time.monotonic() >= fin:
+                return
+
+    return StreamingResponse(generar(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = obtener_job(job_id)
+    killed = job.ejecucion.cancelar()
+    return {"job_id": job.id, "status": job.status, "killed": killed}
+
+
+@app.post("/load/cancel")
+def cancel_load():
+    """Cancela las cargas en curso: mata los extractores vivos y descarta los pendientes."""
+    with EJECUCIONES_LOCK:
+        ejecuciones = list(EJECUCIONES)
+    killed = [s for e in ejecuciones for s in e.cancelar()]
+    return {"cancelled_loads": len(ejecuciones), "killed": killed}
@@ -1,18 +1,30 @@
 ﻿# src/cat/api_busqueda_cat.py
 from __future__ import annotations
 
+from itertools import islice
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 
-from .wrapper_cat import leer_cat_xml
+from COMUN import columnar, ndjson, perfilado
+from COMUN.cache_fuentes import CacheFuente, etag_coincide
+
+from .wrapper_cat import iterar_cat_xml, leer_cat_xml
 
 app = FastAPI(
     title="Wrapper CAT - API de búsqueda",
     version="1.0.0",
     description="Expone datos crudos de la fuente CAT (XML) para que los consuma el extractor.",
 )  # patrón básico FastAPI [web:57]
+# X-Perfil: 1 -> perfil de la petición; GET /profiles (COMUN/perfilado.py)
+perfilado.instalar(app, "cat")
+# Los endpoints de datos van en un router para poder montarlos también en el gateway
+# (GATEWAY/api_gateway.py), que sirve las tres fuentes desde un solo proceso
+router = APIRouter(tags=["CAT"])
 
 XML_FILE = Path("ITV-CAT.xml")
+# Registros ya parseados; se vuelve a leer el fichero solo si cambia (y el ETag con él)
+cache_xml = CacheFuente(XML_FILE, leer_cat_xml)
 
 
 
@@ -23,20 +35,40 @@ def health():
         "status": "ok",
         "xml_exists": XML_FILE.exists(),
         "xml_path": str(XML_FILE.resolve()),
+        "cache": cache_xml.stats(),
     }
 
 
 
 
-@app.get("/cat/records")
+def respuesta_columnar(if_none_match: str | None) -> Response:
+    datos, etag = cache_xml.obtener_columnar()
+    if not etag:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No se pudieron leer registros. ¿Existe el XML en {XML_FILE.resolve()}?",
+        )
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=datos, media_type=columnar.MEDIA_TYPE, headers={"ETag": etag})
+
+
+@router.get("/cat/records")
 def cat_records(
+    response: Response,
+    if_none_match: str | None = Header(default=None),
+    accept: str | None = Header(default=None),
     limit: int | None = Query(default=None, ge=1, le=50000),
 ):
     """
     Devuelve registros RAW obtenidos del XML (sin modificar).
     limit ayuda a probar sin devolver todo.
     """
-    records = leer_cat_xml(XML_FILE)
+    # Accept: application/x-msgpack -> instantánea columnar de toda la fuente (cacheada en disco)
+    if columnar.pedido(accept) and not limit:
+        return respuesta_columnar(if_none_match)
+
+    records, etag = cache_xml.obtener()
 
     if not records:
         raise HTTPException(
@@ -44,9 +76,43 @@ def cat_records(
             detail=f"No se pudieron leer registros. ¿Existe el XML en {XML_FILE.resolve()}?",
         )
 
+    # Sin cambios desde la versión que ya tiene el cliente: ni se serializa ni se envía nada
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
     return records[:limit] if limit else records
 
 
+@router.get("/cat/records/stream")
+def cat_records_stream(
+    if_none_match: str | None = Header(default=None),
+    limit: int | None = Query(default=None, ge=1),
+):
+    """
+    Los mismos registros RAW en NDJSON (un JSON por línea), enviados según se leen del XML:
+    ni el wrapper ni el extractor tienen nunca la lista entera en memoria.
+    - ETag / If-None-Match igual que /cat/records (304 si no ha cambiado).
+    - X-Total-Count solo si ya se sabe sin leer el fichero (la caché tiene ese mismo contenido).
+    """
+    if not XML_FILE.exists():
+        raise HTTPException(
+            status_code=404,
+            detail=f"No se pudieron leer registros. ¿Existe el XML en {XML_FILE.resolve()}?",
+        )
+
+    etag, total = cache_xml.etag_sin_parsear()
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
 
+    headers = {"ETag": etag}
+    if total is not None:
+        headers["X-Total-Count"] = str(total)
+    registros = iterar_cat_xml(XML_FILE)
+    if limit:
+        registros = islice(registros, limit)
+    return StreamingResponse(ndjson.codificar(registros), media_type=ndjson.MEDIA_TYPE, headers=headers)
 
 
+# Al final: include_router copia las rutas que el router tenga en este momento
+app.include_router(router)
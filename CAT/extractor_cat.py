@@ -1,19 +1,37 @@
 ﻿from __future__ import annotations
 
+import argparse
 import re
+import sys
+import time
 import unicodedata
-import requests
 import os
+from typing import Iterator
 
-import firebase_admin
-from firebase_admin import credentials, firestore
-from google.cloud.firestore_v1.base_query import FieldFilter
+# Al lanzarse como script (python CAT/extractor_cat.py) la raíz del proyecto no está en sys.path
+PROJECT_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT_PATH not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT_PATH)
+
+from COMUN import almacen, columnar, ndjson, perfilado
+from COMUN.cargas import guardar_etag, leer_etag
+from COMUN.contadores import AsignadorIds
+from COMUN.escritor import ErrorEscritura, crear_escritor, formatear_stats
+from COMUN.indice_lugares import IndiceLugares
+from COMUN.progreso import reportar_etapa, reportar_progreso
 
 # -------------------------
 # Configuración
 # -------------------------
-CAT_API_BASE = "http://127.0.0.1:8040" 
+# Donde levantes api_busqueda_cat.py (o el gateway: ITV_CAT_API_BASE=http://127.0.0.1:8060)
+CAT_API_BASE = os.environ.get("ITV_CAT_API_BASE", "http://127.0.0.1:8040")
 CAT_RECORDS_URL = f"{CAT_API_BASE}/cat/records"
+CAT_STREAM_URL = f"{CAT_API_BASE}/cat/records/stream"
+FUENTE = "CAT"
+# ITV_FORZAR_CARGA=1: cargar aunque la fuente no haya cambiado (la API de carga lo pone con force=true)
+FORZAR_CARGA = os.environ.get("ITV_FORZAR_CARGA") == "1"
+# ITV_PERFIL=pstats|collapsed (o --profile): perfil de main() en .perfiles/ (COMUN/perfilado.py)
+PERFIL = os.environ.get("ITV_PERFIL") or None
 
 # Ruta de credenciales
 BASE_DIR = os.path.dirname(os.path.abspath(__file__)) 
@@ -50,16 +68,6 @@ def ajustar_contacto(correo_origen: str) -> str:
         return correo_origen.strip()
     return f"INVALID_CONTACT_{correo_origen}"
 
-def get_starting_counter(db, collection_name: str) -> int:
-    docs = db.collection(collection_name).stream()
-    max_id = 0
-    for doc in docs:
-        try:
-            num = int(doc.id)
-            max_id = max(max_id, num)
-        except ValueError: pass
-    return max_id + 1
-
 def get_existing_names(db, collection_name: str) -> set[str]:
     """Devuelve un conjunto (set) con los nombres de las estaciones que ya existen en la BD."""
     existing = set()
@@ -100,54 +108,77 @@ def ajustar_coordenada(valor_float: float, es_latitud: bool) -> float:
 # -------------------------
 # Main
 # -------------------------
-def obtener_registros_raw() -> list[dict]:
+def obtener_registros_raw(etag_previo: str | None = None) -> tuple[Iterator[dict] | None, int | None, str]:
+    """
+    (registros, total, etag) del NDJSON del wrapper: los registros se van leyendo según se procesan.
+    registros=None si el wrapper responde 304 (sin cambios desde etag_previo); total=None si no lo anuncia.
+    """
     try:
-        print(f"[INFO] Conectando a {CAT_RECORDS_URL}...")
-        resp = requests.get(CAT_RECORDS_URL, timeout=60)
-        resp.raise_for_status()
-        return resp.json()
+        if columnar.ACTIVO:  # ITV_TRANSPORTE=columnar: toda la fuente de una vez, por columnas
+            print(f"[INFO] Conectando a {CAT_RECORDS_URL} (columnar)...")
+            return columnar.pedir(CAT_RECORDS_URL, etag_previo)
+        print(f"[INFO] Conectando a {CAT_STREAM_URL}...")
+        return ndjson.pedir(CAT_STREAM_URL, etag_previo)
     except Exception as e:
         print(f"[ERROR] Fallo al conectar con el Wrapper: {e}")
-        return []
+        return iter(()), None, ""
 
 def init_firestore():
-    if not firebase_admin._apps:
-        cred = credentials.Certificate(CREDENTIALS_FILE)
-        firebase_admin.initialize_app(cred)
-    return firestore.client()
+    return almacen.abrir(CREDENTIALS_FILE)
 
-def main():
-    print("[INFO] Extractor CAT: Iniciando proceso...")
-    data_cat = obtener_registros_raw()
-    
-    if not data_cat:
-        print(f"[ERROR] No hay datos. Revisa puerto 8040.")
-        return
+def main(db=None, modo_escritor: str | None = None, forzar: bool = FORZAR_CARGA, perfil: str | None = PERFIL):
+    """
+    db: cliente ya abierto (la API de carga reutiliza el suyo); None = conectar aquí.
+    modo_escritor: "concurrente" o "serie"; None = ITV_ESCRITOR (por defecto concurrente).
+    forzar: cargar aunque la fuente no haya cambiado desde la última carga (ETag).
+    perfil: "pstats" (cProfile) o "collapsed" (muestreo); None = sin perfil.
+    """
+    if perfil:
+        with perfilado.perfilar("extractor_cat", perfil):
+            return main(db, modo_escritor, forzar, perfil=None)
 
+    print("[INFO] Extractor CAT: Iniciando proceso...")
+    t_etapa = time.perf_counter()
     try:
-        db = init_firestore()
+        if db is None:
+            db = init_firestore()
         print("[INFO] Conexión a Firebase exitosa.")
+        t_etapa = reportar_etapa("conexion_firestore", t_etapa)
     except Exception as e:
         print(f"[ERROR] Error conectando a Firebase: {e}")
         return
 
-    batch = db.batch()
+    data_cat, total_registros, etag = obtener_registros_raw(None if forzar else leer_etag(db, FUENTE))
+    t_etapa = reportar_etapa("obtener_registros", t_etapa)
+
+    if data_cat is None:
+        print(f"[INFO] La fuente CAT no ha cambiado desde la última carga ({etag}); no hay nada que cargar.")
+        return
+
+    escritor = crear_escritor(db, modo_escritor)
     registros_insertados = 0
+    registros_leidos = 0
 
-    provincia_counter = get_starting_counter(db, "provincias")
-    localidad_counter = get_starting_counter(db, "localidades")
-    estacion_counter = get_starting_counter(db, "estaciones")
+    # Ids alquilados por bloques al contador compartido: sin recorrer colecciones y
+    # seguro aunque otro extractor cargue a la vez
+    ids_provincias = AsignadorIds(db, "provincias")
+    ids_localidades = AsignadorIds(db, "localidades")
+    ids_estaciones = AsignadorIds(db, "estaciones")
 
     nombres_existentes = get_existing_names(db, "estaciones")
+    t_etapa = reportar_etapa("nombres_existentes", t_etapa)
+    # Provincias y localidades de una vez: 2 consultas en lugar de una por municipio nuevo
+    lugares = IndiceLugares().cargar(db)
+    t_etapa = reportar_etapa("indice_lugares", t_etapa)
 
-    provincia_ids = {}
-    localidad_ids = {}
     estaci_vistas = {}
     estaciones_por_municipio = {}
 
-    print(f"[INFO] Procesando {len(data_cat)} registros...")
+    print("[INFO] Procesando registros según llegan del wrapper...")
 
     for i, registro in enumerate(data_cat, start=1):
+        registros_leidos = i
+        reportar_progreso(i - 1, total_registros, registros_insertados)
         try:
             # 1. Identificador básico
             raw_estaci = (registro.get("estaci") or "").strip()
@@ -244,30 +275,18 @@ def main():
             estaciones_por_municipio[municipio_norm] = nuevo_indice
 
             # Provincia
-            if provincia_nombre in provincia_ids:
-                p_codigo = provincia_ids[provincia_nombre]
-            else:
-                docs_prov = list(db.collection("provincias").where(filter=FieldFilter("nombre", "==", provincia_nombre)).limit(1).stream())
-                if docs_prov:
-                    p_codigo = docs_prov[0].id
-                else:
-                    p_codigo = f"{provincia_counter:04d}"
-                    provincia_counter += 1
-                    batch.set(db.collection("provincias").document(p_codigo), {"codigo": p_codigo, "nombre": provincia_nombre}, merge=True)
-                provincia_ids[provincia_nombre] = p_codigo
+            p_codigo = lugares.provincia(provincia_nombre)
+            if p_codigo is None:
+                p_codigo = f"{ids_provincias.siguiente():04d}"
+                escritor.set(db.collection("provincias").document(p_codigo), {"codigo": p_codigo, "nombre": provincia_nombre}, merge=True)
+                lugares.registrar_provincia(provincia_nombre, p_codigo)
 
             # Localidad
-            if municipio_norm in localidad_ids:
-                l_codigo = localidad_ids[municipio_norm]
-            else:
-                docs_loc = list(db.collection("localidades").where(filter=FieldFilter("nombre", "==", municipio_norm)).limit(1).stream())
-                if docs_loc:
-                    l_codigo = docs_loc[0].id
-                else:
-                    l_codigo = f"{localidad_counter:04d}"
-                    localidad_counter += 1
-                    batch.set(db.collection("localidades").document(l_codigo), {"codigo": l_codigo, "nombre": municipio_norm, "provincia_codigo": p_codigo}, merge=True)
-                localidad_ids[municipio_norm] = l_codigo
+            l_codigo = lugares.localidad(municipio_norm, p_codigo)
+            if l_codigo is None:
+                l_codigo = f"{ids_localidades.siguiente():04d}"
+                escritor.set(db.collection("localidades").document(l_codigo), {"codigo": l_codigo, "nombre": municipio_norm, "provincia_codigo": p_codigo}, merge=True)
+                lugares.registrar_localidad(municipio_norm, p_codigo, l_codigo)
 
             # Estación
             raw_direccion = registro.get("adre_a", "")
@@ -276,10 +295,9 @@ def main():
             raw_tel = (registro.get("tel_atenc_public") or "").strip()
             contacto_final = raw_tel if raw_tel else ajustar_contacto(raw_correo)
 
-            cod_estacion = f"{estacion_counter:05d}"
-            estacion_counter += 1
+            cod_estacion = f"{ids_estaciones.siguiente():05d}"
 
-            batch.set(
+            escritor.set(
                 db.collection("estaciones").document(cod_estacion),
                 {
                     "nombre": nombre_estacion,
@@ -294,20 +312,34 @@ def main():
                     "contacto": contacto_final,
                     "URL": str(registro.get("web", "")),
                     "localidad_codigo": l_codigo,
+                    "provincia_codigo": p_codigo,
                 },
             )
 
             registros_insertados += 1
-            if registros_insertados % 500 == 0:
-                print(f"[INFO] Insertados {registros_insertados}...")
-                batch.commit()
-                batch = db.batch()
 
+        except ErrorEscritura:
+            raise
         except Exception as e:
             print(f"[ERROR] Excepción registro {i}: {e}")
 
-    batch.commit()
+    reportar_progreso(registros_leidos, registros_leidos, registros_insertados)
+    t_etapa = reportar_etapa("procesado", t_etapa)
+
+    print(formatear_stats(escritor.cerrar()))
+    # Lo que sobró de los bloques de ids vuelve al contador (si nadie ha reservado después)
+    for asignador in (ids_provincias, ids_localidades, ids_estaciones):
+        asignador.liberar()
+    reportar_etapa("commit_final", t_etapa)
+    if not registros_leidos:
+        print(f"[ERROR] No hay datos. Revisa el wrapper en {CAT_API_BASE}.")
+        return
+    # La próxima carga se salta la fuente si el wrapper sigue devolviendo este ETag
+    guardar_etag(db, FUENTE, etag, registros_insertados)
     print(f"[INFO] Carga finalizada. {registros_insertados} estaciones insertadas.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extractor CAT: wrapper -> almacén")
+    parser.add_argument("--profile", nargs="?", const="pstats", default=PERFIL, choices=perfilado.FORMATOS,
+                        help="guardar un perfil de la carga en .perfiles/ (por defecto pstats)")
+    main(perfil=parser.parse_args().profile)
@@ -2,59 +2,82 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
 import xml.etree.ElementTree as ET
 
 
 
-def leer_cat_xml(xml_file_path: str | Path) -> list[dict[str, Any]]:
-    """
-    Wrapper CAT (sin HTTP):
-    - Lee el XML de Catalunya.
-    - Devuelve registros RAW como lista de dicts.
-    - NO hace mapping semántico, NO valida CP/provincia, NO toca Firestore.
-    """
-    path = Path(xml_file_path)
-    if not path.exists():
-        return []
-
-
-
-    try:
-        tree = ET.parse(path)
-        root = tree.getroot()
+def _registro_de_row(row_node: ET.Element) -> dict[str, Any]:
+    record: dict[str, Any] = {}
 
-        estaciones: list[dict[str, Any]] = []
+    for child in row_node:
+        # En tu script original ignorabas tags que empiezan por "_" (metadatos)
+        if child.tag.startswith("_"):
+            continue
 
-        # El XML parece tener nodos <row> con hijos como campos
-        for row_node in root.findall(".//row"):
-            record: dict[str, Any] = {}
+        # 1) Texto normal
+        if child.text and child.text.strip():
+            record[child.tag] = child.text.strip()
+        # 2) Algunos campos pueden venir como atributo url
+        elif child.attrib.get("url"):
+            record[child.tag] = child.attrib.get("url")
+        else:
+            record[child.tag] = ""
 
-            for child in row_node:
-                # En tu script original ignorabas tags que empiezan por "_" (metadatos)
-                if child.tag.startswith("_"):
-                    continue
+    return record
 
-                # 1) Texto normal
-                if child.text and child.text.strip():
-                    record[child.tag] = child.text.strip()
-                # 2) Algunos campos pueden venir como atributo url
-                elif child.attrib.get("url"):
-                    record[child.tag] = child.attrib.get("url")
-                else:
-                    record[child.tag] = ""
 
+def iterar_cat_xml(xml_file_path: str | Path) -> Iterator[dict[str, Any]]:
+    """
+    Wrapper CAT (sin HTTP), en streaming con iterparse:
+    - Lee el XML de Catalunya y devuelve (yield) un registro RAW por cada <row> interior.
+    - Cada <row> se suelta de su padre en cuanto se ha leído: la memoria no crece con el fichero.
+    - NO hace mapping semántico, NO valida CP/provincia, NO toca Firestore.
+    - Si el XML está mal formado lanza ET.ParseError (leer_cat_xml lo convierte en []).
+    """
+    path = Path(xml_file_path)
+    if not path.exists():
+        return
+
+    # El XML tiene un <row> que envuelve a los <row> de verdad (uno por estación):
+    # los que contienen otros <row> no son registros.
+    pila: list[ET.Element] = []
+    contenedoras: set[int] = set()
+
+    for evento, elem in ET.iterparse(path, events=("start", "end")):
+        if evento == "start":
+            if elem.tag == "row" and pila and pila[-1].tag == "row":
+                contenedoras.add(id(pila[-1]))
+            pila.append(elem)
+            continue
+
+        pila.pop()
+        if elem.tag != "row":
+            continue  # los campos se leen al cerrar su <row>
+
+        if id(elem) in contenedoras:
+            contenedoras.discard(id(elem))
+        else:
+            record = _registro_de_row(elem)
             # Igual que tu script: solo añadimos si hay campo "estaci" (identificador/nombre origen)
             if record and "estaci" in record:
-                estaciones.append(record)
+                yield record
 
-        return estaciones
+        # Ya procesado: fuera del árbol para que no se acumule
+        if pila:
+            pila[-1].remove(elem)
+        elem.clear()
 
+
+def leer_cat_xml(xml_file_path: str | Path) -> list[dict[str, Any]]:
+    """
+    Wrapper CAT (sin HTTP):
+    - Lee el XML de Catalunya.
+    - Devuelve registros RAW como lista de dicts.
+    - NO hace mapping semántico, NO valida CP/provincia, NO toca Firestore.
+    """
+    try:
+        return list(iterar_cat_xml(xml_file_path))
     except Exception:
         # Si queréis, aquí se puede loguear el error; el API se encargará del HTTP error.
         return []
-
-
-
-
-
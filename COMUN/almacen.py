@@ -0,0 +1,396 @@
+﻿# COMUN/almacen.py
+"""
+Almacén del proyecto: Firestore (por defecto) o un SQLite local, según ITV_ALMACEN.
+
+Los módulos (API de carga, API de búsqueda, extractores) siguen hablando con la interfaz
+del cliente de Firestore, y AlmacenSQLite implementa la parte que usan:
+
+    db.collection(c).document(id).get() / .set(datos, merge=...) / .delete()
+    db.collection(c).where(filter=FieldFilter(campo, "==" | "in" | ..., valor))
+        .select([...]).order_by(campo | "__name__", direction=...).start_after({...}).limit(n).stream()
+    db.batch() -> set/delete/commit, y transacciones con transaccional(db, fn)
+
+En SQLite cada documento es una fila (colección, id, JSON) y los campos por los que se
+filtra tienen índice de expresión (CAMPOS_INDEXADOS). Sirve para cargar y buscar sin un proyecto
+de Firestore (pruebas, benchmarks) y varios procesos pueden compartir el fichero.
+
+    ITV_ALMACEN=sqlite                     (por defecto: firestore)
+    ITV_ALMACEN_SQLITE=ruta.sqlite3        (por defecto: .almacen.sqlite3 en la raíz del proyecto)
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+BACKEND = os.environ.get("ITV_ALMACEN", "firestore")
+SQLITE_RUTA = os.environ.get("ITV_ALMACEN_SQLITE", str(PROJECT_ROOT / ".almacen.sqlite3"))
+
+# Lo mismo que FieldPath.document_id(): ordenar/filtrar por id de documento
+ID_DOCUMENTO = "__name__"
+DESCENDENTE = "DESCENDING"
+
+# Campos por los que filtran la búsqueda y los extractores (en estaciones, localidades y provincias)
+CAMPOS_INDEXADOS = ("nombre", "provincia_codigo", "localidad_codigo", "codigo_postal", "tipo")
+
+FILAS_POR_LECTURA = 1000   # filas que se sacan de SQLite de cada vez en stream()
+# Sin estadísticas el planificador de SQLite prefiere recorrer la clave primaria (ya ordenada
+# por id) antes que los índices de expresión: se rehacen (aproximadas) cada tantas escrituras
+ANALIZAR_CADA = 5000
+
+_OPERADORES = {"==": "=", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+
+
+def abrir(credenciales: Path | str | None = None):
+    """Cliente del almacén configurado (una instancia por proceso)."""
+    if BACKEND == "sqlite":
+        return almacen_sqlite()
+    if BACKEND != "firestore":
+        raise ValueError(f"ITV_ALMACEN desconocido: {BACKEND} (firestore | sqlite)")
+
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(str(credenciales)))
+    return firestore.client()
+
+
+def transaccional(db, fn: Callable[[Any], Any]) -> Any:
+    """fn(transaccion) de forma atómica (en Firestore se reintenta si hay conflicto)."""
+    if isinstance(db, AlmacenSQLite):
+        return db.ejecutar_transaccion(fn)
+    from firebase_admin import firestore
+
+    return firestore.transactional(fn)(db.transaction())
+
+
+_almacenes: dict[str, "AlmacenSQLite"] = {}
+_almacenes_lock = threading.Lock()
+
+
+def almacen_sqlite(ruta: Path | str | None = None) -> "AlmacenSQLite":
+    ruta = str(ruta or SQLITE_RUTA)
+    with _almacenes_lock:
+        if ruta not in _almacenes:
+            _almacenes[ruta] = AlmacenSQLite(ruta)
+        return _almacenes[ruta]
+
+
+def _expresion(campo: str) -> str:
+    if campo == ID_DOCUMENTO:
+        return "id"
+    if '"' in campo or "'" in campo:
+        raise ValueError(f"Nombre de campo no soportado: {campo!r}")
+    # Tiene que ser exactamente la misma expresión que la del índice para que SQLite lo use
+    return f"json_extract(datos, '$.\"{campo}\"')"
+
+
+class DocumentoSQLite:
+    """Lo que en Firestore es un DocumentSnapshot."""
+
+    def __init__(self, referencia: "ReferenciaSQLite", datos: Optional[dict]):
+        self.reference = referencia
+        self.id = referencia.id
+        self.exists = datos is not None
+        self._datos = datos
+
+    def to_dict(self) -> Optional[dict]:
+        return dict(self._datos) if self._datos is not None else None
+
+    def get(self, campo: str) -> Any:
+        if self._datos is None or campo not in self._datos:
+            raise KeyError(campo)
+        return self._datos[campo]
+
+
+class ReferenciaSQLite:
+    def __init__(self, almacen: "AlmacenSQLite", coleccion: str, id_documento: str):
+        self._almacen = almacen
+        self.coleccion = coleccion
+        self.id = id_documento
+
+    @property
+    def path(self) -> str:
+        return f"{self.coleccion}/{self.id}"
+
+    def get(self, transaction=None) -> DocumentoSQLite:
+        return DocumentoSQLite(self, self._almacen._leer(self.coleccion, self.id))
+
+    def set(self, datos: dict, merge: bool = False) -> None:
+        self._almacen._aplicar([("set", self, datos, merge)])
+
+    def delete(self) -> None:
+        self._almacen._aplicar([("delete", self)])
+
+    def __eq__(self, otra) -> bool:
+        return isinstance(otra, ReferenciaSQLite) and (otra.coleccion, otra.id) == (self.coleccion, self.id)
+
+    def __hash__(self) -> int:
+        return hash((self.coleccion, self.id))
+
+
+class ConsultaSQLite:
+    """Consulta inmutable como la de Firestore: cada método devuelve una nueva."""
+
+    def __init__(self, almacen: "AlmacenSQLite", coleccion: str, filtros=(), orden=(), campos=None, despues=None, limite=None):
+        self._almacen = almacen
+        self._coleccion = coleccion
+        self._filtros: tuple = tuple(filtros)
+        self._orden: tuple = tuple(orden)
+        self._campos: Optional[tuple] = campos
+        self._despues: Optional[tuple] = despues
+        self._limite: Optional[int] = limite
+
+    def _copia(self, **cambios) -> "ConsultaSQLite":
+        estado = dict(filtros=self._filtros, orden=self._orden, campos=self._campos, despues=self._despues, limite=self._limite)
+        estado.update(cambios)
+        return ConsultaSQLite(self._almacen, self._coleccion, **estado)
+
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value: Any = None, *, filter=None) -> "ConsultaSQLite":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in _OPERADORES and op_string not in ("in", "not-in"):
+            raise NotImplementedError(f"Operador no soportado en SQLite: {op_string}")
+        return self._copia(filtros=self._filtros + ((field_path, op_string, value),))
+
+    def select(self, campos) -> "ConsultaSQLite":
+        return self._copia(campos=tuple(campos))
+
+    def order_by(self, campo: str, direction: str = "ASCENDING") -> "ConsultaSQLite":
+        return self._copia(orden=self._orden + ((campo, direction == DESCENDENTE),))
+
+    def start_after(self, cursor) -> "ConsultaSQLite":
+        """cursor: {campo: valor} con los campos del order_by, o un documento ya leído."""
+        orden = self._orden_efectivo()
+        if isinstance(cursor, DocumentoSQLite):
+            datos = cursor.to_dict() or {}
+            valores = tuple(cursor.id if c == ID_DOCUMENTO else datos.get(c) for c, _ in orden)
+        else:
+            valores = tuple(cursor[c] for c, _ in orden if c in cursor)
+        return self._copia(despues=valores)
+
+    def limit(self, n: int) -> "ConsultaSQLite":
+        return self._copia(limite=n)
+
+    def _orden_efectivo(self) -> tuple:
+        # Como Firestore: si no se ordena por id, el id desempata al final
+        orden = self._orden or ((ID_DOCUMENTO, False),)
+        if orden[-1][0] != ID_DOCUMENTO:
+            orden = orden + ((ID_DOCUMENTO, orden[-1][1]),)
+        return orden
+
+    def _sql(self) -> tuple[str, list]:
+        condiciones = ["coleccion = ?"]
+        parametros: list = [self._coleccion]
+        for campo, op, valor in self._filtros:
+            expr = _expresion(campo)
+            if op in ("in", "not-in"):
+                valores = list(valor)
+                if not valores:
+                    condiciones.append("0" if op == "in" else "1")
+                    continue
+                marcas = ", ".join("?" * len(valores))
+                condiciones.append(f"{expr} {'IN' if op == 'in' else 'NOT IN'} ({marcas})")
+                parametros += valores
+            else:
+                condiciones.append(f"{expr} {_OPERADORES[op]} ?")
+                parametros.append(valor)
+
+        orden = self._orden_efectivo()
+        if self._despues:
+            usados = orden[:len(self._despues)]
+            if len({desc for _, desc in usados}) > 1:
+                raise NotImplementedError("start_after con direcciones de orden mezcladas")
+            exprs = ", ".join(_expresion(c) for c, _ in usados)
+            marcas = ", ".join("?" * len(usados))
+            condiciones.append(f"({exprs}) {'<' if usados[0][1] else '>'} ({marcas})")
+            parametros += list(self._despues)
+
+        sql = "SELECT id, datos FROM documentos WHERE " + " AND ".join(condiciones)
+        sql += " ORDER BY " + ", ".join(f"{_expresion(c)} {'DESC' if desc else 'ASC'}" for c, desc in orden)
+        if self._limite is not None:
+            sql += " LIMIT ?"
+            parametros.append(self._limite)
+        return sql, parametros
+
+    def stream(self) -> Iterator[DocumentoSQLite]:
+        sql, parametros = self._sql()
+        for id_documento, datos in self._almacen._consultar(sql, parametros):
+            datos = json.loads(datos)
+            if self._campos is not None:
+                datos = {c: datos[c] for c in self._campos if c in datos}
+            yield DocumentoSQLite(ReferenciaSQLite(self._almacen, self._coleccion, id_documento), datos)
+
+    def get(self) -> list[DocumentoSQLite]:
+        return list(self.stream())
+
+
+class ColeccionSQLite(ConsultaSQLite):
+    def __init__(self, almacen: "AlmacenSQLite", coleccion: str):
+        super().__init__(almacen, coleccion)
+        self.id = coleccion
+
+    def document(self, id_documento: Optional[str] = None) -> ReferenciaSQLite:
+        return ReferenciaSQLite(self._almacen, self._coleccion, id_documento or uuid.uuid4().hex[:20])
+
+
+class LoteSQLite:
+    """db.batch(): las operaciones se aplican juntas en una transacción de SQLite al hacer commit()."""
+
+    def __init__(self, almacen: "AlmacenSQLite"):
+        self._almacen = almacen
+        self._ops: list[tuple] = []
+
+    def set(self, referencia: ReferenciaSQLite, datos: dict, merge: bool = False) -> None:
+        self._ops.append(("set", referencia, datos, merge))
+
+    def delete(self, referencia: ReferenciaSQLite) -> None:
+        self._ops.append(("delete", referencia))
+
+    def commit(self) -> list:
+        ops, self._ops = self._ops, []
+        self._almacen._aplicar(ops)
+        return []
+
+
+class TransaccionSQLite(LoteSQLite):
+    """Dentro de ejecutar_transaccion: las lecturas ven el estado bloqueado y las escrituras se aplican al final."""
+
+
+class AlmacenSQLite:
+    """Cliente con la interfaz de firestore.Client que usa el proyecto, sobre un fichero SQLite."""
+
+    # El escritor no aplica la rampa 500/50/5 de Firestore (COMUN/escritor.py)
+    RAMPA = False
+
+    def __init__(self, ruta: Path | str = SQLITE_RUTA):
+        self.ruta = str(ruta)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.ruta, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")      # lectores y un escritor a la vez (varios procesos)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA analysis_limit=1000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documentos ("
+            " coleccion TEXT NOT NULL, id TEXT NOT NULL, datos TEXT NOT NULL,"
+            " PRIMARY KEY (coleccion, id))"
+        )
+        for campo in CAMPOS_INDEXADOS:
+            # Con el id al final, un filtro de igualdad ya sale en el orden de la paginación
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{campo} ON documentos (coleccion, {_expresion(campo)}, id)"
+            )
+        self._conn.execute("ANALYZE")
+        self._en_transaccion = False
+        self._sin_analizar = 0
+        self.lecturas = 0
+        self.escrituras = 0
+        self.consultas = 0
+
+    def collection(self, nombre: str) -> ColeccionSQLite:
+        return ColeccionSQLite(self, nombre)
+
+    def batch(self) -> LoteSQLite:
+        return LoteSQLite(self)
+
+    def get_all(self, referencias) -> Iterator[DocumentoSQLite]:
+        """Como firestore.Client.get_all: un documento por referencia (exists=False si no está)."""
+        for referencia in referencias:
+            yield referencia.get()
+
+    def ejecutar_transaccion(self, fn: Callable[[TransaccionSQLite], Any]) -> Any:
+        """BEGIN IMMEDIATE bloquea a los demás escritores (también de otros procesos) hasta el COMMIT."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._en_transaccion = True
+            try:
+                transaccion = TransaccionSQLite(self)
+                resultado = fn(transaccion)
+                self._escribir(transaccion._ops)
+                self._conn.execute("COMMIT")
+                return resultado
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._en_transaccion = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "sqlite", "lecturas": self.lecturas, "escrituras": self.escrituras, "consultas": self.consultas}
+
+    def cerrar(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # --- internos ---
+
+    def _leer(self, coleccion: str, id_documento: str) -> Optional[dict]:
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT datos FROM documentos WHERE coleccion = ? AND id = ?", (coleccion, id_documento)
+            ).fetchone()
+            self.lecturas += 1
+        return json.loads(fila[0]) if fila else None
+
+    def _consultar(self, sql: str, parametros: list) -> Iterator[tuple[str, str]]:
+        with self._lock:
+            cursor = self._conn.execute(sql, parametros)
+            self.consultas += 1
+        devueltas = 0
+        while True:
+            with self._lock:
+                filas = cursor.fetchmany(FILAS_POR_LECTURA)
+                # Como Firestore: cada documento devuelto es una lectura (y una consulta vacía cuenta una)
+                self.lecturas += len(filas) if (filas or devueltas) else 1
+            if not filas:
+                return
+            devueltas += len(filas)
+            yield from filas
+
+    def _aplicar(self, ops: list[tuple]) -> None:
+        if not ops:
+            return
+        with self._lock:
+            if self._en_transaccion:
+                self._escribir(ops)
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._escribir(ops)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            if self._sin_analizar >= ANALIZAR_CADA:
+                self._conn.execute("ANALYZE")
+                self._sin_analizar = 0
+
+    def _escribir(self, ops: list[tuple]) -> None:
+        for op in ops:
+            referencia = op[1]
+            if op[0] == "delete":
+                self._conn.execute(
+                    "DELETE FROM documentos WHERE coleccion = ? AND id = ?", (referencia.coleccion, referencia.id)
+                )
+            else:
+                _, _, datos, merge = op
+                if merge:
+                    fila = self._conn.execute(
+                        "SELECT datos FROM documentos WHERE coleccion = ? AND id = ?", (referencia.coleccion, referencia.id)
+                    ).fetchone()
+                    if fila:
+                        datos = {**json.loads(fila[0]), **datos}
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documentos (coleccion, id, datos) VALUES (?, ?, ?)",
+                    (referencia.coleccion, referencia.id, json.dumps(datos, ensure_ascii=False, default=str)),
+                )
+        self.escrituras += len(ops)
+        self._sin_analizar += len(ops)
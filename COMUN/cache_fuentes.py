@@ -0,0 +1,171 @@
+﻿# COMUN/cache_fuentes.py
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from COMUN import columnar
+
+# Instantáneas columnar ya codificadas (relativo al directorio desde el que se lanza el wrapper, como los datos)
+DIR_COLUMNAR = Path(".cache_fuentes")
+
+
+def sha256_fichero(ruta: Path, bloque: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with ruta.open("rb") as f:
+        for trozo in iter(lambda: f.read(bloque), b""):
+            h.update(trozo)
+    return h.hexdigest()
+
+
+class CacheFuente:
+    """
+    Registros ya parseados de un fichero fuente de un wrapper:
+    - si mtime y tamaño no cambian, se devuelven sin tocar el fichero (solo un stat);
+    - si cambian, se calcula el sha256: mismo contenido = misma caché (p. ej. un 'touch');
+    - si el contenido es otro, se vuelve a parsear con el lector del wrapper.
+    El ETag sale del sha256, así que es el mismo aunque se reinicie el wrapper.
+    """
+
+    def __init__(self, ruta: Path | str, lector: Callable[[Path], list[dict[str, Any]]], dir_columnar: Path | str = DIR_COLUMNAR):
+        self.ruta = Path(ruta)
+        self.lector = lector
+        self.dir_columnar = Path(dir_columnar)
+        self._lock = threading.Lock()
+        # Una sola petición construye la instantánea columnar; las demás esperan y la reutilizan
+        self._lock_columnar = threading.Lock()
+        self._firma: Optional[tuple[int, int]] = None   # (mtime_ns, tamaño)
+        self._sha: Optional[str] = None
+        self._registros: list[dict[str, Any]] = []
+        # Hash del fichero calculado solo para el ETag del streaming (sin parsear ni guardar registros)
+        self._firma_stream: Optional[tuple[int, int]] = None
+        self._sha_stream: Optional[str] = None
+        # Última instantánea columnar servida (bytes) y el ETag del contenido del que sale
+        self._columnar = b""
+        self._etag_columnar = ""
+        self.lecturas = 0
+        self.aciertos = 0
+
+    def obtener(self) -> tuple[list[dict[str, Any]], str]:
+        """(registros, etag); ([], "") si el fichero no existe."""
+        with self._lock:
+            try:
+                st = self.ruta.stat()
+            except FileNotFoundError:
+                self._firma, self._sha, self._registros = None, None, []
+                return [], ""
+
+            firma = (st.st_mtime_ns, st.st_size)
+            if firma != self._firma:
+                sha = sha256_fichero(self.ruta)
+                if sha != self._sha:
+                    self._registros = self.lector(self.ruta)
+                    self._sha = sha
+                    self.lecturas += 1
+                self._firma = firma
+            else:
+                self.aciertos += 1
+            return self._registros, self.etag()
+
+    def etag_sin_parsear(self) -> tuple[str, Optional[int]]:
+        """
+        (etag, total) del fichero tal como está ahora, sin parsearlo (para servirlo en streaming).
+        total solo se sabe si la caché ya tiene parseado ese mismo contenido; si no, None.
+        """
+        with self._lock:
+            try:
+                st = self.ruta.stat()
+            except FileNotFoundError:
+                return "", None
+            firma = (st.st_mtime_ns, st.st_size)
+            if firma == self._firma:
+                return self.etag(), len(self._registros)
+            if firma != self._firma_stream:
+                self._sha_stream = sha256_fichero(self.ruta)
+                self._firma_stream = firma
+            if self._sha_stream == self._sha:
+                return self.etag(), len(self._registros)
+            return f'"{self._sha_stream[:32]}"', None
+
+    def obtener_columnar(self) -> tuple[bytes, str]:
+        """
+        (instantánea columnar, etag); (b"", "") si el fichero no existe.
+        Se guarda en disco con el hash del contenido en el nombre: tras reiniciar el wrapper
+        se sirve sin parsear la fuente ni volver a codificarla.
+        """
+        etag, _ = self.etag_sin_parsear()
+        if not etag:
+            return b"", ""
+        with self._lock:
+            if etag == self._etag_columnar:
+                return self._columnar, etag
+
+        with self._lock_columnar:
+            with self._lock:
+                if etag == self._etag_columnar:
+                    return self._columnar, etag
+            try:
+                datos = self._fichero_columnar(etag).read_bytes()
+            except FileNotFoundError:
+                registros, etag = self.obtener()
+                if not etag:
+                    return b"", ""
+                datos = columnar.codificar(registros)
+                self._guardar_columnar(datos, etag)
+
+            with self._lock:
+                self._columnar, self._etag_columnar = datos, etag
+            return datos, etag
+
+    def _guardar_columnar(self, datos: bytes, etag: str) -> None:
+        """
+        Escribe la instantánea con un temporal de nombre único y la renombra: otro proceso
+        (varios workers comparten el directorio) puede estar escribiendo la misma a la vez,
+        y como el nombre lleva el hash del contenido, gane quien gane el fichero es el mismo.
+        """
+        fichero = self._fichero_columnar(etag)
+        self.dir_columnar.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.dir_columnar, prefix=f"{fichero.name}.", suffix=".tmp", delete=False) as tmp:
+            tmp.write(datos)
+        try:
+            os.replace(tmp.name, fichero)
+        except OSError:
+            # En Windows no se puede reemplazar un fichero abierto: si ya está, vale el que hay
+            Path(tmp.name).unlink(missing_ok=True)
+            if not fichero.exists():
+                raise
+        # Las de versiones anteriores de esta fuente ya no las va a pedir nadie
+        for viejo in self.dir_columnar.glob(f"{self.ruta.name}.*.msgpack"):
+            if viejo != fichero:
+                viejo.unlink(missing_ok=True)
+
+    def _fichero_columnar(self, etag: str) -> Path:
+        sha = etag.strip('"')
+        return self.dir_columnar / f"{self.ruta.name}.{sha}.msgpack"
+
+    def etag(self) -> str:
+        return f'"{self._sha[:32]}"' if self._sha else ""
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "registros": len(self._registros),
+                "etag": self.etag(),
+                "lecturas": self.lecturas,
+                "aciertos": self.aciertos,
+                "columnar": len(self._columnar) if self._etag_columnar else None,
+            }
+
+
+def etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    """Cabecera If-None-Match (lista, '*' o débil W/"...") contra el ETag actual."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidatos = [c.strip().removeprefix("W/") for c in if_none_match.split(",")]
+    return etag in candidatos
@@ -0,0 +1,26 @@
+﻿# COMUN/cargas.py
+from __future__ import annotations
+
+import time
+from typing import Optional
+
+
+# Un documento por fuente con lo último que se cargó: cargas/{GAL|CAT|CV}.etag
+# /clear lo borra con el resto del almacén, así que tras vaciarlo se vuelve a cargar todo
+CARGAS_COLLECTION = "cargas"
+
+
+def leer_etag(db, fuente: str) -> Optional[str]:
+    """ETag de la fuente en la última carga completa (None si no hay)."""
+    snap = db.collection(CARGAS_COLLECTION).document(fuente).get()
+    if not snap.exists:
+        return None
+    return (snap.to_dict() or {}).get("etag") or None
+
+
+def guardar_etag(db, fuente: str, etag: str, registros: int) -> None:
+    if not etag:
+        return
+    db.collection(CARGAS_COLLECTION).document(fuente).set(
+        {"fuente": fuente, "etag": etag, "registros": registros, "fecha": time.time()}
+    )
@@ -0,0 +1,124 @@
+﻿# COMUN/columnar.py
+"""
+Transporte columnar (opcional) de los registros raw entre wrappers y extractores.
+
+En JSON cada registro repite todas sus claves ("NOME DA ESTACIÓN", "horari_de_servei"...);
+aquí se envía una lista por columna, en msgpack:
+
+    {"version": 1, "filas": N, "columnas": [
+        {"nombre": k, "valores": [...]}                  # tal cual
+        {"nombre": k, "dic": [...], "idx": [...]}         # columnas con muchos repetidos
+        ... + "ausentes": [filas sin esa clave] si alguna no la tiene
+    ]}
+
+Necesita msgpack (pip install msgpack); sin él todo sigue en JSON/NDJSON.
+Los wrappers lo sirven en /x/records con 'Accept: application/x-msgpack' y los
+extractores lo piden con ITV_TRANSPORTE=columnar.
+"""
+from __future__ import annotations
+
+import os
+from typing import Any, Iterable, Iterator, Optional
+
+import requests
+
+try:
+    import msgpack
+except ImportError:  # dependencia opcional
+    msgpack = None
+
+MEDIA_TYPE = "application/x-msgpack"
+VERSION = 1
+DISPONIBLE = msgpack is not None
+# Lo activa quien lanza el extractor; sin msgpack se ignora y se usa NDJSON
+ACTIVO = DISPONIBLE and os.environ.get("ITV_TRANSPORTE") == "columnar"
+
+
+def pedido(accept: Optional[str]) -> bool:
+    """¿El cliente acepta columnar (y este proceso sabe generarlo)?"""
+    return DISPONIBLE and bool(accept) and MEDIA_TYPE in accept
+
+
+def _columna(nombre: str, valores: list, ausentes: list[int]) -> dict:
+    col: dict[str, Any] = {"nombre": nombre}
+    # Diccionario solo para texto: como clave de dict, 1 == 1.0 == True se mezclarían
+    distintos = None
+    if all(v is None or isinstance(v, str) for v in valores):
+        distintos = {v: None for v in valores}   # dict: conserva el orden de aparición
+    if distintos is not None and len(distintos) * 2 <= len(valores):
+        posicion = {v: i for i, v in enumerate(distintos)}
+        col["dic"] = list(distintos)
+        col["idx"] = [posicion[v] for v in valores]
+    else:
+        col["valores"] = valores
+    if ausentes:
+        col["ausentes"] = ausentes
+    return col
+
+
+def codificar(registros: Iterable[dict[str, Any]]) -> bytes:
+    registros = list(registros)
+    nombres: dict[str, None] = {}
+    for r in registros:
+        for k in r:
+            nombres.setdefault(k, None)
+
+    columnas = []
+    for nombre in nombres:
+        valores, ausentes = [], []
+        for i, r in enumerate(registros):
+            if nombre in r:
+                valores.append(r[nombre])
+            else:
+                valores.append(None)
+                ausentes.append(i)
+        columnas.append(_columna(nombre, valores, ausentes))
+
+    return msgpack.packb({"version": VERSION, "filas": len(registros), "columnas": columnas}, use_bin_type=True)
+
+
+def decodificar(datos: bytes) -> tuple[int, Iterator[dict[str, Any]]]:
+    """
+    (filas, registros): las columnas se decodifican de una vez y los dicts se montan
+    según se recorren. Los valores repetidos de una columna con diccionario son el
+    mismo objeto en todas las filas.
+    """
+    obj = msgpack.unpackb(datos, raw=False)
+    if obj.get("version") != VERSION:
+        raise ValueError(f"Formato columnar v{obj.get('version')} no soportado (se espera v{VERSION})")
+    filas = obj["filas"]
+
+    columnas = []
+    for col in obj["columnas"]:
+        if "dic" in col:
+            dic = col["dic"]
+            valores = [dic[j] for j in col["idx"]]
+        else:
+            valores = col["valores"]
+        columnas.append((col["nombre"], valores, set(col.get("ausentes") or ())))
+
+    def generar() -> Iterator[dict[str, Any]]:
+        for i in range(filas):
+            yield {nombre: valores[i] for nombre, valores, ausentes in columnas if i not in ausentes}
+
+    return filas, generar()
+
+
+def pedir(url: str, etag_previo: Optional[str] = None, timeout=(5, 120)) -> tuple[Optional[Iterator[dict[str, Any]]], Optional[int], str]:
+    """
+    Lado extractor, con la misma forma que ndjson.pedir: (registros, total, etag).
+    Si el wrapper no sabe generar columnar contesta en JSON y también vale.
+    """
+    headers = {"Accept": f"{MEDIA_TYPE}, application/json;q=0.5"}
+    if etag_previo:
+        headers["If-None-Match"] = etag_previo
+    resp = requests.get(url, headers=headers, timeout=timeout)
+    if resp.status_code == 304:
+        return None, None, etag_previo or ""
+    resp.raise_for_status()
+    etag = resp.headers.get("ETag", "")
+    if resp.headers.get("Content-Type", "").startswith(MEDIA_TYPE):
+        total, registros = decodificar(resp.content)
+        return registros, total, etag
+    datos = resp.json()
+    return iter(datos), len(datos), etag
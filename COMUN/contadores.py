@@ -0,0 +1,111 @@
+﻿# COMUN/contadores.py
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+from COMUN import almacen
+
+
+# Un documento por colección con el siguiente id libre: contadores/{coleccion}.siguiente
+CONTADORES_COLLECTION = "contadores"
+
+# Ids que se reservan de una vez: una transacción (1 lectura + 1 escritura) por bloque
+BLOQUE_IDS = 1000
+# Provincias y localidades se crean con cuentagotas (decenas y cientos por carga) y sus ids tienen
+# 4 cifras: un bloque de 1000 que no se puede devolver (otro extractor reservó después) se pierde
+BLOQUES_POR_COLECCION = {"provincias": 10, "localidades": 100}
+
+
+def ultimo_id_numerico(db, collection_name: str) -> int:
+    """
+    Mayor id numérico de la colección (0 si está vacía o no hay ids numéricos).
+    Recorre todos los ids (sin campos): el orden de id es de texto y los ids se salen
+    de su ancho (f"{n:05d}" pasa de "99999" a "100000"), así que el último en orden
+    de id no es el mayor. Solo se llama al crear el contador de la colección.
+    """
+    mayor = 0
+    for d in db.collection(collection_name).select([]).stream():
+        if d.id.isdigit():
+            mayor = max(mayor, int(d.id))
+    return mayor
+
+
+def reservar_ids(db, collection_name: str, cantidad: int) -> int:
+    """
+    Reserva 'cantidad' ids consecutivos de forma atómica y devuelve el primero.
+    Si el contador aún no existe se inicializa con el último id de la colección,
+    así que sirve también para almacenes cargados antes de existir contadores.
+    Dos extractores en paralelo nunca reciben el mismo rango: si chocan, Firestore
+    reintenta la transacción (en SQLite el segundo espera al bloqueo) y lee el contador ya actualizado.
+    """
+    ref = db.collection(CONTADORES_COLLECTION).document(collection_name)
+
+    def _reservar(transaction) -> int:
+        snap = ref.get(transaction=transaction)
+        if snap.exists:
+            siguiente = int(snap.get("siguiente"))
+        else:
+            siguiente = ultimo_id_numerico(db, collection_name) + 1
+        transaction.set(ref, {"siguiente": siguiente + cantidad})
+        return siguiente
+
+    return almacen.transaccional(db, _reservar)
+
+
+def devolver_ids(db, collection_name: str, desde: int, hasta: int) -> bool:
+    """
+    Devuelve al contador el rango [desde, hasta) sin usar, solo si nadie ha reservado
+    después (contador == hasta). Así una carga normal deja los ids sin huecos.
+    """
+    ref = db.collection(CONTADORES_COLLECTION).document(collection_name)
+
+    def _devolver(transaction) -> bool:
+        snap = ref.get(transaction=transaction)
+        if not snap.exists or int(snap.get("siguiente")) != hasta:
+            return False
+        transaction.set(ref, {"siguiente": desde})
+        return True
+
+    return almacen.transaccional(db, _devolver)
+
+
+class AsignadorIds:
+    """
+    Entrega ids de una colección alquilando bloques en el contador compartido (BLOQUE_IDS,
+    o el de BLOQUES_POR_COLECCION):
+    - crear el asignador no lee nada; el primer bloque se pide con el primer id;
+    - después, una transacción por bloque, sin importar el tamaño del almacén;
+    - liberar() al terminar devuelve lo que sobró del último bloque si se puede.
+    Es seguro entre hilos (el pipeline de CV pide ids desde varios).
+    """
+
+    def __init__(self, db, collection_name: str, bloque: Optional[int] = None):
+        self.db = db
+        self.collection_name = collection_name
+        self.bloque = bloque or BLOQUES_POR_COLECCION.get(collection_name, BLOQUE_IDS)
+        self._lock = threading.Lock()
+        self._siguiente = 0
+        self._fin = 0  # primer id fuera del bloque actual
+        self.bloques_reservados = 0
+
+    def siguiente(self) -> int:
+        with self._lock:
+            if self._siguiente >= self._fin:
+                self._siguiente = reservar_ids(self.db, self.collection_name, self.bloque)
+                self._fin = self._siguiente + self.bloque
+                self.bloques_reservados += 1
+            valor = self._siguiente
+            self._siguiente += 1
+            return valor
+
+    def liberar(self) -> Optional[int]:
+        """Devuelve el resto del bloque actual; retorna cuántos ids se devolvieron (None si no se pudo)."""
+        with self._lock:
+            if self._siguiente >= self._fin:
+                return 0
+            sobrantes = self._fin - self._siguiente
+            if not devolver_ids(self.db, self.collection_name, self._siguiente, self._fin):
+                return None
+            self._fin = self._siguiente
+            return sobrantes
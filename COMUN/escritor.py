@@ -0,0 +1,245 @@
+﻿# COMUN/escritor.py
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from COMUN.progreso import CargaCancelada, comprobar_cancelacion, evento_cancelacion
+
+from google.api_core import exceptions as gexc
+
+
+# Errores de Firestore en los que merece la pena reintentar (contención, cuota, red)
+ERRORES_TRANSITORIOS = (
+    gexc.Aborted,
+    gexc.DeadlineExceeded,
+    gexc.ResourceExhausted,
+    gexc.ServiceUnavailable,
+    gexc.InternalServerError,
+)
+
+LOTE_MAX = 500                  # escrituras por commit (límite de Firestore)
+MAX_EN_VUELO = 8                # commits simultáneos del escritor concurrente
+MAX_REINTENTOS = 6
+BACKOFF_BASE = 0.5              # segundos; se dobla en cada reintento
+BACKOFF_MAX = 16.0
+
+# Rampa 500/50/5: empezar en 500 escrituras/s y subir un 50% cada 5 minutos
+# (ITV_ESCRITOR_RITMO cambia el punto de partida, p. ej. contra un almacén ya "caliente")
+RAMPA_INICIAL = float(os.environ.get("ITV_ESCRITOR_RITMO", "500"))
+RAMPA_FACTOR = 1.5
+RAMPA_FASE_SEGUNDOS = 300.0
+
+# "concurrente" (por defecto) o "serie" (un commit bloqueante cada LOTE_MAX, como antes)
+MODO_POR_DEFECTO = os.environ.get("ITV_ESCRITOR", "concurrente")
+
+
+class ErrorEscritura(Exception):
+    """Un lote no se pudo confirmar ni con reintentos; la carga no debe seguir como si nada."""
+
+
+class LimitadorRampa:
+    """
+    Cubo de tokens cuyo ritmo crece por fases (la rampa 500/50/5 que recomienda Firestore
+    para colecciones nuevas). tomar(n) bloquea hasta que hay n tokens.
+    """
+
+    def __init__(self, inicial: float = RAMPA_INICIAL, factor: float = RAMPA_FACTOR, fase: float = RAMPA_FASE_SEGUNDOS):
+        self.inicial = inicial
+        self.factor = factor
+        self.fase = fase
+        self._lock = threading.Lock()
+        self._t0: Optional[float] = None
+        self._tokens = inicial
+        self._ultimo = 0.0
+
+    def ritmo(self, ahora: Optional[float] = None) -> float:
+        if self._t0 is None:
+            return self.inicial
+        ahora = time.monotonic() if ahora is None else ahora
+        return self.inicial * self.factor ** int((ahora - self._t0) // self.fase)
+
+    def tomar(self, n: int) -> None:
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                if self._t0 is None:
+                    self._t0 = self._ultimo = ahora
+                ritmo = self.ritmo(ahora)
+                self._tokens = min(ritmo, self._tokens + (ahora - self._ultimo) * ritmo)
+                self._ultimo = ahora
+                # Un lote mayor que el cubo entero pasa en cuanto el cubo está lleno
+                necesarios = min(n, ritmo)
+                if self._tokens >= necesarios:
+                    self._tokens -= necesarios
+                    return
+                espera = (necesarios - self._tokens) / ritmo
+            time.sleep(espera)
+
+
+class EscritorSerie:
+    """
+    Lo que hacían los extractores: acumula en un db.batch() y confirma de forma
+    bloqueante cada LOTE_MAX escrituras. Se mantiene para comparar y como red de seguridad.
+    """
+
+    modo = "serie"
+
+    def __init__(self, db, lote: int = LOTE_MAX):
+        self.db = db
+        self.lote = lote
+        self._ops: list[tuple] = []
+        self._lock = threading.Lock()
+        self._t0: Optional[float] = None
+        self._t_fin: Optional[float] = None
+        self.escrituras = 0
+        self.commits = 0
+        self.reintentos = 0
+        # Se captura aquí (hilo del extractor): los hilos del pool no heredan su contexto
+        self._cancelacion = evento_cancelacion()
+
+    def set(self, ref, data: dict, merge: bool = False) -> None:
+        comprobar_cancelacion(self._cancelacion)
+        with self._lock:
+            if self._t0 is None:
+                self._t0 = time.perf_counter()
+            self._ops.append((ref, data, merge))
+            if len(self._ops) < self.lote:
+                return
+            ops, self._ops = self._ops, []
+        self._enviar(ops)
+
+    def _enviar(self, ops: list[tuple]) -> None:
+        self._confirmar(ops)
+
+    def _confirmar(self, ops: list[tuple]) -> None:
+        """Un commit con reintentos y backoff exponencial (con jitter) ante errores transitorios."""
+        for intento in range(MAX_REINTENTOS + 1):
+            # Una carga cancelada no confirma más lotes (tampoco los que ya estaban en cola)
+            comprobar_cancelacion(self._cancelacion)
+            batch = self.db.batch()
+            for ref, data, merge in ops:
+                batch.set(ref, data, merge=merge)
+            try:
+                batch.commit()
+                break
+            except ERRORES_TRANSITORIOS as e:
+                if intento == MAX_REINTENTOS:
+                    raise ErrorEscritura(f"Commit de {len(ops)} escrituras fallido tras {intento + 1} intentos: {e}") from e
+                with self._lock:
+                    self.reintentos += 1
+                espera = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** intento) * random.uniform(0.5, 1.0)
+                if self._cancelacion is not None:
+                    self._cancelacion.wait(espera)
+                else:
+                    time.sleep(espera)
+            except Exception as e:
+                raise ErrorEscritura(f"Commit de {len(ops)} escrituras rechazado: {e}") from e
+        with self._lock:
+            self.escrituras += len(ops)
+            self.commits += 1
+
+    def flush(self) -> None:
+        with self._lock:
+            ops, self._ops = self._ops, []
+        if ops:
+            self._enviar(ops)
+
+    def cerrar(self) -> dict:
+        self.flush()
+        self._t_fin = time.perf_counter()
+        return self.stats()
+
+    def stats(self) -> dict:
+        fin = self._t_fin if self._t_fin is not None else time.perf_counter()
+        segundos = fin - self._t0 if self._t0 is not None else 0.0
+        return {
+            "modo": self.modo,
+            "escrituras": self.escrituras,
+            "commits": self.commits,
+            "reintentos": self.reintentos,
+            "segundos": round(segundos, 3),
+            "escrituras_por_segundo": round(self.escrituras / segundos, 1) if segundos > 0 else 0.0,
+        }
+
+
+class EscritorConcurrente(EscritorSerie):
+    """
+    Confirma los lotes en segundo plano con hasta MAX_EN_VUELO commits a la vez:
+    - el extractor sigue procesando registros mientras viajan los commits;
+    - el ritmo lo limita la rampa 500/50/5 (LimitadorRampa), salvo con rampa=False;
+    - cada commit reintenta con backoff; si uno falla del todo, el error sale en el
+      siguiente set()/flush() del extractor.
+    Los lotes pueden confirmarse en desorden: cada documento se escribe una sola vez por carga.
+    """
+
+    modo = "concurrente"
+
+    def __init__(self, db, lote: int = LOTE_MAX, max_en_vuelo: int = MAX_EN_VUELO,
+                 limitador: Optional[LimitadorRampa] = None, rampa: bool = True):
+        super().__init__(db, lote)
+        self.max_en_vuelo = max_en_vuelo
+        self.limitador = (limitador or LimitadorRampa()) if rampa else None
+        self._pool = ThreadPoolExecutor(max_workers=max_en_vuelo, thread_name_prefix="escritor")
+        self._huecos = threading.BoundedSemaphore(max_en_vuelo)
+        self._pendientes: set[Future] = set()
+        self._error: Optional[BaseException] = None
+
+    def _comprobar_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def _enviar(self, ops: list[tuple]) -> None:
+        self._comprobar_error()
+        if self.limitador is not None:
+            self.limitador.tomar(len(ops))
+        self._huecos.acquire()  # no más de max_en_vuelo lotes en memoria/viajando
+        futuro = self._pool.submit(self._confirmar, ops)
+        with self._lock:
+            self._pendientes.add(futuro)
+        futuro.add_done_callback(self._terminado)
+
+    def _terminado(self, futuro: Future) -> None:
+        with self._lock:
+            self._pendientes.discard(futuro)
+            error = futuro.exception()
+            if error is not None and self._error is None:
+                self._error = error if isinstance(error, (ErrorEscritura, CargaCancelada)) else ErrorEscritura(str(error))
+        self._huecos.release()
+
+    def flush(self) -> None:
+        super().flush()
+        while True:
+            with self._lock:
+                pendientes = list(self._pendientes)
+            if not pendientes:
+                break
+            for futuro in pendientes:
+                futuro.exception()  # espera sin lanzar; el error se recoge abajo
+        self._comprobar_error()
+
+    def cerrar(self) -> dict:
+        try:
+            return super().cerrar()
+        finally:
+            self._pool.shutdown(wait=True)
+
+
+def crear_escritor(db, modo: Optional[str] = None):
+    """Escritor para un extractor: modo "concurrente" o "serie" (por defecto ITV_ESCRITOR)."""
+    modo = modo or MODO_POR_DEFECTO
+    if modo == "serie":
+        return EscritorSerie(db)
+    if modo == "concurrente":
+        # La rampa es para no saturar Firestore; un almacén local (AlmacenSQLite.RAMPA) no la necesita
+        return EscritorConcurrente(db, rampa=getattr(db, "RAMPA", True))
+    raise ValueError(f"Modo de escritor desconocido: {modo}")
+
+
+def formatear_stats(stats: dict) -> str:
+    """Línea [ESCRITOR] con el resumen, mismo formato clave=valor que [PROGRESO]/[ETAPA]."""
+    return "[ESCRITOR] " + " ".join(f"{k}={v}" for k, v in stats.items())
@@ -0,0 +1,75 @@
+﻿# COMUN/indice_lugares.py
+from __future__ import annotations
+
+import threading
+import unicodedata
+from typing import Optional
+
+
+def normalizar_nombre(nombre: str) -> str:
+    """Clave de búsqueda: sin tildes, en minúsculas y con los espacios colapsados."""
+    sin_tildes = "".join(
+        c for c in unicodedata.normalize("NFD", nombre or "")
+        if unicodedata.category(c) != "Mn"
+    )
+    return " ".join(sin_tildes.lower().split())
+
+
+class IndiceLugares:
+    """
+    Provincias y localidades del almacén en memoria, leídas de golpe al empezar:
+    - cargar() hace 2 consultas (una por colección) en vez de una por municipio nuevo.
+    - Las localidades se indexan por (nombre normalizado, provincia_codigo).
+    - Lo que el extractor crea se registra aquí, así que no vuelve a preguntar a Firestore.
+    Es seguro entre hilos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._provincias: dict[str, str] = {}                 # nombre_norm -> codigo
+        self._localidades: dict[tuple[str, str], str] = {}    # (nombre_norm, provincia_codigo) -> codigo
+        self.documentos_leidos = 0
+        self.consultas = 0
+
+    def cargar(self, db) -> "IndiceLugares":
+        for doc in db.collection("provincias").select(["nombre"]).stream():
+            info = doc.to_dict() or {}
+            self.documentos_leidos += 1
+            if info.get("nombre"):
+                self._provincias.setdefault(normalizar_nombre(info["nombre"]), doc.id)
+        self.consultas += 1
+
+        for doc in db.collection("localidades").select(["nombre", "provincia_codigo"]).stream():
+            info = doc.to_dict() or {}
+            self.documentos_leidos += 1
+            if info.get("nombre"):
+                clave = (normalizar_nombre(info["nombre"]), str(info.get("provincia_codigo", "") or ""))
+                self._localidades.setdefault(clave, doc.id)
+        self.consultas += 1
+        return self
+
+    def provincia(self, nombre: str) -> Optional[str]:
+        with self._lock:
+            return self._provincias.get(normalizar_nombre(nombre))
+
+    def localidad(self, nombre: str, provincia_codigo: str) -> Optional[str]:
+        with self._lock:
+            return self._localidades.get((normalizar_nombre(nombre), provincia_codigo or ""))
+
+    def registrar_provincia(self, nombre: str, codigo: str) -> str:
+        """Añade la provincia; si otro hilo se adelantó, devuelve el código que ya había."""
+        with self._lock:
+            return self._provincias.setdefault(normalizar_nombre(nombre), codigo)
+
+    def registrar_localidad(self, nombre: str, provincia_codigo: str, codigo: str) -> str:
+        with self._lock:
+            return self._localidades.setdefault((normalizar_nombre(nombre), provincia_codigo or ""), codigo)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "provincias": len(self._provincias),
+                "localidades": len(self._localidades),
+                "documentos_leidos": self.documentos_leidos,
+                "consultas": self.consultas,
+            }
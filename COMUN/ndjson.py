@@ -0,0 +1,58 @@
+﻿# COMUN/ndjson.py
+from __future__ import annotations
+
+import json
+from typing import Any, Iterable, Iterator, Optional
+
+import requests
+
+
+# Un registro JSON por línea: se puede escribir y leer según se parsea, sin tener la lista entera
+MEDIA_TYPE = "application/x-ndjson"
+REGISTROS_POR_TROZO = 256   # líneas agrupadas por escritura al socket (una por registro sería muy lento)
+
+
+def codificar(registros: Iterable[dict[str, Any]], por_trozo: int = REGISTROS_POR_TROZO) -> Iterator[bytes]:
+    """Lado wrapper: trozos de NDJSON para una StreamingResponse."""
+    lineas: list[str] = []
+    for registro in registros:
+        lineas.append(json.dumps(registro, ensure_ascii=False))
+        if len(lineas) >= por_trozo:
+            yield ("\n".join(lineas) + "\n").encode("utf-8")
+            lineas = []
+    if lineas:
+        yield ("\n".join(lineas) + "\n").encode("utf-8")
+
+
+def decodificar(lineas: Iterable[bytes]) -> Iterator[dict[str, Any]]:
+    for linea in lineas:
+        if linea.strip():
+            yield json.loads(linea)
+
+
+def pedir(url: str, etag_previo: Optional[str] = None, timeout=(5, 120)) -> tuple[Optional[Iterator[dict[str, Any]]], Optional[int], str]:
+    """
+    Lado extractor: (registros, total, etag) de un endpoint /records/stream.
+    - registros se va leyendo de la respuesta según se consume (la conexión se cierra al acabar);
+      None si el wrapper responde 304 (sin cambios desde etag_previo).
+    - total es el X-Total-Count que anuncie el wrapper (None si aún no lo sabe).
+    """
+    headers = {"If-None-Match": etag_previo} if etag_previo else {}
+    resp = requests.get(url, headers=headers, stream=True, timeout=timeout)
+    if resp.status_code == 304:
+        resp.close()
+        return None, None, etag_previo or ""
+    try:
+        resp.raise_for_status()
+    except requests.HTTPError:
+        resp.close()
+        raise
+    total = resp.headers.get("X-Total-Count")
+
+    def generar() -> Iterator[dict[str, Any]]:
+        try:
+            yield from decodificar(resp.iter_lines(chunk_size=1 << 16))
+        finally:
+            resp.close()
+
+    return generar(), int(total) if total is not None else None, resp.headers.get("ETag", "")
@@ -0,0 +1,247 @@
+﻿# COMUN/perfilado.py
+"""
+Perfilado bajo demanda, sin volver a desplegar:
+
+- APIs (instalar(app, servicio)): con ITV_PERFILADO=cabecera (por defecto) se perfila la petición
+  que lleve la cabecera "X-Perfil: 1"; con ITV_PERFILADO=todas, todas; con ITV_PERFILADO=0, ninguna.
+  Es un perfil por muestreo (pilas de todos los hilos cada INTERVALO_MUESTREO segundos, mientras
+  dura la petición, cuerpo en streaming incluido): los endpoints síncronos corren en el pool de
+  hilos de FastAPI, donde cProfile no llega. Se guarda en pilas colapsadas (.collapsed), la
+  entrada de flamegraph.pl o speedscope; la respuesta dice el nombre en "X-Perfil-Fichero".
+  Al muestrear todo el proceso, el perfil de una petición incluye también las pilas de las
+  que se atiendan a la vez (cada pila empieza por el nombre del hilo).
+- Extractores (perfilar()): con cProfile (.pstats, para pstats/snakeviz) o por muestreo (.collapsed).
+- GET /profiles lista los perfiles guardados (de todos los servicios: comparten directorio)
+  y GET /profiles/{nombre} descarga uno.
+"""
+from __future__ import annotations
+
+import cProfile
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import anyio.to_thread
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+PERFILES_DIR = Path(os.environ.get("ITV_PERFILES_DIR", PROJECT_ROOT / ".perfiles"))
+
+# "cabecera": solo peticiones con X-Perfil; "todas": todas; "0": desactivado
+MODO = os.environ.get("ITV_PERFILADO", "cabecera").lower()
+CABECERA = "x-perfil"
+CABECERA_FICHERO = "X-Perfil-Fichero"
+RUTA_PERFILES = "/profiles"
+
+FORMATOS = ("pstats", "collapsed")
+INTERVALO_MUESTREO = 0.005     # segundos entre muestras
+PROFUNDIDAD_MAXIMA = 128       # marcos por pila (los de más abajo se descartan)
+MAX_PERFILES = 200             # al superarlo se borran los más antiguos
+
+# Hojas de pila de hilos parados esperando trabajo (pool sin tareas, bucle de eventos en select):
+# no son tiempo de la petición y taparían el resto del flamegraph
+FUNCIONES_EN_ESPERA = {("threading.py", "wait"), ("selectors.py", "select"), ("queue.py", "get")}
+
+NOMBRE_VALIDO = re.compile(r"^[\w.-]+\.(pstats|collapsed)$")
+
+_contador_lock = threading.Lock()
+_contador = 0
+
+
+def activo_para(cabeceras: dict[str, str]) -> bool:
+    if MODO in ("0", "no", "off"):
+        return False
+    if MODO == "todas":
+        return True
+    return cabeceras.get(CABECERA, "").lower() not in ("", "0", "no")
+
+
+def nuevo_fichero(servicio: str, etiqueta: str, formato: str) -> Path:
+    """Ruta para un perfil nuevo: servicio_fecha_etiqueta_pid_n.formato (ordenable por fecha)."""
+    global _contador
+    with _contador_lock:
+        _contador += 1
+        n = _contador
+    etiqueta = re.sub(r"[^\w-]+", "-", etiqueta).strip("-")[:60] or "raiz"
+    fecha = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return PERFILES_DIR / f"{servicio}_{fecha}_{etiqueta}_{os.getpid()}_{n}.{formato}"
+
+
+def _podar() -> None:
+    for p in listar()[MAX_PERFILES:]:
+        (PERFILES_DIR / p["nombre"]).unlink(missing_ok=True)
+
+
+class Muestreador:
+    """Perfil por muestreo: cuenta pilas colapsadas ("hilo;mod:func;...") de todos los hilos."""
+
+    def __init__(self, intervalo: float = INTERVALO_MUESTREO):
+        self.intervalo = intervalo
+        self.muestras: Counter[str] = Counter()
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, name="perfilado-muestreo", daemon=True)
+
+    def iniciar(self) -> None:
+        self._hilo.start()
+
+    def parar(self) -> None:
+        self._parar.set()
+        self._hilo.join()
+
+    def _muestrear(self) -> None:
+        propio = threading.get_ident()
+        while not self._parar.wait(self.intervalo):
+            nombres = {h.ident: h.name for h in threading.enumerate()}
+            for ident, marco in sys._current_frames().items():
+                if ident == propio:
+                    continue
+                pila = []
+                while marco is not None and len(pila) < PROFUNDIDAD_MAXIMA:
+                    codigo = marco.f_code
+                    pila.append((os.path.basename(codigo.co_filename), codigo.co_name))
+                    marco = marco.f_back
+                if not pila or pila[0] in FUNCIONES_EN_ESPERA:
+                    continue
+                hilo = nombres.get(ident, str(ident)).replace(";", "_")
+                self.muestras[";".join([hilo] + [f"{f}:{n}" for f, n in reversed(pila)])] += 1
+
+    def guardar(self, ruta: Path) -> None:
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        with ruta.open("w", encoding="utf-8") as f:
+            for pila, n in self.muestras.most_common():
+                f.write(f"{pila} {n}\n")
+
+
+@contextmanager
+def perfilar(servicio: str, formato: str = "pstats", etiqueta: str = "main"):
+    """
+    Perfila el bloque y guarda el resultado en PERFILES_DIR. pstats: cProfile del hilo actual
+    (los hilos que lance el bloque no salen); collapsed: muestreo de todos los hilos del proceso.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de perfil desconocido: {formato} ({', '.join(FORMATOS)})")
+    ruta = nuevo_fichero(servicio, etiqueta, formato)
+
+    if formato == "collapsed":
+        muestreador = Muestreador()
+        muestreador.iniciar()
+        try:
+            yield ruta
+        finally:
+            muestreador.parar()
+            muestreador.guardar(ruta)
+            _podar()
+            print(f"[INFO] Perfil guardado en {ruta}")
+        return
+
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError as e:
+        # Python 3.12+: un solo cProfile activo por proceso (p. ej. dos extractores en proceso a la vez)
+        print(f"[WARN] No se puede perfilar con cProfile ({e}); se sigue sin perfil.")
+        yield None
+        return
+    try:
+        yield ruta
+    finally:
+        perfil.disable()
+        PERFILES_DIR.mkdir(parents=True, exist_ok=True)
+        perfil.dump_stats(str(ruta))
+        _podar()
+        print(f"[INFO] Perfil guardado en {ruta}")
+
+
+def _terminar(muestreador: Muestreador, ruta: Path) -> None:
+    muestreador.parar()
+    muestreador.guardar(ruta)
+    _podar()
+
+
+class MiddlewarePerfilado:
+    """
+    Middleware ASGI: perfila la petición completa, hasta el último trozo del cuerpo.
+    El muestreador ve todos los hilos del proceso: con peticiones concurrentes, el perfil de
+    una lleva también las pilas de las demás. Parar el muestreo, escribir el fichero y podar
+    el directorio se hace en un hilo, fuera del bucle de eventos.
+    """
+
+    def __init__(self, app, servicio: str):
+        self.app = app
+        self.servicio = servicio
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(RUTA_PERFILES):
+            await self.app(scope, receive, send)
+            return
+        cabeceras = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        if not activo_para(cabeceras):
+            await self.app(scope, receive, send)
+            return
+
+        ruta = nuevo_fichero(self.servicio, f"{scope['method']}{scope['path']}", "collapsed")
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                mensaje = {**mensaje, "headers": [*mensaje.get("headers", []), (CABECERA_FICHERO.lower().encode(), ruta.name.encode())]}
+            await send(mensaje)
+
+        muestreador = Muestreador()
+        muestreador.iniciar()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            await anyio.to_thread.run_sync(_terminar, muestreador, ruta)
+
+
+def listar() -> list[dict]:
+    """Perfiles guardados, del más reciente al más antiguo."""
+    if not PERFILES_DIR.is_dir():
+        return []
+    ficheros = []
+    for p in PERFILES_DIR.iterdir():
+        if NOMBRE_VALIDO.match(p.name):
+            ficheros.append((p, p.stat()))
+    ficheros.sort(key=lambda f: f[1].st_mtime, reverse=True)
+    return [
+        {
+            "nombre": p.name,
+            "formato": p.suffix[1:],
+            "bytes": st.st_size,
+            "modificado": datetime.fromtimestamp(st.st_mtime).isoformat(timespec="seconds"),
+        }
+        for p, st in ficheros
+    ]
+
+
+router = APIRouter(tags=["perfilado"])
+
+
+@router.get(RUTA_PERFILES)
+def listar_perfiles():
+    """Perfiles guardados (los de todos los servicios), del más reciente al más antiguo."""
+    perfiles = listar()
+    return {"modo": MODO, "directorio": str(PERFILES_DIR), "count": len(perfiles), "perfiles": perfiles}
+
+
+@router.get(RUTA_PERFILES + "/{nombre}")
+def descargar_perfil(nombre: str):
+    # Solo nombres de perfil (sin rutas): nada fuera de PERFILES_DIR
+    ruta = PERFILES_DIR / nombre
+    if not NOMBRE_VALIDO.match(nombre) or not ruta.is_file():
+        raise HTTPException(status_code=404, detail=f"No existe el perfil {nombre}")
+    media_type = "text/plain; charset=utf-8" if ruta.suffix == ".collapsed" else "application/octet-stream"
+    return FileResponse(ruta, media_type=media_type, filename=nombre)
+
+
+def instalar(app, servicio: str) -> None:
+    """Middleware de perfilado y GET /profiles en una app FastAPI."""
+    app.add_middleware(MiddlewarePerfilado, servicio=servicio)
+    app.include_router(router)
@@ -0,0 +1,68 @@
+﻿# COMUN/progreso.py
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+
+# La API de carga lo activa al lanzar los extractores; a mano no ensucia la salida
+PROGRESO_ACTIVO = os.environ.get("ITV_PROGRESO") == "1"
+
+# Cancelación de un extractor en proceso (API de carga, mode="inprocess"): la API pone un Event
+# en el contexto del hilo del extractor y lo activa al cancelar o por timeout. El extractor lo
+# comprueba en cada registro y en cada etapa, y el escritor antes de cada commit.
+_cancelacion: ContextVar[Optional[threading.Event]] = ContextVar("cancelacion_carga", default=None)
+
+
+class CargaCancelada(BaseException):
+    """
+    Se lanza dentro de un extractor en proceso al cancelarlo (o por timeout).
+    Hereda de BaseException para que los 'except Exception' por registro no la traguen.
+    """
+
+
+def activar_cancelacion(evento: Optional[threading.Event]) -> None:
+    _cancelacion.set(evento)
+
+
+def evento_cancelacion() -> Optional[threading.Event]:
+    """El Event de cancelación del hilo actual (None fuera de una carga en proceso)."""
+    return _cancelacion.get()
+
+
+def comprobar_cancelacion(evento: Optional[threading.Event] = None) -> None:
+    """Lanza CargaCancelada si la carga se ha cancelado (evento: el del hilo actual si no se pasa)."""
+    evento = evento if evento is not None else _cancelacion.get()
+    if evento is not None and evento.is_set():
+        raise CargaCancelada()
+
+
+def reportar_progreso(procesados: int, total: Optional[int], insertados: int) -> None:
+    """Línea [PROGRESO] que la API de carga convierte en eventos de progreso del job."""
+    comprobar_cancelacion()
+    if PROGRESO_ACTIVO:
+        print(f"[PROGRESO] procesados={procesados} total={total if total is not None else '?'} insertados={insertados}", flush=True)
+
+
+def reportar_etapa(nombre: str, t0: float) -> float:
+    """
+    Imprime cuánto ha tardado una etapa desde t0 (time.perf_counter()) y devuelve
+    el instante actual, para encadenar: t = reportar_etapa("x", t).
+    """
+    comprobar_cancelacion()
+    ahora = time.perf_counter()
+    print(f"[ETAPA] nombre={nombre} segundos={ahora - t0:.3f}", flush=True)
+    return ahora
+
+
+def parsear_linea(linea: str) -> dict[str, str]:
+    """'[PROGRESO] a=1 b=2' -> {'a': '1', 'b': '2'}"""
+    campos = {}
+    for trozo in linea.split("]", 1)[-1].split():
+        clave, _, valor = trozo.partition("=")
+        if valor:
+            campos[clave] = valor
+    return campos
@@ -1,18 +1,33 @@
 ﻿# src/cv/api_busqueda_cv.py
 from __future__ import annotations
 
+import base64
+import binascii
+import json
+from itertools import islice
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 
-from .wrapper_cv import leer_cv_json
+from COMUN import columnar, ndjson, perfilado
+from COMUN.cache_fuentes import CacheFuente, etag_coincide
+
+from .wrapper_cv import iterar_cv_json, leer_cv_json
 
 app = FastAPI(
     title="Wrapper CV - API de búsqueda",
     version="1.0.0",
     description="Expone datos crudos de la fuente CV (JSON) para que los consuma el extractor.",
 )
+# X-Perfil: 1 -> perfil de la petición; GET /profiles (COMUN/perfilado.py)
+perfilado.instalar(app, "cv")
+# Los endpoints de datos van en un router para poder montarlos también en el gateway
+# (GATEWAY/api_gateway.py), que sirve las tres fuentes desde un solo proceso
+router = APIRouter(tags=["CV"])
 
 JSON_FILE = Path("estaciones.json")
+# Registros ya parseados; se vuelve a leer el fichero solo si cambia (y el ETag con él)
+cache_json = CacheFuente(JSON_FILE, leer_cv_json)
 
 
 
@@ -22,20 +37,60 @@ def health():
         "status": "ok",
         "json_exists": JSON_FILE.exists(),
         "json_path": str(JSON_FILE.resolve()),
+        "cache": cache_json.stats(),
     }
 
 
 
 
-@app.get("/cv/records")
+def codificar_cursor(offset: int) -> str:
+    """Cursor opaco para la página siguiente (por dentro: la posición del siguiente registro)."""
+    raw = json.dumps({"offset": offset}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        offset = json.loads(raw.decode("utf-8"))["offset"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="cursor no válido")
+    if not isinstance(offset, int) or offset < 0:
+        raise HTTPException(status_code=400, detail="cursor no válido")
+    return offset
+
+
+def respuesta_columnar(if_none_match: str | None) -> Response:
+    datos, etag = cache_json.obtener_columnar()
+    if not etag:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No se pudieron leer registros. ¿Existe el JSON en {JSON_FILE.resolve()}?",
+        )
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=datos, media_type=columnar.MEDIA_TYPE, headers={"ETag": etag})
+
+
+@router.get("/cv/records")
 def cv_records(
+    response: Response,
+    if_none_match: str | None = Header(default=None),
+    accept: str | None = Header(default=None),
     limit: int | None = Query(default=None, ge=1, le=50000),
+    offset: int = Query(default=0, ge=0),
+    cursor: str | None = Query(default=None, description="X-Next-Cursor de la página anterior (sustituye a offset)"),
 ):
     """
     Devuelve registros RAW del JSON (sin modificar).
-    limit es útil para pruebas.
+    - limit/offset (o cursor) para paginar; sin limit, todo desde offset.
+    - Cabeceras: X-Total-Count (total de registros) y X-Next-Cursor (si quedan más).
     """
-    records = leer_cv_json(JSON_FILE)
+    # Accept: application/x-msgpack -> instantánea columnar de toda la fuente (cacheada en disco)
+    if columnar.pedido(accept) and limit is None and not offset and cursor is None:
+        return respuesta_columnar(if_none_match)
+
+    records, etag = cache_json.obtener()
 
     if not records:
         raise HTTPException(
@@ -43,7 +98,51 @@ def cv_records(
             detail=f"No se pudieron leer registros. ¿Existe el JSON en {JSON_FILE.resolve()}?",
         )
 
-    return records[:limit] if limit else records
+    # Sin cambios desde la versión que ya tiene el cliente: ni se serializa ni se envía nada
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    if cursor is not None:
+        offset = decodificar_cursor(cursor)
+    total = len(records)
+    fin = min(total, offset + limit) if limit else total
+
+    response.headers["X-Total-Count"] = str(total)
+    if fin < total:
+        response.headers["X-Next-Cursor"] = codificar_cursor(fin)
+    return records[offset:fin]
+
+
+@router.get("/cv/records/stream")
+def cv_records_stream(
+    if_none_match: str | None = Header(default=None),
+    limit: int | None = Query(default=None, ge=1),
+):
+    """
+    Los mismos registros RAW en NDJSON (un JSON por línea), enviados según se leen del JSON:
+    ni el wrapper ni el extractor tienen nunca la lista entera en memoria.
+    - ETag / If-None-Match igual que /cv/records (304 si no ha cambiado).
+    - X-Total-Count solo si ya se sabe sin leer el fichero (la caché tiene ese mismo contenido).
+    """
+    if not JSON_FILE.exists():
+        raise HTTPException(
+            status_code=404,
+            detail=f"No se pudieron leer registros. ¿Existe el JSON en {JSON_FILE.resolve()}?",
+        )
+
+    etag, total = cache_json.etag_sin_parsear()
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
 
+    headers = {"ETag": etag}
+    if total is not None:
+        headers["X-Total-Count"] = str(total)
+    registros = iterar_cv_json(JSON_FILE)
+    if limit:
+        registros = islice(registros, limit)
+    return StreamingResponse(ndjson.codificar(registros), media_type=ndjson.MEDIA_TYPE, headers=headers)
 
 
+# Al final: include_router copia las rutas que el router tenga en este momento
+app.include_router(router)
@@ -0,0 +1,99 @@
+﻿# CV/cache_geocodificacion.py
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+
+# Fichero local (no versionado); se crea en la primera carga
+CACHE_FILE = Path(__file__).resolve().parent / ".geocache.sqlite3"
+
+# Una dirección encontrada casi nunca cambia; una no encontrada se vuelve a intentar antes
+TTL_ACIERTO_SEGUNDOS = 180 * 24 * 3600
+TTL_FALLO_SEGUNDOS = 7 * 24 * 3600
+
+
+class EntradaGeocache(NamedTuple):
+    encontrado: bool
+    lat: Optional[str]
+    lon: Optional[str]
+
+
+def normalizar_consulta(consulta: str) -> str:
+    """Misma clave aunque cambien mayúsculas o espacios: 'Av.  X , Y' == 'av. x, y'."""
+    trozos = [" ".join(t.split()) for t in consulta.casefold().split(",")]
+    return ", ".join(t for t in trozos if t)
+
+
+class CacheGeocodificacion:
+    """
+    Caché persistente (SQLite) de consultas a Nominatim, con aciertos y fallos:
+    - obtener() devuelve None si la consulta no está o caducó (hay que ir a la red);
+    - un fallo cacheado también evita la red (y su espera) hasta que caduca.
+    Es segura entre hilos.
+    """
+
+    def __init__(self, ruta: Path | str = CACHE_FILE,
+                 ttl_acierto: float = TTL_ACIERTO_SEGUNDOS, ttl_fallo: float = TTL_FALLO_SEGUNDOS):
+        self.ruta = str(ruta)
+        self.ttl_acierto = ttl_acierto
+        self.ttl_fallo = ttl_fallo
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.ruta, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocache ("
+            " consulta TEXT PRIMARY KEY,"
+            " encontrado INTEGER NOT NULL,"
+            " lat TEXT, lon TEXT,"
+            " guardado REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.aciertos = 0           # consulta resuelta desde la caché (con coordenadas)
+        self.fallos_cacheados = 0   # consulta que ya se sabía que no tiene resultado
+        self.ausentes = 0           # no estaba o caducó (lo resuelve el nomenclátor o la red, si la hay)
+
+    def obtener(self, consulta: str) -> Optional[EntradaGeocache]:
+        clave = normalizar_consulta(consulta)
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT encontrado, lat, lon, guardado FROM geocache WHERE consulta = ?", (clave,)
+            ).fetchone()
+            if fila is not None:
+                encontrado, lat, lon, guardado = fila
+                ttl = self.ttl_acierto if encontrado else self.ttl_fallo
+                if time.time() - guardado <= ttl:
+                    if encontrado:
+                        self.aciertos += 1
+                    else:
+                        self.fallos_cacheados += 1
+                    return EntradaGeocache(bool(encontrado), lat, lon)
+            self.ausentes += 1
+            return None
+
+    def guardar(self, consulta: str, coords: Optional[tuple[str, str]]) -> None:
+        """coords=None guarda un fallo (Nominatim respondió sin resultados)."""
+        lat, lon = coords if coords else (None, None)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocache (consulta, encontrado, lat, lon, guardado) VALUES (?, ?, ?, ?, ?)",
+                (normalizar_consulta(consulta), 1 if coords else 0, lat, lon, time.time()),
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos_cacheados + self.ausentes
+            return {
+                "consultas": consultas,
+                "aciertos": self.aciertos,
+                "fallos_cacheados": self.fallos_cacheados,
+                "ausentes": self.ausentes,
+                "ratio_aciertos": round((self.aciertos + self.fallos_cacheados) / consultas, 3) if consultas else 0.0,
+            }
+
+    def cerrar(self) -> None:
+        with self._lock:
+            self._conn.close()
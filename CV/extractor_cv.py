@@ -1,20 +1,54 @@
 ﻿# -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import argparse
+import os
 import re
+import sys
+import threading
 import time
 import unicodedata
 import requests
-
-import firebase_admin
-from firebase_admin import credentials, firestore
-from google.cloud.firestore_v1.base_query import FieldFilter
+from pathlib import Path
+from typing import Iterator
+
+# Al lanzarse como script (python CV/extractor_cv.py) la raíz del proyecto no está en sys.path
+PROJECT_ROOT_PATH = str(Path(__file__).resolve().parent.parent)
+if PROJECT_ROOT_PATH not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT_PATH)
+
+from COMUN import almacen, columnar, ndjson, perfilado
+from COMUN.cargas import guardar_etag, leer_etag
+from COMUN.contadores import AsignadorIds
+from COMUN.escritor import ErrorEscritura, crear_escritor, formatear_stats
+from COMUN.indice_lugares import IndiceLugares
+from COMUN.progreso import reportar_etapa, reportar_progreso
+from CV.cache_geocodificacion import CacheGeocodificacion
+from CV.nomenclator import Nomenclator
+from CV.pipeline_cv import CuboTokens, ejecutar_pipeline, formatear_pipeline
 
 # -------------------------
 # Config
 # -------------------------
-CV_API_BASE = "http://127.0.0.1:8050"
-CV_RECORDS_URL = f"{CV_API_BASE}/cv/records?limit=50"
+# Donde levantes api_busqueda_cv.py (o el gateway: ITV_CV_API_BASE=http://127.0.0.1:8060)
+CV_API_BASE = os.environ.get("ITV_CV_API_BASE", "http://127.0.0.1:8050")
+CV_RECORDS_URL = f"{CV_API_BASE}/cv/records"
+CV_STREAM_URL = f"{CV_API_BASE}/cv/records/stream"
+FUENTE = "CV"
+# ITV_FORZAR_CARGA=1: cargar aunque la fuente no haya cambiado (la API de carga lo pone con force=true)
+FORZAR_CARGA = os.environ.get("ITV_FORZAR_CARGA") == "1"
+# ITV_PERFIL=pstats|collapsed (o --profile): perfil de main() en .perfiles/ (COMUN/perfilado.py)
+PERFIL = os.environ.get("ITV_PERFIL") or None
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_USER_AGENT = "itv-cv-loader/1.0 (contacto@ejemplo.com)"
+NOMINATIM_INTERVALO_SEGUNDOS = 1.1
+# Pipeline: hilos de geocodificación (la red la limita el cubo; el resto es caché/nomenclátor) y tamaño de colas
+GEOCODIFICACION_HILOS = 4
+PIPELINE_TAM_COLA = 64
+
+# ITV_GEOCODIFICAR_RED=0: solo caché y nomenclátor local (cargas sin red, p. ej. en CI)
+GEOCODIFICAR_RED = os.environ.get("ITV_GEOCODIFICAR_RED", "1") != "0"
 
 CREDENTIALS_FILE = "iei-proyecto-firebase-adminsdk-fbsvc-04d774ba06.json"
 
@@ -83,52 +117,99 @@ def mapear_tipo(tipo_estacion_origen: str) -> str:
     return "Otros"
 
 
-def geocodificar(direccion: str, municipio: str, cod_postal: str) -> tuple[str, str]:
+# Política de uso de Nominatim: como mucho 1 petición por segundo, la compartan los hilos que sea
+nominatim_cubo = CuboTokens(1 / NOMINATIM_INTERVALO_SEGUNDOS)
+
+# Peticiones hechas de verdad a Nominatim (y cuántas fallaron); acumulado del proceso
+_nominatim_lock = threading.Lock()
+nominatim_stats = {"peticiones": 0, "errores": 0}
+
+
+def _contar_nominatim(campo: str) -> None:
+    with _nominatim_lock:
+        nominatim_stats[campo] += 1
+
+
+def leer_nominatim_stats() -> dict:
+    with _nominatim_lock:
+        return dict(nominatim_stats)
+
+
+def consultar_nominatim(consulta: str) -> tuple[str, str] | None:
+    """(lat, lon) o None si no hay resultados; los errores de red se propagan (no se cachean)."""
+    nominatim_cubo.tomar()
+    _contar_nominatim("peticiones")
+    r = requests.get(
+        NOMINATIM_URL,
+        params={"q": consulta, "format": "json", "limit": 1},
+        headers={"User-Agent": NOMINATIM_USER_AGENT},
+        timeout=10,
+    )
+    r.raise_for_status()
+    data = r.json()
+    if data:
+        return data[0]["lat"], data[0]["lon"]
+    return None
+
+
+def consultar_y_cachear(consulta: str, cache: CacheGeocodificacion | None) -> tuple[str, str] | None:
+    """A la red (esperando turno) y guarda el resultado; sin red configurada, None."""
+    if not GEOCODIFICAR_RED:
+        return None
+    try:
+        coords = consultar_nominatim(consulta)
+    except Exception:
+        _contar_nominatim("errores")
+        return None
+    if cache is not None:
+        cache.guardar(consulta, coords)
+    return coords
+
+
+def resolver_consulta(consulta: str, cache: CacheGeocodificacion | None) -> tuple[str, str] | None:
+    """Caché primero; a la red solo si no está o caducó."""
+    if cache is not None:
+        entrada = cache.obtener(consulta)
+        if entrada is not None:
+            return (entrada.lat, entrada.lon) if entrada.encontrado else None
+    return consultar_y_cachear(consulta, cache)
+
+
+def geocodificar(direccion: str, municipio: str, cod_postal: str,
+                 cache: CacheGeocodificacion | None = None,
+                 nomenclator: Nomenclator | None = None) -> tuple[str, str]:
     """
-    Geocodificación como en tu script:
-    - 2 intentos (dirección completa, luego municipio+CP)
-    - sleep ~1s para no saturar el servicio
+    Geocodificación por niveles, del más barato al más caro:
+    1. dirección completa ya geocodificada en otra carga (caché);
+    2. nomenclátor local por (municipio, CP): sin red, microsegundos;
+    3. Nominatim como en tu script (dirección completa, luego municipio+CP), salvo ITV_GEOCODIFICAR_RED=0
     """
     query_full = f"{direccion}, {municipio}, {cod_postal}, Comunidad Valenciana, España"
     query_simple = f"{municipio}, {cod_postal}, España"
 
-    url = "https://nominatim.openstreetmap.org/search"
-    headers = {"User-Agent": "itv-cv-loader/1.0 (contacto@ejemplo.com)"}
+    entrada = cache.obtener(query_full) if cache is not None else None
+    if entrada is not None and entrada.encontrado:
+        return entrada.lat, entrada.lon
 
-    try:
-        time.sleep(1.1)
-        r = requests.get(url, params={"q": query_full, "format": "json", "limit": 1}, headers=headers, timeout=10)
-        data = r.json()
-        if data:
-            return data[0]["lat"], data[0]["lon"]
-    except Exception:
-        pass
+    if nomenclator is not None:
+        coords = nomenclator.buscar(municipio, cod_postal)
+        if coords:
+            return coords
 
-    try:
-        time.sleep(1.1)
-        r = requests.get(url, params={"q": query_simple, "format": "json", "limit": 1}, headers=headers, timeout=10)
-        data = r.json()
-        if data:
-            print(f"[INFO] Usando coordenadas del municipio: {query_simple}")
-            return data[0]["lat"], data[0]["lon"]
-    except Exception:
-        pass
+    if entrada is None:
+        coords = consultar_y_cachear(query_full, cache)
+        if coords:
+            return coords
+
+    coords = resolver_consulta(query_simple, cache)
+    if coords:
+        print(f"[INFO] Usando coordenadas del municipio: {query_simple}")
+        return coords
 
     print(f"[WARN] No encontrado ni municipio ni dirección: {query_full}")
     return "0", "0"
 
 
-def get_starting_counter(db, collection_name: str) -> int:
-    docs = db.collection(collection_name).stream()
-    max_id = 0
-    for doc in docs:
-        try:
-            num = int(doc.id)
-            max_id = max(max_id, num)
-        except ValueError:
-            pass
-    return max_id + 1
-
 def get_existing_names(db, collection_name: str) -> set[str]:
     """Devuelve un conjunto (set) con los nombres de las estaciones que ya existen en la BD."""
     existing = set()
@@ -151,220 +232,298 @@ def get_first(registro: dict, keys: list[str], default=None):
 # -------------------------
 # I/O: pedir raw al wrapper
 # -------------------------
-def obtener_registros_raw() -> list[dict]:
-    resp = requests.get(CV_RECORDS_URL, timeout=(5, 120))
-    resp.raise_for_status()
-    return resp.json()
+def iterar_registros_raw(etag_previo: str | None = None) -> tuple[Iterator[dict] | None, int | None, str]:
+    """
+    (registros, total, etag) del NDJSON del wrapper: los registros llegan y se procesan uno a uno,
+    así que la preparación empieza con el primero y en memoria no está nunca la fuente entera.
+    registros=None si la fuente no ha cambiado desde etag_previo (304); total=None si el wrapper no lo anuncia.
+    """
+    if columnar.ACTIVO:  # ITV_TRANSPORTE=columnar: toda la fuente de una vez, por columnas
+        return columnar.pedir(CV_RECORDS_URL, etag_previo)
+    return ndjson.pedir(CV_STREAM_URL, etag_previo)
 
 
 def init_firestore():
-    if not firebase_admin._apps:
-        cred = credentials.Certificate(CREDENTIALS_FILE)
-        firebase_admin.initialize_app(cred)
-    return firestore.client()
+    return almacen.abrir(CREDENTIALS_FILE)
 
 
-def main():
-    print("[INFO] Extractor CV: pidiendo registros al wrapper...")
-    data_cv = obtener_registros_raw()
-    if not data_cv:
-        print("[ERROR] No hay datos para procesar.")
-        return
+def main(db=None, modo_escritor: str | None = None, forzar: bool = FORZAR_CARGA, perfil: str | None = PERFIL):
+    """
+    db: cliente ya abierto (la API de carga reutiliza el suyo); None = conectar aquí.
+    modo_escritor: "concurrente" o "serie"; None = ITV_ESCRITOR (por defecto concurrente).
+    forzar: cargar aunque la fuente no haya cambiado desde la última carga (ETag).
+    perfil: "pstats" (cProfile) o "collapsed" (muestreo); None = sin perfil.
+    """
+    if perfil:
+        with perfilado.perfilar("extractor_cv", perfil):
+            return main(db, modo_escritor, forzar, perfil=None)
 
-    db = init_firestore()
+    t_etapa = time.perf_counter()
+    if db is None:
+        db = init_firestore()
     print("[INFO] Conexión a Firebase exitosa.")
+    t_etapa = reportar_etapa("conexion_firestore", t_etapa)
 
-    batch = db.batch()
-    registros_procesados = 0
+    print("[INFO] Extractor CV: pidiendo registros al wrapper...")
+    data_cv, total_registros, etag = iterar_registros_raw(None if forzar else leer_etag(db, FUENTE))
+    t_etapa = reportar_etapa("obtener_registros", t_etapa)
+    if data_cv is None:
+        print(f"[INFO] La fuente CV no ha cambiado desde la última carga ({etag}); no hay nada que cargar.")
+        return
+
+    escritor = crear_escritor(db, modo_escritor)
 
-    provincia_counter = get_starting_counter(db, "provincias")
-    localidad_counter = get_starting_counter(db, "localidades")
-    estacion_counter = get_starting_counter(db, "estaciones")
+    # Ids alquilados por bloques al contador compartido: sin recorrer colecciones y
+    # seguro aunque otro extractor cargue a la vez
+    ids_provincias = AsignadorIds(db, "provincias")
+    ids_localidades = AsignadorIds(db, "localidades")
+    ids_estaciones = AsignadorIds(db, "estaciones")
     
     nombres_existentes = get_existing_names(db, "estaciones")
+    t_etapa = reportar_etapa("nombres_existentes", t_etapa)
+    # Provincias y localidades de una vez: 2 consultas en lugar de una por municipio nuevo
+    lugares = IndiceLugares().cargar(db)
+    t_etapa = reportar_etapa("indice_lugares", t_etapa)
+    cache_geo = CacheGeocodificacion()
+    nominatim_inicio = leer_nominatim_stats()
+    nomenclator = Nomenclator.abrir()
 
-    provincia_ids = {}          # provincia_normalizada -> id
-    localidad_ids = {}          # (municipio, provincia_id) -> id
     estacion_ids_vistas = {}    # Nº estación origen -> primer índice visto
+    registros_procesados = 0
+    registros_terminados = 0
+    registros_leidos = 0
+
+    def preparar_registros():
+        """Etapa 1 (este hilo): lectura, avisos y descarte de duplicados, en orden."""
+        nonlocal registros_leidos
+        for i, registro in enumerate(data_cv, start=1):
+            registros_leidos = i
+            try:
+                raw_provincia = (get_first(registro, ["PROVINCIA"], "") or "").strip()
+                warn_if_empty("PROVINCIA", raw_provincia, i)
+
+                cp_value = get_first(registro, ["C.POSTAL", "C. POSTAL", "CÓDIGO POSTAL", "CODIGO POSTAL"], None)
+                warn_if_empty("C.POSTAL / C. POSTAL", cp_value, i)
+
+                raw_municipio = (get_first(registro, ["MUNICIPIO"], "") or "").strip()
+                warn_if_empty("MUNICIPIO", raw_municipio, i)
+
+                raw_direccion = get_first(
+                    registro,
+                    ["DIRECCIÓN", "DIRECCION", "Dirección", "Direccion", "DIRECCI?N"],
+                    ""
+                ) or ""
+                warn_if_empty("DIRECCIÓN", raw_direccion, i)
+
+                raw_horarios = get_first(registro, ["HORARIOS"], None)
+                warn_if_empty("HORARIOS", raw_horarios, i)
+
+                raw_correo = get_first(registro, ["CORREO", "EMAIL"], None)
+                warn_if_empty("CORREO", raw_correo, i)
+
+                raw_cod_estacion = str(
+                    get_first(registro, ["Nº ESTACIÓN", "Nº ESTACION", "N. ESTACIÓN", "N. ESTACION", "N? ESTACI?N"], "N/A")
+                ).strip()
+                warn_if_empty("Nº ESTACIÓN", raw_cod_estacion, i)
+
+                # Duplicados por Nº estación
+                if raw_cod_estacion and raw_cod_estacion != "N/A":
+                    if raw_cod_estacion in estacion_ids_vistas:
+                        primero = estacion_ids_vistas[raw_cod_estacion]
+                        print(f"[WARN] Registro {i}: duplicado Nº ESTACIÓN '{raw_cod_estacion}' (ya estaba en {primero}); se omite.")
+                        yield None
+                        continue
+                    estacion_ids_vistas[raw_cod_estacion] = i
+
+                provincia_name = normalizar_provincia(raw_provincia, i)
+
+                cp_str = str(cp_value).strip() if cp_value is not None and str(cp_value).strip() else ""
+                cp_valido = True
+                if cp_str and not re.fullmatch(r"\d{5}", cp_str):
+                    print(f"[WARN] Registro {i}: CP '{cp_str}' no tiene 5 dígitos; no se guardará.")
+                    cp_valido = False
 
-    for i, registro in enumerate(data_cv, start=1):
+                if provincia_name and cp_valido and re.fullmatch(r"\d{5}", cp_str or ""):
+                    cp_coincide_con_provincia(cp_str, provincia_name, i)
+                    prefijo = cp_str[:2]
+                    permitidos = CP_PREFIJOS_CV.get(provincia_name, set())
+                    if permitidos and prefijo not in permitidos:
+                        cp_valido = False
+
+                yield {
+                    "i": i,
+                    "registro": registro,
+                    "provincia_name": provincia_name,
+                    "raw_municipio": raw_municipio,
+                    "municipio_name": raw_municipio.strip().title() if raw_municipio else "",
+                    "raw_direccion": raw_direccion,
+                    "raw_horarios": raw_horarios,
+                    "raw_correo": raw_correo,
+                    "raw_cod_estacion": raw_cod_estacion,
+                    "cp_str": cp_str,
+                    "cp_valido": cp_valido,
+                }
+            except Exception as e:
+                print(f"[ERROR] Procesando registro {i}: {e}. Datos: {registro}")
+                yield None
+
+    def geocodificar_registro(r: dict) -> tuple[str, str]:
+        """Etapa 2 (varios hilos): caché, nomenclátor y, si hace falta, Nominatim con su cubo de tokens."""
+        if r["raw_cod_estacion"] == "N/A" or not r["raw_cod_estacion"]:
+            return "", ""
+        if not r["raw_municipio"] or not r["cp_str"]:
+            return "", ""
+        return geocodificar(r["raw_direccion"], r["municipio_name"], r["cp_str"], cache_geo, nomenclator)
+
+    def escribir_registro(r: dict, coords) -> None:
+        """Etapa 3 (un hilo, en el orden original): provincia, localidad, validación final y escritura."""
+        nonlocal registros_procesados, registros_terminados
+        i = r["i"]
+        registros_terminados += 1
+        reportar_progreso(registros_terminados - 1, total_registros, registros_procesados)
         try:
-            raw_provincia = (get_first(registro, ["PROVINCIA"], "") or "").strip()
-            warn_if_empty("PROVINCIA", raw_provincia, i)
-
-            cp_value = get_first(registro, ["C.POSTAL", "C. POSTAL", "CÓDIGO POSTAL", "CODIGO POSTAL"], None)
-            warn_if_empty("C.POSTAL / C. POSTAL", cp_value, i)
-
-            raw_municipio = (get_first(registro, ["MUNICIPIO"], "") or "").strip()
-            warn_if_empty("MUNICIPIO", raw_municipio, i)
-
-            raw_direccion = get_first(
-                registro,
-                ["DIRECCIÓN", "DIRECCION", "Dirección", "Direccion", "DIRECCI?N"],
-                ""
-            ) or ""
-            warn_if_empty("DIRECCIÓN", raw_direccion, i)
-
-            raw_horarios = get_first(registro, ["HORARIOS"], None)
-            warn_if_empty("HORARIOS", raw_horarios, i)
-
-            raw_correo = get_first(registro, ["CORREO", "EMAIL"], None)
-            warn_if_empty("CORREO", raw_correo, i)
-
-            raw_cod_estacion = str(
-                get_first(registro, ["Nº ESTACIÓN", "Nº ESTACION", "N. ESTACIÓN", "N. ESTACION", "N? ESTACI?N"], "N/A")
-            ).strip()
-            warn_if_empty("Nº ESTACIÓN", raw_cod_estacion, i)
-
-            # Duplicados por Nº estación
-            if raw_cod_estacion and raw_cod_estacion != "N/A":
-                if raw_cod_estacion in estacion_ids_vistas:
-                    primero = estacion_ids_vistas[raw_cod_estacion]
-                    print(f"[WARN] Registro {i}: duplicado Nº ESTACIÓN '{raw_cod_estacion}' (ya estaba en {primero}); se omite.")
-                    continue
-                estacion_ids_vistas[raw_cod_estacion] = i
-
-            provincia_name = normalizar_provincia(raw_provincia, i)
-
-            cp_str = str(cp_value).strip() if cp_value is not None and str(cp_value).strip() else ""
-            cp_valido = True
-            if cp_str and not re.fullmatch(r"\d{5}", cp_str):
-                print(f"[WARN] Registro {i}: CP '{cp_str}' no tiene 5 dígitos; no se guardará.")
-                cp_valido = False
-
-            if provincia_name and cp_valido and re.fullmatch(r"\d{5}", cp_str or ""):
-                cp_coincide_con_provincia(cp_str, provincia_name, i)
-                prefijo = cp_str[:2]
-                permitidos = CP_PREFIJOS_CV.get(provincia_name, set())
-                if permitidos and prefijo not in permitidos:
-                    cp_valido = False
+            if isinstance(coords, BaseException):
+                raise coords
 
-            omitir_geocodificacion = not raw_municipio or not cp_str
+            provincia_name = r["provincia_name"]
+            municipio_name = r["municipio_name"]
+            cp_str = r["cp_str"]
+            cp_valido = r["cp_valido"]
 
             # PROVINCIA
             if provincia_name is not None:
-                if provincia_name not in provincia_ids:
-                    provincia_ids[provincia_name] = f"{provincia_counter:04d}"
-                    provincia_counter += 1
-                p_codigo = provincia_ids[provincia_name]
-
-                batch.set(
-                    db.collection("provincias").document(p_codigo),
-                    {"codigo": p_codigo, "nombre": provincia_name},
-                    merge=True,
-                )
+                p_codigo = lugares.provincia(provincia_name)
+                if p_codigo is None:
+                    p_codigo = f"{ids_provincias.siguiente():04d}"
+                    escritor.set(
+                        db.collection("provincias").document(p_codigo),
+                        {"codigo": p_codigo, "nombre": provincia_name},
+                        merge=True,
+                    )
+                    lugares.registrar_provincia(provincia_name, p_codigo)
             else:
                 p_codigo = ""
 
             # LOCALIDAD
-            if raw_municipio:
-                municipio_name = raw_municipio.strip().title()
-                clave_localidad = (municipio_name, p_codigo)
-
-                if clave_localidad in localidad_ids:
-                    l_codigo = localidad_ids[clave_localidad]
-                else:
-                    query = db.collection("localidades").where(filter=FieldFilter("nombre", "==", municipio_name))
-                    if p_codigo:
-                        query = query.where(filter=FieldFilter("provincia_codigo", "==", p_codigo))
-
-                    docs_exist = list(query.limit(1).stream())
-                    if docs_exist:
-                        l_codigo = docs_exist[0].id
-                        localidad_ids[clave_localidad] = l_codigo
-                    else:
-                        l_codigo = f"{localidad_counter:04d}"
-                        localidad_counter += 1
-                        batch.set(
-                            db.collection("localidades").document(l_codigo),
-                            {"codigo": l_codigo, "nombre": municipio_name, "provincia_codigo": p_codigo},
-                            merge=True,
-                        )
-                        localidad_ids[clave_localidad] = l_codigo
+            if r["raw_municipio"]:
+                l_codigo = lugares.localidad(municipio_name, p_codigo)
+                if l_codigo is None:
+                    l_codigo = f"{ids_localidades.siguiente():04d}"
+                    escritor.set(
+                        db.collection("localidades").document(l_codigo),
+                        {"codigo": l_codigo, "nombre": municipio_name, "provincia_codigo": p_codigo},
+                        merge=True,
+                    )
+                    lugares.registrar_localidad(municipio_name, p_codigo, l_codigo)
 
                 tiene_municipio = True
             else:
                 print(f"[ERROR] Registro {i}: MUNICIPIO vacío; no se crea localidad ni estación.")
-                municipio_name = ""
                 l_codigo = ""
                 tiene_municipio = False
 
             # ESTACIÓN
-            if raw_cod_estacion == "N/A" or not raw_cod_estacion:
+            if r["raw_cod_estacion"] == "N/A" or not r["raw_cod_estacion"]:
                 print(f"[WARN] Registro {i}: sin Nº ESTACIÓN válido; se omite.")
-                continue
+                return
 
-            if omitir_geocodificacion:
-                latitud = ""
-                longitud = ""
-            else:
-                latitud, longitud = geocodificar(raw_direccion, municipio_name, cp_str)
+            latitud, longitud = coords
 
-            tipo = mapear_tipo(get_first(registro, ["TIPO ESTACIÓN", "TIPO ESTACION", "TIPO ESTACI?N"], "") or "")
+            tipo = mapear_tipo(get_first(r["registro"], ["TIPO ESTACIÓN", "TIPO ESTACION", "TIPO ESTACI?N"], "") or "")
 
             if not provincia_name:
                 print(f"[WARN] Registro {i}: Se omite por falta de PROVINCIA.")
-                continue
+                return
 
             if not tiene_municipio:
                 print(f"[WARN] Registro {i}: Se omite por falta de MUNICIPIO.")
-                continue
+                return
 
             # cp_valido se calculó arriba en tu script
             if not cp_valido or not cp_str:
                 print(f"[WARN] Registro {i}: Se omite por falta de CÓDIGO POSTAL válido.")
-                continue
+                return
 
             tiene_coords = (latitud not in ["0", ""] and longitud not in ["0", ""])
 
             if tipo != "Estación_movil" and not tiene_coords:
                 print(f"[WARN] Registro {i}: Se omite estación FIJA ({tipo}) sin coordenadas.")
-                continue
+                return
 
-            if not tiene_municipio:
-                nombre_estacion = ""
-                descripcion_estacion = ""
-            else:
-                nombre_estacion = f"Estación de {municipio_name}"
-                descripcion_estacion = f"ITV en {municipio_name}. Revisión anual."
+            nombre_estacion = f"Estación de {municipio_name}"
+            descripcion_estacion = f"ITV en {municipio_name}. Revisión anual."
 
-                if nombre_estacion in nombres_existentes:
-                    print(f"[SKIP] Datos repetidos (ya en BD): {nombre_estacion}")
-                    continue
+            if nombre_estacion in nombres_existentes:
+                print(f"[SKIP] Datos repetidos (ya en BD): {nombre_estacion}")
+                return
 
-            cod_estacion = f"{estacion_counter:05d}"
-            estacion_counter += 1
+            cod_estacion = f"{ids_estaciones.siguiente():05d}"
 
-            batch.set(
+            escritor.set(
                 db.collection("estaciones").document(cod_estacion),
                 {
                     "cod_estacion": cod_estacion,
                     "nombre": nombre_estacion,
-                    "direccion": raw_direccion,
+                    "direccion": r["raw_direccion"],
                     "codigo_postal": cp_str if cp_valido else "",
                     "longitud": longitud,
                     "latitud": latitud,
                     "tipo": tipo,
                     "descripcion": descripcion_estacion,
-                    "horario": raw_horarios or "Consultar web",
-                    "contacto": raw_correo or "N/A",
+                    "horario": r["raw_horarios"] or "Consultar web",
+                    "contacto": r["raw_correo"] or "N/A",
                     "URL": "Sitval.com",
                     "localidad_codigo": l_codigo,
+                    "provincia_codigo": p_codigo,
                 },
             )
 
             registros_procesados += 1
-            if registros_procesados % 500 == 0:
-                print(f"[INFO] Commit batch... {registros_procesados}")
-                batch.commit()
-                batch = db.batch()
 
+        except ErrorEscritura:
+            raise
         except Exception as e:
-            print(f"[ERROR] Procesando registro {i}: {e}. Datos: {registro}")
-
-    batch.commit()
+            print(f"[ERROR] Procesando registro {i}: {e}. Datos: {r['registro']}")
+
+    # Mientras unos hilos esperan a Nominatim, la escritura ya va resolviendo y confirmando lo anterior
+    stats_pipeline = ejecutar_pipeline(
+        preparar_registros(),
+        geocodificar_registro,
+        escribir_registro,
+        hilos_geocodificacion=GEOCODIFICACION_HILOS,
+        tam_cola=PIPELINE_TAM_COLA,
+    )
+    for linea in formatear_pipeline(stats_pipeline):
+        print(linea)
+
+    reportar_progreso(registros_leidos, registros_leidos, registros_procesados)
+    t_etapa = reportar_etapa("procesado", t_etapa)
+
+    print(formatear_stats(escritor.cerrar()))
+    # Lo que sobró de los bloques de ids vuelve al contador (si nadie ha reservado después)
+    for asignador in (ids_provincias, ids_localidades, ids_estaciones):
+        asignador.liberar()
+    reportar_etapa("commit_final", t_etapa)
+    geo = cache_geo.stats()
+    cache_geo.cerrar()
+    nom = nomenclator.stats() if nomenclator is not None else {"aciertos": 0, "aciertos_cp": 0, "fallos": 0}
+    if nomenclator is not None:
+        nomenclator.cerrar()
+    red = {k: v - nominatim_inicio[k] for k, v in leer_nominatim_stats().items()}
+    print(f"[GEOCODIFICACION] consultas={geo['consultas']} aciertos={geo['aciertos']} "
+          f"fallos_cacheados={geo['fallos_cacheados']} ausentes={geo['ausentes']} ratio_aciertos={geo['ratio_aciertos']} "
+          f"nomenclator={nom['aciertos'] + nom['aciertos_cp']} nomenclator_fallos={nom['fallos']} "
+          f"nominatim={red['peticiones']} nominatim_errores={red['errores']} red={'si' if GEOCODIFICAR_RED else 'no'}")
+    if not registros_leidos:
+        print("[ERROR] No hay datos para procesar.")
+        return
+    # La próxima carga se salta la fuente si el wrapper sigue devolviendo este ETag
+    guardar_etag(db, FUENTE, etag, registros_procesados)
     print(f"[INFO] Carga finalizada. Total {registros_procesados} estaciones.")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Extractor CV: wrapper -> almacén")
+    parser.add_argument("--profile", nargs="?", const="pstats", default=PERFIL, choices=perfilado.FORMATOS,
+                        help="guardar un perfil de la carga en .perfiles/ (por defecto pstats)")
+    main(perfil=parser.parse_args().profile)
@@ -0,0 +1,208 @@
+﻿# CV/nomenclator.py
+"""
+Geocodificación local (sin red) por (código postal, municipio).
+
+La fuente es un CSV versionado (CV/datos/nomenclator_cp.csv: cod_postal;municipio;provincia;lat;lon)
+que se compila a un binario compacto de registros fijos ordenados:
+
+    cabecera  b"NMCL" + versión (uint32) + nº de registros (uint32)
+    registro  cod_postal (uint32) | crc32(municipio normalizado) (uint32) | lat (float32) | lon (float32)
+
+El binario se abre con mmap y se busca por bisección: no hay que parsear nada al cargar
+y cada consulta son unas pocas lecturas de 16 bytes.
+
+Compilar a mano (desde la raíz del proyecto):
+    python CV/nomenclator.py [--csv ruta.csv] [--bin ruta.bin]
+El extractor lo recompila solo si el CSV es más reciente que el binario.
+
+El CSV versionado es solo una muestra (unas 35 filas, CP de municipios con estación; el banco
+de pruebas genera sus CP desde él), así que una carga completa de la CV sin red solo geocodifica esos CP; los
+demás van a la caché y, si ITV_GEOCODIFICAR_RED lo permite, a Nominatim. El CSV completo se
+genera desde los códigos postales de GeoNames (https://download.geonames.org/export/zip/ES.zip,
+fichero ES.txt, licencia CC BY 4.0):
+    python CV/nomenclator.py --geonames ES.txt
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import mmap
+import struct
+import sys
+import threading
+import zlib
+from pathlib import Path
+from typing import Optional
+
+# Al lanzarse como script (python CV/nomenclator.py) la raíz del proyecto no está en sys.path
+PROJECT_ROOT_PATH = str(Path(__file__).resolve().parent.parent)
+if PROJECT_ROOT_PATH not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT_PATH)
+
+from COMUN.indice_lugares import normalizar_nombre
+
+DATOS_DIR = Path(__file__).resolve().parent / "datos"
+NOMENCLATOR_CSV = DATOS_DIR / "nomenclator_cp.csv"
+NOMENCLATOR_BIN = DATOS_DIR / "nomenclator.bin"
+
+# Códigos de provincia (dos primeras cifras del CP) de la Comunitat Valenciana
+PROVINCIAS_CV = {"03": "Alicante", "12": "Castellón", "46": "Valencia"}
+
+MAGIA = b"NMCL"
+VERSION = 1
+CABECERA = struct.Struct("<4sII")
+REGISTRO = struct.Struct("<IIff")
+
+
+def hash_municipio(nombre: str) -> int:
+    return zlib.crc32(normalizar_nombre(nombre).encode("utf-8"))
+
+
+def construir(csv_path: Path | str = NOMENCLATOR_CSV, bin_path: Path | str = NOMENCLATOR_BIN) -> int:
+    """Compila el CSV al binario; devuelve cuántos registros se escribieron (sin duplicados)."""
+    registros: dict[tuple[int, int], tuple[float, float]] = {}
+    with open(csv_path, encoding="utf-8-sig", newline="") as f:
+        for fila in csv.DictReader(f, delimiter=";"):
+            try:
+                cp = int(fila["cod_postal"])
+                clave = (cp, hash_municipio(fila["municipio"]))
+                registros.setdefault(clave, (float(fila["lat"]), float(fila["lon"])))
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    bin_path = Path(bin_path)
+    tmp = bin_path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(CABECERA.pack(MAGIA, VERSION, len(registros)))
+        for (cp, h), (lat, lon) in sorted(registros.items()):
+            f.write(REGISTRO.pack(cp, h, lat, lon))
+    tmp.replace(bin_path)
+    return len(registros)
+
+
+def desde_geonames(txt_path: Path | str, csv_path: Path | str = NOMENCLATOR_CSV) -> int:
+    """
+    Genera el CSV del nomenclátor desde el volcado de CP de GeoNames (ES.txt, separado por
+    tabuladores: país, CP, lugar, ..., admin3 = municipio, ..., lat, lon), solo con los CP de la CV.
+    Cada CP se guarda con el municipio y con el nombre del lugar, y los nombres bilingües
+    ("Alicante/Alacant") con cada variante. Devuelve las filas escritas.
+    """
+    filas = set()
+    with open(txt_path, encoding="utf-8", newline="") as f:
+        for columnas in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            if len(columnas) < 11:
+                continue
+            cp, lugar, municipio, lat, lon = columnas[1], columnas[2], columnas[7], columnas[9], columnas[10]
+            provincia = PROVINCIAS_CV.get(cp[:2])
+            if provincia is None:
+                continue
+            for nombre in {n.strip() for n in f"{municipio}/{lugar}".split("/")} - {""}:
+                filas.add((cp, nombre, provincia, lat, lon))
+
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        escritor = csv.writer(f, delimiter=";")
+        escritor.writerow(["cod_postal", "municipio", "provincia", "lat", "lon"])
+        escritor.writerows(sorted(filas))
+    return len(filas)
+
+
+class Nomenclator:
+    """
+    Índice (cp, municipio) -> (lat, lon) sobre el binario mapeado en memoria.
+    buscar() se llama desde los hilos de geocodificación del pipeline: las lecturas del mmap
+    no cambian nada y los contadores van con lock.
+    """
+
+    def __init__(self, bin_path: Path | str = NOMENCLATOR_BIN):
+        self._f = open(bin_path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magia, version, self.total = CABECERA.unpack_from(self._mm, 0)
+        if magia != MAGIA or version != VERSION:
+            raise ValueError(f"{bin_path} no es un nomenclátor v{VERSION}")
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.aciertos_cp = 0
+        self.fallos = 0
+
+    @classmethod
+    def abrir(cls, csv_path: Path | str = NOMENCLATOR_CSV, bin_path: Path | str = NOMENCLATOR_BIN) -> Optional["Nomenclator"]:
+        """Abre el binario, recompilándolo si falta o es más antiguo que el CSV. None si no hay datos."""
+        csv_path, bin_path = Path(csv_path), Path(bin_path)
+        if csv_path.exists() and (not bin_path.exists() or bin_path.stat().st_mtime < csv_path.stat().st_mtime):
+            construir(csv_path, bin_path)
+        if not bin_path.exists():
+            return None
+        return cls(bin_path)
+
+    def _clave(self, i: int) -> tuple[int, int]:
+        return struct.unpack_from("<II", self._mm, CABECERA.size + i * REGISTRO.size)
+
+    def _primero_desde(self, clave: tuple[int, int]) -> int:
+        """Índice del primer registro con clave >= clave (bisección)."""
+        lo, hi = 0, self.total
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._clave(mid) < clave:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _coords(self, i: int) -> tuple[str, str]:
+        _, _, lat, lon = REGISTRO.unpack_from(self._mm, CABECERA.size + i * REGISTRO.size)
+        # Mismo formato que devuelve Nominatim (texto); float32 da ~1 m de precisión
+        return f"{lat:.5f}", f"{lon:.5f}"
+
+    def buscar(self, municipio: str, cod_postal: str) -> Optional[tuple[str, str]]:
+        """
+        (lat, lon) del municipio; si el nombre no coincide pero el CP es conocido,
+        el del primer municipio con ese CP. None si el CP no está.
+        """
+        try:
+            cp = int(cod_postal)
+        except (TypeError, ValueError):
+            self._contar("fallos")
+            return None
+
+        clave = (cp, hash_municipio(municipio))
+        i = self._primero_desde(clave)
+        if i < self.total and self._clave(i) == clave:
+            self._contar("aciertos")
+            return self._coords(i)
+
+        i = self._primero_desde((cp, 0))
+        if i < self.total and self._clave(i)[0] == cp:
+            self._contar("aciertos_cp")
+            return self._coords(i)
+
+        self._contar("fallos")
+        return None
+
+    def _contar(self, campo: str) -> None:
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"registros": self.total, "aciertos": self.aciertos, "aciertos_cp": self.aciertos_cp, "fallos": self.fallos}
+
+    def cerrar(self) -> None:
+        self._mm.close()
+        self._f.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compila el nomenclátor CSV al binario que usa el extractor CV")
+    parser.add_argument("--csv", default=str(NOMENCLATOR_CSV))
+    parser.add_argument("--bin", default=str(NOMENCLATOR_BIN))
+    parser.add_argument("--geonames", help="ES.txt de GeoNames: regenera antes el CSV con todos los CP de la CV")
+    args = parser.parse_args()
+    if args.geonames:
+        filas = desde_geonames(args.geonames, args.csv)
+        print(f"[INFO] CSV generado desde GeoNames: {filas} filas -> {args.csv}")
+    n = construir(args.csv, args.bin)
+    print(f"[INFO] Nomenclátor compilado: {n} registros -> {args.bin}")
+
+
+if __name__ == "__main__":
+    main()
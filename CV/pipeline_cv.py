@@ -0,0 +1,214 @@
+﻿# CV/pipeline_cv.py
+from __future__ import annotations
+
+import contextvars
+import heapq
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+
+_FIN = object()
+
+
+def _hilo(target: Callable[[], None], nombre: str) -> threading.Thread:
+    """Hilo que hereda el contexto de quien lo crea (p. ej. la salida capturada de la API de carga)."""
+    ctx = contextvars.copy_context()
+    return threading.Thread(target=ctx.run, args=(target,), name=nombre, daemon=True)
+
+
+class CuboTokens:
+    """
+    Cubo de tokens compartido entre hilos: como mucho 'capacidad' llamadas seguidas y,
+    después, 'por_segundo' de media. tomar() solo duerme lo que falte para el siguiente token.
+    """
+
+    def __init__(self, por_segundo: float, capacidad: float = 1.0):
+        self.por_segundo = por_segundo
+        self.capacidad = capacidad
+        self._lock = threading.Lock()
+        self._tokens = capacidad
+        self._ultimo = time.monotonic()
+        self.esperas = 0
+        self.segundos_esperando = 0.0
+
+    def tomar(self) -> None:
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.por_segundo)
+            self._ultimo = ahora
+            # Se reserva el token aunque aún no exista: el siguiente hilo hace cola detrás
+            self._tokens -= 1
+            espera = -self._tokens / self.por_segundo if self._tokens < 0 else 0.0
+            if espera:
+                self.esperas += 1
+                self.segundos_esperando += espera
+        if espera:
+            time.sleep(espera)
+
+
+class ColaMedida:
+    """queue.Queue acotada que apunta su profundidad en cada put (máxima y media)."""
+
+    def __init__(self, nombre: str, maxsize: int):
+        self.nombre = nombre
+        self.maxsize = maxsize
+        self._q: queue.Queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self.profundidad_max = 0
+        self._suma = 0
+        self._muestras = 0
+
+    def put(self, item) -> None:
+        self._q.put(item)
+        n = self._q.qsize()
+        with self._lock:
+            self.profundidad_max = max(self.profundidad_max, n)
+            self._suma += n
+            self._muestras += 1
+
+    def get(self):
+        return self._q.get()
+
+    def stats(self) -> dict:
+        with self._lock:
+            media = self._suma / self._muestras if self._muestras else 0.0
+            return {"cola": self.nombre, "capacidad": self.maxsize, "profundidad_max": self.profundidad_max, "profundidad_media": round(media, 1)}
+
+
+class EstadisticasEtapa:
+    """Elementos y tiempo ocupado de una etapa (sumado entre sus hilos)."""
+
+    def __init__(self, nombre: str, hilos: int = 1):
+        self.nombre = nombre
+        self.hilos = hilos
+        self._lock = threading.Lock()
+        self.elementos = 0
+        self.segundos_ocupada = 0.0
+
+    def anotar(self, segundos: float) -> None:
+        with self._lock:
+            self.elementos += 1
+            self.segundos_ocupada += segundos
+
+    def stats(self, segundos_totales: float) -> dict:
+        with self._lock:
+            return {
+                "etapa": self.nombre,
+                "hilos": self.hilos,
+                "elementos": self.elementos,
+                "ocupada_s": round(self.segundos_ocupada, 3),
+                "por_segundo": round(self.elementos / segundos_totales, 1) if segundos_totales > 0 else 0.0,
+                # 1.0 = todos sus hilos ocupados todo el rato (la etapa es el cuello de botella)
+                "utilizacion": round(self.segundos_ocupada / (segundos_totales * self.hilos), 3) if segundos_totales > 0 else 0.0,
+            }
+
+
+def ejecutar_pipeline(
+    entradas: Iterable[Any],
+    geocodificar: Callable[[Any], Any],
+    escribir: Callable[[Any, Any], None],
+    hilos_geocodificacion: int = 4,
+    tam_cola: int = 64,
+) -> dict:
+    """
+    preparación (este hilo) -> cola -> geocodificación (N hilos) -> cola -> escritura (1 hilo)
+
+    - geocodificar(item) devuelve el resultado para escribir; si lanza, escribir recibe la excepción
+      (y decide si es de ese registro o si tiene que parar todo relanzándola).
+    - escribir(item, resultado) recibe los elementos en el orden de 'entradas' (los ids salen
+      igual que en la versión secuencial); si lanza, el pipeline se detiene y la excepción
+      se relanza aquí cuando todo ha parado.
+    Devuelve las estadísticas de cada etapa y cola.
+    """
+    cola_geo = ColaMedida("geocodificacion", tam_cola)
+    cola_escritura = ColaMedida("escritura", tam_cola)
+    etapa_prep = EstadisticasEtapa("preparacion")
+    etapa_geo = EstadisticasEtapa("geocodificacion", hilos_geocodificacion)
+    etapa_esc = EstadisticasEtapa("escritura")
+    parar = threading.Event()
+    error: list[BaseException] = []
+
+    def trabajador_geo() -> None:
+        while True:
+            elemento = cola_geo.get()
+            if elemento is _FIN:
+                return
+            orden, item = elemento
+            resultado: Any = None
+            if not parar.is_set():
+                t0 = time.perf_counter()
+                try:
+                    resultado = geocodificar(item)
+                except BaseException as e:  # también la cancelación de la carga: la relanza escribir
+                    resultado = e
+                etapa_geo.anotar(time.perf_counter() - t0)
+            cola_escritura.put((orden, item, resultado))
+
+    def trabajador_escritura() -> None:
+        pendientes: list = []   # montículo por orden de llegada a la preparación
+        siguiente = 0
+        while True:
+            elemento = cola_escritura.get()
+            if elemento is _FIN:
+                return
+            heapq.heappush(pendientes, elemento)
+            while pendientes and pendientes[0][0] == siguiente:
+                _, item, resultado = heapq.heappop(pendientes)
+                siguiente += 1
+                if parar.is_set():
+                    continue  # solo se vacía la cola para que nadie se quede bloqueado
+                t0 = time.perf_counter()
+                try:
+                    escribir(item, resultado)
+                except BaseException as e:
+                    error.append(e)
+                    parar.set()
+                etapa_esc.anotar(time.perf_counter() - t0)
+
+    t_inicio = time.perf_counter()
+    geo_hilos = [_hilo(trabajador_geo, f"cv-geo-{n}") for n in range(hilos_geocodificacion)]
+    hilo_esc = _hilo(trabajador_escritura, "cv-escritura")
+    for h in geo_hilos:
+        h.start()
+    hilo_esc.start()
+
+    orden = 0
+    iterador = iter(entradas)
+    try:
+        while not parar.is_set():
+            t0 = time.perf_counter()
+            try:
+                item = next(iterador)
+            except StopIteration:
+                break
+            etapa_prep.anotar(time.perf_counter() - t0)
+            if item is None:
+                continue  # descartado en la preparación (duplicado...)
+            cola_geo.put((orden, item))
+            orden += 1
+    finally:
+        for _ in geo_hilos:
+            cola_geo.put(_FIN)
+        for h in geo_hilos:
+            h.join()
+        cola_escritura.put(_FIN)
+        hilo_esc.join()
+
+    segundos = time.perf_counter() - t_inicio
+    if error:
+        raise error[0]
+    return {
+        "segundos": round(segundos, 3),
+        "etapas": [e.stats(segundos) for e in (etapa_prep, etapa_geo, etapa_esc)],
+        "colas": [cola_geo.stats(), cola_escritura.stats()],
+    }
+
+
+def formatear_pipeline(stats: dict) -> list[str]:
+    """Líneas [PIPELINE] (formato clave=valor, como [ETAPA]/[ESCRITOR])."""
+    lineas = []
+    for bloque in stats["etapas"] + stats["colas"]:
+        lineas.append("[PIPELINE] " + " ".join(f"{k}={v}" for k, v in bloque.items()))
+    return lineas
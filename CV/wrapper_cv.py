@@ -3,39 +3,109 @@ from __future__ import annotations
 
 import json
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
 
 
 
-def leer_cv_json(json_file_path: str | Path) -> list[dict[str, Any]]:
+BLOQUE_LECTURA = 1 << 16   # caracteres leídos del fichero cada vez en iterar_cv_json
+_ESPACIOS = " \t\r\n"
+_MARGEN_CORTE = 32         # caracteres del final del búfer en los que un error puede ser solo un corte
+
+
+def iterar_cv_json(json_file_path: str | Path, bloque: int = BLOQUE_LECTURA) -> Iterator[dict[str, Any]]:
     """
-    Wrapper CV (sin HTTP):
-    - Lee la fuente JSON (estaciones.json).
-    - Devuelve registros RAW (crudos).
-    - NO hace mapping/validaciones semánticas.
-    - NO geocodifica.
-    - NO escribe en Firestore.
+    Wrapper CV (sin HTTP), en streaming:
+    - Lee la fuente JSON (estaciones.json), que es una lista, elemento a elemento:
+      en memoria solo hay un bloque del fichero y el registro actual.
+    - Devuelve (yield) registros RAW (crudos); si la raíz no es una lista no devuelve nada.
+    - Si el JSON está mal formado lanza json.JSONDecodeError (leer_cv_json lo convierte en []).
+    - NO hace mapping/validaciones semánticas, NO geocodifica, NO escribe en Firestore.
     """
     path = Path(json_file_path)
 
     if not path.exists():
-        return []
+        return
 
+    decoder = json.JSONDecoder()
+    with path.open("r", encoding="utf-8") as f:
+        buf, pos, eof = "", 0, False
+        # inicio: antes del '['; valor_o_cierre: tras el '['; valor: tras una ','
+        # separador: tras un elemento (',' o ']'); fin: tras el ']' (solo espacios hasta EOF)
+        espera = "inicio"
 
+        def rellenar() -> None:
+            """Descarta lo ya consumido del búfer y añade el siguiente bloque del fichero."""
+            nonlocal buf, pos, eof
+            trozo = f.read(bloque)
+            eof = not trozo
+            buf, pos = buf[pos:] + trozo, 0
 
-    try:
-        with path.open("r", encoding="utf-8") as f:
-            data = json.load(f)
+        def cerca_del_final(i: int) -> bool:
+            # Un elemento cortado por el bloque da error (o un número incompleto: "1." o "1e")
+            # en los últimos caracteres del búfer; más atrás es un error de sintaxis de verdad
+            return not eof and i >= len(buf) - _MARGEN_CORTE
 
-        # Aseguramos que sea lista (según tu script original, data_cv se itera como lista).
-        if isinstance(data, list):
-            return data
+        while True:
+            while pos < len(buf) and buf[pos] in _ESPACIOS:
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    if espera in ("inicio", "fin"):
+                        return
+                    raise json.JSONDecodeError("Lista sin cerrar", buf, pos)
+                rellenar()
+                continue
 
-        # Si viniera como objeto { "data": [...] } u otra estructura, lo adaptáis aquí.
-        return []
-
-    except json.JSONDecodeError:
-        return []
+            c = buf[pos]
+            if espera == "inicio":
+                if c != "[":
+                    return  # como antes: solo se aceptan listas
+                espera = "valor_o_cierre"
+                pos += 1
+                continue
+            if espera == "fin":
+                raise json.JSONDecodeError("Extra data", buf, pos)
+            if espera == "separador":
+                if c == ",":
+                    espera = "valor"
+                elif c == "]":
+                    espera = "fin"
+                else:
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+                pos += 1
+                continue
+            if c == "]" and espera == "valor_o_cierre":
+                espera = "fin"
+                pos += 1
+                continue
+            if c in ",]":
+                raise json.JSONDecodeError("Expecting value", buf, pos)
 
+            try:
+                registro, fin = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if cerca_del_final(e.pos) or (not eof and e.msg.startswith("Unterminated string")):
+                    rellenar()  # el elemento sigue en el siguiente bloque
+                    continue
+                raise
+            if cerca_del_final(fin):
+                rellenar()  # un número al final del bloque podría seguir en el siguiente
+                continue
+            pos = fin
+            espera = "separador"
+            yield registro
 
 
+def leer_cv_json(json_file_path: str | Path) -> list[dict[str, Any]]:
+    """
+    Wrapper CV (sin HTTP):
+    - Lee la fuente JSON (estaciones.json).
+    - Devuelve registros RAW (crudos).
+    - NO hace mapping/validaciones semánticas.
+    - NO geocodifica.
+    - NO escribe en Firestore.
+    """
+    try:
+        return list(iterar_cv_json(json_file_path))
+    except json.JSONDecodeError:
+        return []
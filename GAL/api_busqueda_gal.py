@@ -1,19 +1,31 @@
 ﻿# src/gal/api_busqueda_gal.py
 from __future__ import annotations
 
+from itertools import islice
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 
-from .wrapper_gal import leer_gal_csv
+from COMUN import columnar, ndjson, perfilado
+from COMUN.cache_fuentes import CacheFuente, etag_coincide
+
+from .wrapper_gal import iterar_gal_csv, leer_gal_csv
 
 app = FastAPI(
     title="Wrapper GAL - API de búsqueda",
     version="1.0.0",
     description="Expone datos crudos de la fuente GAL (CSV) para que los consuma el extractor.",
 )  # FastAPI básico: instancia + decoradores @app.get(...) [web:57]
+# X-Perfil: 1 -> perfil de la petición; GET /profiles (COMUN/perfilado.py)
+perfilado.instalar(app, "gal")
+# Los endpoints de datos van en un router para poder montarlos también en el gateway
+# (GATEWAY/api_gateway.py), que sirve las tres fuentes desde un solo proceso
+router = APIRouter(tags=["GAL"])
 
 # Ajusta esta ruta según dónde tengas el CSV en tu proyecto
 CSV_FILE = Path("Estacions_ITV.csv")
+# Registros ya parseados; se vuelve a leer el fichero solo si cambia (y el ETag con él)
+cache_csv = CacheFuente(CSV_FILE, leer_gal_csv)
 
 
 
@@ -30,18 +42,38 @@ def health():
         "status": "ok",
         "csv_exists": CSV_FILE.exists(),
         "csv_path": str(CSV_FILE.resolve()),
+        "cache": cache_csv.stats(),
     }
 
 
-@app.get("/gal/records")
+def respuesta_columnar(if_none_match: str | None) -> Response:
+    datos, etag = cache_csv.obtener_columnar()
+    if not etag:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No se pudieron leer registros. ¿Existe el CSV en {CSV_FILE.resolve()}?",
+        )
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=datos, media_type=columnar.MEDIA_TYPE, headers={"ETag": etag})
+
+
+@router.get("/gal/records")
 def gal_records(
+    response: Response,
+    if_none_match: str | None = Header(default=None),
+    accept: str | None = Header(default=None),
     limit: int | None = Query(default=None, ge=1, le=20000),
 ):
     """
     Devuelve los registros raw (tal cual salen del CSV).
     - limit es opcional para no devolver miles de filas durante pruebas.
     """
-    records = leer_gal_csv(CSV_FILE)
+    # Accept: application/x-msgpack -> instantánea columnar de toda la fuente (cacheada en disco)
+    if columnar.pedido(accept) and not limit:
+        return respuesta_columnar(if_none_match)
+
+    records, etag = cache_csv.obtener()
 
     if not records:
         raise HTTPException(
@@ -49,9 +81,43 @@ def gal_records(
             detail=f"No se pudieron leer registros. ¿Existe el CSV en {CSV_FILE.resolve()}?",
         )
 
+    # Sin cambios desde la versión que ya tiene el cliente: ni se serializa ni se envía nada
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
     return records[:limit] if limit else records
 
 
+@router.get("/gal/records/stream")
+def gal_records_stream(
+    if_none_match: str | None = Header(default=None),
+    limit: int | None = Query(default=None, ge=1),
+):
+    """
+    Los mismos registros RAW en NDJSON (un JSON por línea), enviados según se leen del CSV:
+    ni el wrapper ni el extractor tienen nunca la lista entera en memoria.
+    - ETag / If-None-Match igual que /gal/records (304 si no ha cambiado).
+    - X-Total-Count solo si ya se sabe sin leer el fichero (la caché tiene ese mismo contenido).
+    """
+    if not CSV_FILE.exists():
+        raise HTTPException(
+            status_code=404,
+            detail=f"No se pudieron leer registros. ¿Existe el CSV en {CSV_FILE.resolve()}?",
+        )
+
+    etag, total = cache_csv.etag_sin_parsear()
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
 
+    headers = {"ETag": etag}
+    if total is not None:
+        headers["X-Total-Count"] = str(total)
+    registros = iterar_gal_csv(CSV_FILE)
+    if limit:
+        registros = islice(registros, limit)
+    return StreamingResponse(ndjson.codificar(registros), media_type=ndjson.MEDIA_TYPE, headers=headers)
 
 
+# Al final: include_router copia las rutas que el router tenga en este momento
+app.include_router(router)
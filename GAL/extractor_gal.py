@@ -1,18 +1,38 @@
 ﻿# src/gal/extractor_gal.py
 from __future__ import annotations
 
+import argparse
+import os
 import re
-import requests
-
-import firebase_admin
-from firebase_admin import credentials, firestore
-from google.cloud.firestore_v1.base_query import FieldFilter
+import sys
+import time
+from pathlib import Path
+from typing import Iterator
+
+# Al lanzarse como script (python GAL/extractor_gal.py) la raíz del proyecto no está en sys.path
+PROJECT_ROOT_PATH = str(Path(__file__).resolve().parent.parent)
+if PROJECT_ROOT_PATH not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT_PATH)
+
+from COMUN import almacen, columnar, ndjson, perfilado
+from COMUN.cargas import guardar_etag, leer_etag
+from COMUN.contadores import AsignadorIds
+from COMUN.escritor import ErrorEscritura, crear_escritor, formatear_stats
+from COMUN.indice_lugares import IndiceLugares
+from COMUN.progreso import reportar_etapa, reportar_progreso
 
 # =========================
 # Config del extractor
 # =========================
-GAL_API_BASE = "http://127.0.0.1:8030"  # donde levantes api_busqueda_gal.py
+# Donde levantes api_busqueda_gal.py (o el gateway: ITV_GAL_API_BASE=http://127.0.0.1:8060)
+GAL_API_BASE = os.environ.get("ITV_GAL_API_BASE", "http://127.0.0.1:8030")
 GAL_RECORDS_URL = f"{GAL_API_BASE}/gal/records"
+GAL_STREAM_URL = f"{GAL_API_BASE}/gal/records/stream"
+FUENTE = "GAL"
+# ITV_FORZAR_CARGA=1: cargar aunque la fuente no haya cambiado (la API de carga lo pone con force=true)
+FORZAR_CARGA = os.environ.get("ITV_FORZAR_CARGA") == "1"
+# ITV_PERFIL=pstats|collapsed (o --profile): perfil de main() en .perfiles/ (COMUN/perfilado.py)
+PERFIL = os.environ.get("ITV_PERFIL") or None
 
 CREDENTIALS_FILE = "iei-proyecto-firebase-adminsdk-fbsvc-04d774ba06.json"
 
@@ -37,19 +57,6 @@ def generar_descripcion(nombre: str, concello: str | None, provincia: str | None
     return f"Estación de ITV {nombre} ubicada en {concello_str} ({provincia_str})."
 
 
-def get_starting_counter(db, collection_name: str) -> int:
-    """Devuelve el siguiente ID numérico libre en una colección."""
-    docs = db.collection(collection_name).stream()
-    max_id = 0
-    for doc in docs:
-        try:
-            num = int(doc.id)
-            if num > max_id:
-                max_id = num
-        except ValueError:
-            pass
-    return max_id + 1
-
 def get_existing_names(db, collection_name: str) -> set[str]:
     """Devuelve un conjunto (set) con los nombres de las estaciones que ya existen en la BD."""
     existing = set()
@@ -139,10 +146,14 @@ def parse_coord_gmaps(coord_str: str):
 # =========================
 # 1) Obtener datos raw desde la API del wrapper
 # =========================
-def obtener_registros_raw() -> list[dict]:
-    resp = requests.get(GAL_RECORDS_URL, timeout=60)
-    resp.raise_for_status()
-    return resp.json()
+def obtener_registros_raw(etag_previo: str | None = None) -> tuple[Iterator[dict] | None, int | None, str]:
+    """
+    (registros, total, etag) del NDJSON del wrapper: los registros se van leyendo según se procesan.
+    registros=None si el wrapper responde 304 (sin cambios desde etag_previo); total=None si no lo anuncia.
+    """
+    if columnar.ACTIVO:  # ITV_TRANSPORTE=columnar: toda la fuente de una vez, por columnas
+        return columnar.pedir(GAL_RECORDS_URL, etag_previo)
+    return ndjson.pedir(GAL_STREAM_URL, etag_previo)
 
 
 # =========================
@@ -150,44 +161,60 @@ def obtener_registros_raw() -> list[dict]:
 # =========================
 def init_firestore():
     """
-    Inicializa Firestore.
-    Nota: firebase_admin.initialize_app() solo debe llamarse una vez por proceso.
+    Inicializa el almacén: Firestore o, con ITV_ALMACEN=sqlite, el SQLite local.
+    Nota: firebase_admin.initialize_app() solo se llama una vez por proceso (COMUN/almacen.py).
     """
-    if not firebase_admin._apps:
-        cred = credentials.Certificate(CREDENTIALS_FILE)
-        firebase_admin.initialize_app(cred)
-    return firestore.client()
+    return almacen.abrir(CREDENTIALS_FILE)
 
 
-def main():
-    print("[INFO] Extractor GAL: pidiendo registros al wrapper...")
-    data_gal = obtener_registros_raw()
-
-    if not data_gal:
-        print("[ERROR] No hay datos para procesar.")
-        return
+def main(db=None, modo_escritor: str | None = None, forzar: bool = FORZAR_CARGA, perfil: str | None = PERFIL):
+    """
+    db: cliente ya abierto (la API de carga reutiliza el suyo); None = conectar aquí.
+    modo_escritor: "concurrente" o "serie"; None = ITV_ESCRITOR (por defecto concurrente).
+    forzar: cargar aunque la fuente no haya cambiado desde la última carga (ETag).
+    perfil: "pstats" (cProfile) o "collapsed" (muestreo); None = sin perfil.
+    """
+    if perfil:
+        with perfilado.perfilar("extractor_gal", perfil):
+            return main(db, modo_escritor, forzar, perfil=None)
 
+    t_etapa = time.perf_counter()
     print("[INFO] Conectando a Firestore...")
-    db = init_firestore()
+    if db is None:
+        db = init_firestore()
     print("[INFO] Conexión a Firebase exitosa.")
+    t_etapa = reportar_etapa("conexion_firestore", t_etapa)
 
-    batch = db.batch()
+    print("[INFO] Extractor GAL: pidiendo registros al wrapper...")
+    data_gal, total_registros, etag = obtener_registros_raw(None if forzar else leer_etag(db, FUENTE))
+    t_etapa = reportar_etapa("obtener_registros", t_etapa)
+
+    if data_gal is None:
+        print(f"[INFO] La fuente GAL no ha cambiado desde la última carga ({etag}); no hay nada que cargar.")
+        return
+
+    escritor = crear_escritor(db, modo_escritor)
     registros_procesados = 0
+    registros_leidos = 0
 
-    provincia_ids = {}
-    localidad_ids = {}
     estaciones_por_concello = {}
     nombre_est_vistos = {}
 
-    provincia_counter = get_starting_counter(db, "provincias")
-    localidad_counter = get_starting_counter(db, "localidades")
-    estacion_counter = get_starting_counter(db, "estaciones")
+    # Ids alquilados por bloques al contador compartido: sin recorrer colecciones y
+    # seguro aunque otro extractor cargue a la vez
+    ids_provincias = AsignadorIds(db, "provincias")
+    ids_localidades = AsignadorIds(db, "localidades")
+    ids_estaciones = AsignadorIds(db, "estaciones")
     nombres_existentes = get_existing_names(db, "estaciones")
-    print(f"[INFO] Procesando {len(data_gal)} registros raw...")
-
-    print(f"[INFO] Procesando {len(data_gal)} registros raw...")
+    t_etapa = reportar_etapa("nombres_existentes", t_etapa)
+    # Provincias y localidades de una vez: 2 consultas en lugar de una por concello nuevo
+    lugares = IndiceLugares().cargar(db)
+    t_etapa = reportar_etapa("indice_lugares", t_etapa)
+    print("[INFO] Procesando registros raw según llegan del wrapper...")
 
     for i, registro in enumerate(data_gal, start=1):
+        registros_leidos = i
+        reportar_progreso(i - 1, total_registros, registros_procesados)
         try:
             # ===== Lectura y normalización básica =====
             raw_provincia = (registro.get("PROVINCIA") or "").strip()
@@ -233,27 +260,15 @@ def main():
 
             # ===== Provincia: creación / reutilización =====
             if provincia_nombre is not None:
-                if provincia_nombre in provincia_ids:
-                    p_codigo = provincia_ids[provincia_nombre]
-                else:
-                    docs_prov = list(
-                        db.collection("provincias")
-                        .where(filter=FieldFilter("nombre", "==", provincia_nombre))
-                        .limit(1)
-                        .stream()
+                p_codigo = lugares.provincia(provincia_nombre)
+                if p_codigo is None:
+                    p_codigo = f"{ids_provincias.siguiente():04d}"
+                    escritor.set(
+                        db.collection("provincias").document(p_codigo),
+                        {"codigo": p_codigo, "nombre": provincia_nombre},
+                        merge=True,
                     )
-                    if docs_prov:
-                        p_codigo = docs_prov[0].id
-                        provincia_ids[provincia_nombre] = p_codigo
-                    else:
-                        p_codigo = f"{provincia_counter:04d}"
-                        provincia_counter += 1
-                        batch.set(
-                            db.collection("provincias").document(p_codigo),
-                            {"codigo": p_codigo, "nombre": provincia_nombre},
-                            merge=True,
-                        )
-                        provincia_ids[provincia_nombre] = p_codigo
+                    lugares.registrar_provincia(provincia_nombre, p_codigo)
             else:
                 p_codigo = ""
 
@@ -267,27 +282,15 @@ def main():
 
             # ===== Localidad (concello) =====
             if concello_norm:
-                if concello_norm in localidad_ids:
-                    l_codigo = localidad_ids[concello_norm]
-                else:
-                    docs_loc = list(
-                        db.collection("localidades")
-                        .where(filter=FieldFilter("nombre", "==", concello_norm))
-                        .limit(1)
-                        .stream()
+                l_codigo = lugares.localidad(concello_norm, p_codigo)
+                if l_codigo is None:
+                    l_codigo = f"{ids_localidades.siguiente():04d}"
+                    escritor.set(
+                        db.collection("localidades").document(l_codigo),
+                        {"codigo": l_codigo, "nombre": concello_norm, "provincia_codigo": p_codigo},
+                        merge=True,
                     )
-                    if docs_loc:
-                        l_codigo = docs_loc[0].id
-                        localidad_ids[concello_norm] = l_codigo
-                    else:
-                        l_codigo = f"{localidad_counter:04d}"
-                        localidad_counter += 1
-                        batch.set(
-                            db.collection("localidades").document(l_codigo),
-                            {"codigo": l_codigo, "nombre": concello_norm, "provincia_codigo": p_codigo},
-                            merge=True,
-                        )
-                        localidad_ids[concello_norm] = l_codigo
+                    lugares.registrar_localidad(concello_norm, p_codigo, l_codigo)
                 tiene_concello = True
             else:
                 print(f"[ERROR] Registro {i}: CONCELLO vacío; no se crea localidad ni estación.")
@@ -341,8 +344,7 @@ def main():
                  print(f"[WARN] Registro {i}: Se omite estación FIJA sin coordenadas válidas.")
                  continue
 
-            cod_estacion = f"{estacion_counter:05d}"
-            estacion_counter += 1
+            cod_estacion = f"{ids_estaciones.siguiente():05d}"
 
             estacion_data = {
                 "nombre": nombre_estacion,
@@ -357,27 +359,36 @@ def main():
                 "contacto": raw_correo or "N/A",
                 "URL": raw_url,
                 "localidad_codigo": l_codigo,
+                "provincia_codigo": p_codigo,
             }
 
-            batch.set(db.collection("estaciones").document(cod_estacion), estacion_data)
+            escritor.set(db.collection("estaciones").document(cod_estacion), estacion_data)
 
             registros_procesados += 1
-            if registros_procesados % 500 == 0:
-                print(f"[INFO] Commit batch... {registros_procesados} registros")
-                batch.commit()
-                batch = db.batch()
 
+        except ErrorEscritura:
+            raise
         except Exception as e:
             print(f"[ERROR] Registro {i}: {e}. Datos: {registro}")
 
-    batch.commit()
+    reportar_progreso(registros_leidos, registros_leidos, registros_procesados)
+    t_etapa = reportar_etapa("procesado", t_etapa)
+
+    print(formatear_stats(escritor.cerrar()))
+    # Lo que sobró de los bloques de ids vuelve al contador (si nadie ha reservado después)
+    for asignador in (ids_provincias, ids_localidades, ids_estaciones):
+        asignador.liberar()
+    reportar_etapa("commit_final", t_etapa)
+    if not registros_leidos:
+        print("[ERROR] No hay datos para procesar.")
+        return
+    # La próxima carga se salta la fuente si el wrapper sigue devolviendo este ETag
+    guardar_etag(db, FUENTE, etag, registros_procesados)
     print(f"[INFO] Carga finalizada. Total: {registros_procesados} estaciones.")
 
 
 if __name__ == "__main__":
-    main()
-
-
-
-
-
+    parser = argparse.ArgumentParser(description="Extractor GAL: wrapper -> almacén")
+    parser.add_argument("--profile", nargs="?", const="pstats", default=PERFIL, choices=perfilado.FORMATOS,
+                        help="guardar un perfil de la carga en .perfiles/ (por defecto pstats)")
+    main(perfil=parser.parse_args().profile)
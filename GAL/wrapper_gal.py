@@ -3,26 +3,24 @@ from __future__ import annotations
 
 import csv
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
 
 
 
 
 
-def leer_gal_csv(csv_file_path: str | Path, delimiter: str = ";") -> list[dict[str, Any]]:
+def iterar_gal_csv(csv_file_path: str | Path, delimiter: str = ";") -> Iterator[dict[str, Any]]:
     """
-    Wrapper GAL (sin HTTP):
-    - Lee el CSV de Galicia.
-    - Devuelve registros 'crudos' (raw) como lista de dicts.
+    Wrapper GAL (sin HTTP), en streaming:
+    - Lee el CSV de Galicia fila a fila.
+    - Devuelve (yield) registros 'crudos' (raw) según se leen; en memoria solo hay la fila actual.
     - NO hace mapping semántico, NO valida lógica de negocio, NO carga en Firestore.
     """
     csv_path = Path(csv_file_path)
 
     if not csv_path.exists():
-        # En vez de print, aquí devolvemos [] y la API decidirá qué error HTTP devolver.
-        return []
-
-    data: list[dict[str, Any]] = []
+        # No se emite nada y la API decidirá qué error HTTP devolver.
+        return
 
     # utf-8-sig ayuda si el CSV viene con BOM.
     with csv_path.open(mode="r", encoding="utf-8-sig", newline="") as file:
@@ -39,11 +37,9 @@ def leer_gal_csv(csv_file_path: str | Path, delimiter: str = ";") -> list[dict[s
                 v = value.strip() if isinstance(value, str) else (value or "")
                 cleaned_row[k] = v
 
-            data.append(cleaned_row)
-
-    return data
-
-
-
+            yield cleaned_row
 
 
+def leer_gal_csv(csv_file_path: str | Path, delimiter: str = ";") -> list[dict[str, Any]]:
+    """Igual que iterar_gal_csv pero como lista ([] si no existe el CSV)."""
+    return list(iterar_gal_csv(csv_file_path, delimiter))
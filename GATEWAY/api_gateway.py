@@ -0,0 +1,93 @@
+﻿# GATEWAY/api_gateway.py
+"""
+Gateway de los wrappers: GAL, CAT y CV en un solo proceso (opcional).
+
+Monta los routers de GAL/api_busqueda_gal.py, CAT/api_busqueda_cat.py y CV/api_busqueda_cv.py
+con las mismas rutas (/gal/records, /cat/records/stream, /cv/records...), así que los extractores
+solo tienen que apuntar aquí (ITV_GAL_API_BASE, ITV_CAT_API_BASE e ITV_CV_API_BASE).
+Un solo intérprete, una caché de fuentes por proceso y un solo pool de hilos, en lugar de
+tres procesos uvicorn con sus propios runtimes.
+
+Lanzar (desde la raíz del proyecto, como los wrappers):
+    python GATEWAY/api_gateway.py [--port 8060] [--workers 2]
+    python -m uvicorn GATEWAY.api_gateway:app --port 8060 --workers 2
+o con el lanzador: python start_all.py --gateway
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from anyio import to_thread
+from fastapi import FastAPI
+
+# Al lanzarse como script (python GATEWAY/api_gateway.py) la raíz del proyecto no está en sys.path
+PROJECT_ROOT_PATH = str(Path(__file__).resolve().parent.parent)
+if PROJECT_ROOT_PATH not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT_PATH)
+
+from CAT import api_busqueda_cat
+from COMUN import perfilado
+from CV import api_busqueda_cv
+from GAL import api_busqueda_gal
+
+GATEWAY_PUERTO = 8060
+# Hilos del pool donde FastAPI ejecuta los endpoints síncronos (lectura de fuentes, serialización)
+GATEWAY_HILOS = int(os.environ.get("ITV_GATEWAY_HILOS", "16"))
+
+WRAPPERS = {
+    "GAL": api_busqueda_gal,
+    "CAT": api_busqueda_cat,
+    "CV": api_busqueda_cv,
+}
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    to_thread.current_default_thread_limiter().total_tokens = GATEWAY_HILOS
+    yield
+
+
+app = FastAPI(
+    title="Gateway de wrappers (GAL, CAT, CV)",
+    version="1.0.0",
+    description="Las tres APIs de datos crudos en un solo proceso, con las mismas rutas que por separado.",
+    lifespan=lifespan,
+)
+
+for modulo in WRAPPERS.values():
+    app.include_router(modulo.router)
+# X-Perfil: 1 -> perfil de la petición; GET /profiles (COMUN/perfilado.py)
+perfilado.instalar(app, "gateway")
+
+
+@app.get("/health")
+def health():
+    """Salud de cada fuente (lo mismo que su /health por separado) y del proceso."""
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "hilos": GATEWAY_HILOS,
+        "fuentes": {fuente: modulo.health() for fuente, modulo in WRAPPERS.items()},
+    }
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Gateway de los wrappers GAL, CAT y CV")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=GATEWAY_PUERTO)
+    parser.add_argument("--workers", type=int, default=1, help="procesos uvicorn (cada uno con su caché en memoria)")
+    args = parser.parse_args()
+
+    # Los wrappers buscan sus ficheros relativos al directorio actual: se lanza desde la raíz
+    os.chdir(PROJECT_ROOT_PATH)
+    uvicorn.run("GATEWAY.api_gateway:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
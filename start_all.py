@@ -0,0 +1,126 @@
+﻿# start_all.py
+"""
+Lanzador multiplataforma (lo mismo que start_all.ps1, sin PowerShell):
+
+- API de carga (8010) y API de búsqueda (8020).
+- Wrappers: por separado en 8030/8040/8050 o, con --gateway, los tres en un solo
+  proceso (GATEWAY/api_gateway.py, 8060). En ese caso la API de carga recibe
+  ITV_GAL_API_BASE/ITV_CAT_API_BASE/ITV_CV_API_BASE apuntando al gateway.
+- Servidor estático de la carpeta UI (5500) y, si no se pide lo contrario, las dos interfaces en el navegador.
+
+Uso (desde cualquier sitio):
+    python start_all.py [--gateway] [--workers 2] [--reload] [--sin-navegador]
+Ctrl+C para todos los servicios.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import webbrowser
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+UI_DIR = ROOT / "UI"
+HOST = "127.0.0.1"
+
+APIS = [
+    ("API Carga", "CARGA.api_carga:app", 8010),
+    ("API Busqueda ITV", "BUSQUEDA.api_busqueda_itv:app", 8020),
+]
+WRAPPERS = [
+    ("API Busqueda GAL", "GAL.api_busqueda_gal:app", 8030, "ITV_GAL_API_BASE"),
+    ("API Busqueda CAT", "CAT.api_busqueda_cat:app", 8040, "ITV_CAT_API_BASE"),
+    ("API Busqueda CV", "CV.api_busqueda_cv:app", 8050, "ITV_CV_API_BASE"),
+]
+GATEWAY = ("Gateway wrappers", "GATEWAY.api_gateway:app", 8060)
+UI_PUERTO = 5500
+ESPERA_MAX_SEGUNDOS = 60
+
+
+def comando_uvicorn(app: str, puerto: int, reload: bool, workers: int = 1) -> list[str]:
+    cmd = [sys.executable, "-m", "uvicorn", app, "--host", HOST, "--port", str(puerto)]
+    if reload:
+        cmd.append("--reload")   # incompatible con varios workers: uvicorn lo ignora
+    elif workers > 1:
+        cmd += ["--workers", str(workers)]
+    return cmd
+
+
+def esperar_puerto(puerto: int, proceso: subprocess.Popen, limite: float) -> bool:
+    while time.perf_counter() < limite:
+        if proceso.poll() is not None:
+            return False
+        try:
+            with socket.create_connection((HOST, puerto), timeout=0.2):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Arranca las APIs, los wrappers (o el gateway) y la UI")
+    parser.add_argument("--gateway", action="store_true", help="GAL, CAT y CV en un solo proceso (puerto 8060)")
+    parser.add_argument("--workers", type=int, default=1, help="workers del gateway (sin --reload)")
+    parser.add_argument("--reload", action="store_true", help="recargar al cambiar el código (como start_all.ps1)")
+    parser.add_argument("--sin-navegador", action="store_true", help="no abrir las interfaces")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    servicios: list[tuple[str, list[str], int]] = []
+    for nombre, app, puerto in APIS:
+        servicios.append((nombre, comando_uvicorn(app, puerto, args.reload), puerto))
+    if args.gateway:
+        nombre, app, puerto = GATEWAY
+        servicios.append((nombre, comando_uvicorn(app, puerto, args.reload, args.workers), puerto))
+        for *_, variable in WRAPPERS:
+            env[variable] = f"http://{HOST}:{puerto}"
+    else:
+        for nombre, app, puerto, _ in WRAPPERS:
+            servicios.append((nombre, comando_uvicorn(app, puerto, args.reload), puerto))
+    servicios.append(("UI", [sys.executable, "-m", "http.server", str(UI_PUERTO), "--bind", HOST], UI_PUERTO))
+
+    t0 = time.perf_counter()
+    procesos: list[tuple[str, subprocess.Popen, int]] = []
+    try:
+        for nombre, cmd, puerto in servicios:
+            # Los wrappers buscan sus ficheros relativos al directorio actual: todo se lanza desde la raíz
+            cwd = UI_DIR if nombre == "UI" else ROOT
+            procesos.append((nombre, subprocess.Popen(cmd, cwd=str(cwd), env=env), puerto))
+
+        limite = time.perf_counter() + ESPERA_MAX_SEGUNDOS
+        for nombre, proceso, puerto in procesos:
+            if not esperar_puerto(puerto, proceso, limite):
+                raise RuntimeError(f"{nombre} no ha arrancado en el puerto {puerto}")
+            print(f"[INFO] {nombre} ({puerto}) listo a los {time.perf_counter() - t0:.1f} s")
+        print(f"[INFO] {len(procesos)} servicios listos en {time.perf_counter() - t0:.1f} s. Ctrl+C para pararlos.")
+
+        if not args.sin_navegador:
+            webbrowser.open(f"http://{HOST}:{UI_PUERTO}/itv_ui.html")
+            webbrowser.open(f"http://{HOST}:{UI_PUERTO}/carga_ui.html")
+
+        while all(p.poll() is None for _, p, _ in procesos):
+            time.sleep(0.5)
+        caido = next(n for n, p, _ in procesos if p.poll() is not None)
+        print(f"[ERROR] {caido} ha terminado; se paran los demás.")
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        print(f"[ERROR] {e}")
+    finally:
+        for _, proceso, _ in procesos:
+            if proceso.poll() is None:
+                proceso.terminate()
+        for _, proceso, _ in procesos:
+            try:
+                proceso.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proceso.kill()
+
+
+if __name__ == "__main__":
+    main()